@@ -13,4 +13,4 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 #
-from quackir._base import IndexType, SearchType, SearchDB
\ No newline at end of file
+from quackir._base import IndexType, SearchType, SearchDB, ANNType, AnalyzerType, UpdateMode, FusionMethod, ScoreNormalization, EmbeddingPrecision, TableInfo
\ No newline at end of file
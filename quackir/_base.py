@@ -15,8 +15,12 @@
 #
 
 from enum import Enum
+from abc import ABC, abstractmethod
 import dotenv
 import argparse
+import resource
+import sys
+import zlib
 import os
 
 class IndexType(Enum):
@@ -33,6 +37,91 @@ class SearchDB(Enum):
     SQLITE = 'sqlite'
     POSTGRES = 'postgres'
 
+class ANNType(Enum):
+    HNSW = 'hnsw'
+    IVFFLAT = 'ivfflat'
+
+class AnalyzerType(Enum):
+    LUCENE = 'lucene'
+    PYTHON = 'python'
+
+class UpdateMode(Enum):
+    APPEND = 'append'
+    UPSERT = 'upsert'
+
+class FusionMethod(Enum):
+    RRF = 'rrf'
+    COMBSUM = 'combsum'
+    COMBMNZ = 'combmnz'
+    WEIGHTED = 'weighted'
+
+class ScoreNormalization(Enum):
+    NONE = 'none'
+    MINMAX = 'minmax'
+    ZSCORE = 'zscore'
+
+class EmbeddingPrecision(Enum):
+    FLOAT64 = 'float64'
+    FLOAT32 = 'float32'
+    FLOAT16 = 'float16'
+    INT8 = 'int8'
+
+# the version stamp of every table, replaced by indexers whenever a table changes, so that cached search results can be told apart
+VERSION_TABLE = "quackir_versions"
+
+class TableInfo:
+    """
+    What searchers and indexers need to know about a table, looked up from the database's catalog.
+
+    Args:
+        index_type (IndexType): Sparse for a table of contents, dense for a table of embeddings.
+        dimension (int): Dimension of the embeddings of a dense table.
+        num_rows (int): Number of rows in the table.
+        has_fts_index (bool): Whether the full text search index of a sparse table has been built.
+        has_ann_index (bool): Whether a dense table has an approximate nearest neighbor index.
+        precision (EmbeddingPrecision): How the embeddings of a dense table are stored.
+    """
+    def __init__(self, index_type: IndexType, dimension: int = None, num_rows: int = 0, has_fts_index=False, has_ann_index=False, precision: EmbeddingPrecision = None):
+        self.index_type = index_type
+        self.dimension = dimension
+        self.num_rows = num_rows
+        self.has_fts_index = has_fts_index
+        self.has_ann_index = has_ann_index
+        self.precision = precision
+
+class TableInfoCache(ABC):
+    """
+    Caches the TableInfo of every table a searcher or indexer touches, so that the catalog is queried once per table
+    instead of on every call. Whatever changes a table invalidates its entry.
+    """
+    def __init__(self):
+        self.table_infos = {}
+
+    def table_info(self, table_name: str) -> TableInfo:
+        info = self.table_infos.get(table_name)
+        if info is None:
+            info = self.describe_table(table_name)
+            self.table_infos[table_name] = info
+        return info
+
+    def invalidate_table_info(self, table_name: str = None):
+        """Forgets what is known about a table, or about every table if none is given."""
+        if table_name is None:
+            self.table_infos.clear()
+        else:
+            self.table_infos.pop(table_name, None)
+
+    @abstractmethod
+    def describe_table(self, table_name: str) -> TableInfo:
+        """Looks up a table in the database's catalog."""
+        pass
+
+def peak_rss_mb(children=False) -> float:
+    """Peak resident set size in megabytes of this process, or of the largest of its terminated child processes."""
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
 def count_lines(filename, open_cmd):
     with open_cmd(filename, 'r') as file:
         return sum(1 for _ in file)
@@ -40,6 +129,29 @@ def count_lines(filename, open_cmd):
 def sanitize_table_name(table_name: str):
     return table_name.replace("-", "_")
 
+def shard_of(doc_id: str, num_shards: int) -> int:
+    """The shard a document belongs to, from a hash of its id that is the same in every process and run."""
+    return zlib.crc32(str(doc_id).encode()) % num_shards
+
+def shard_table_name(table_name: str, shard: int) -> str:
+    return f"{table_name}_shard{shard}"
+
+def shard_db_path(db_path: str, shard: int) -> str:
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_shard{shard}{ext}"
+
+def shard_locations(table_name: str, num_shards: int, db_path: str = None, separate_files=False) -> list:
+    """
+    Where every shard of a sharded index is kept: a table named after the index and the shard in the same database,
+    or with separate_files, a table named after the index in a database file of its own, named after db_path and the shard.
+
+    Returns:
+        list: A (db_path, table_name) tuple per shard.
+    """
+    if separate_files:
+        return [(shard_db_path(db_path, shard), table_name) for shard in range(num_shards)]
+    return [(db_path, shard_table_name(table_name, shard)) for shard in range(num_shards)]
+
 def _add_db_parser_arguments(parser: argparse.ArgumentParser):
     """
     Adds common arguments to the provided parser for database and search configurations.
@@ -14,4 +14,4 @@
 # limitations under the License.
 #
 
-from ._base import tokenize
\ No newline at end of file
+from ._base import tokenize, tokenize_batch, tokenize_chunks, analyzer_process_pool, set_analyzer, get_analyzer, set_analysis_cache, get_analysis_cache, save_analysis_cache, record_analyzed_words, take_analyzed_words, merge_analyzed_words
\ No newline at end of file
@@ -14,62 +14,11 @@
 # limitations under the License.
 #
 
-from ._base import tokenize
-from quackir._base import count_lines
+from ._base import set_analyzer, set_analysis_cache, save_analysis_cache, get_analysis_cache
+from ._files import tokenize_file, tokenize_files, save_tokenized_data
+from quackir._base import AnalyzerType
 import argparse
-import json
 import os
-import gzip
-from tqdm import tqdm 
-    
-def tokenize_tsv_file(input_file, open_cmd, num_lines):
-    tokenized_data = []
-    with open_cmd(input_file, 'rt') as f:
-        for line in tqdm(f, total=num_lines, desc="Processing lines"):
-            parts = line.strip().split('\t')
-            id = parts[0]
-            content = ' '.join(parts[1:])
-            tokenized_data.append({id: tokenize(content)})    
-    return tokenized_data
-
-def tokenize_json_file(input_file, open_cmd, num_lines):
-    tokenized_data = []
-    with open_cmd(input_file, 'rt') as f:
-        for line in tqdm(f, total=num_lines, desc="Processing lines"):
-            obj = json.loads(line.strip())
-            obj_items = list(obj.items())
-            if not obj_items:
-                continue
-            _, id = obj_items[0]
-            if 'title' in obj and 'text' in obj:
-                content = f"{obj['title']} {obj['text']}"
-            elif 'contents' in obj:
-                content = obj['contents']
-            else:
-                content = ' '.join(str(v) for k, v in obj_items[1:])
-            tokenized_data.append({id: tokenize(content)})
-    return tokenized_data
-
-def tokenize_file(filename):
-    open_cmd = open
-    if filename.endswith('.gz'):
-        open_cmd = gzip.open
-    num_lines = count_lines(filename, open_cmd)
-    if '.jsonl' in filename:
-        tokenized_data = tokenize_json_file(filename, open_cmd, num_lines)
-    elif '.tsv' in filename:
-        tokenized_data = tokenize_tsv_file(filename, open_cmd, num_lines)
-    else:
-        return []
-    print(f"Tokenized {len(tokenized_data)} items from {filename}")
-    return tokenized_data
-
-def save_tokenized_data(tokenized_data, output_file):
-    with open(output_file, 'w') as f:
-        for item in tokenized_data:
-            s = json.dumps({"id": list(item.keys())[0], "contents": list(item.values())[0]})
-            f.write(s + '\n')
-    print(f"Tokenized data saved to {output_file}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -77,14 +26,22 @@ if __name__ == "__main__":
                         help="Path to the input file/directory containing text to tokenize.")
     parser.add_argument("--output", type=str, required=True,
                         help="Path to the output file where the tokenized text will be saved.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes to tokenize with, each loading its own analyzer.")
+    parser.add_argument("--analyzer", type=AnalyzerType, choices=list(AnalyzerType), default=AnalyzerType.LUCENE,
+                        help="Analyzer to tokenize with: Pyserini's Lucene analyzer, or its pure Python port that does not start a JVM.")
+    parser.add_argument("--analysis-cache", type=str, default=None,
+                        help="Path to a vocabulary file that caches the analyzed form of every word, loaded if it exists and saved when done.")
     args = parser.parse_args()
+    set_analyzer(args.analyzer)
+    set_analysis_cache(path=args.analysis_cache)
 
-    all_data = []
     if os.path.isdir(args.input):
         with os.scandir(args.input) as entries:
-            for entry in entries:
-                if entry.is_file():
-                    all_data.extend(tokenize_file(entry.path))
+            filenames = sorted(entry.path for entry in entries if entry.is_file())
+        tokenize_files(filenames, args.output, args.workers)
     else:
-        all_data = tokenize_file(args.input)
-    save_tokenized_data(all_data, args.output)
\ No newline at end of file
+        save_tokenized_data(tokenize_file(args.input, args.workers), args.output)
+    print(f"Analysis cache: {get_analysis_cache().info()}")
+    if args.analysis_cache:
+        save_analysis_cache()
\ No newline at end of file
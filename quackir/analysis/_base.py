@@ -14,9 +14,155 @@
 # limitations under the License.
 #
 
-from pyserini.analysis import Analyzer, get_lucene_analyzer
+from quackir._base import AnalyzerType
+from ._cache import AnalysisCache, DEFAULT_CACHE_SIZE
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import multiprocessing
+import os
 
-analyzer = Analyzer(get_lucene_analyzer())
+# read by worker processes too, so that they load the same analyzer as their parent
+ANALYZER_ENV = "QUACKIR_ANALYZER"
+ANALYSIS_CACHE_SIZE_ENV = "QUACKIR_ANALYSIS_CACHE_SIZE"
+ANALYSIS_CACHE_PATH_ENV = "QUACKIR_ANALYSIS_CACHE"
+
+_analyzer = None
+_analysis_cache = None
+
+def set_analyzer(analyzer_type: AnalyzerType):
+    """Selects the analyzer used by tokenize, for this process and any worker processes it starts."""
+    global _analyzer, _analysis_cache
+    os.environ[ANALYZER_ENV] = analyzer_type.value
+    _analyzer = None
+    _analysis_cache = None
+
+def get_analyzer():
+    """Loads the selected analyzer on first use, so that the JVM is only started if sparse tokenization is needed."""
+    global _analyzer
+    if _analyzer is None:
+        analyzer_type = AnalyzerType(os.environ.get(ANALYZER_ENV, AnalyzerType.LUCENE.value))
+        if analyzer_type == AnalyzerType.PYTHON:
+            from ._porter import PorterAnalyzer
+            _analyzer = PorterAnalyzer()
+        else:
+            from pyserini.analysis import Analyzer, get_lucene_analyzer
+            _analyzer = Analyzer(get_lucene_analyzer())
+    return _analyzer
+
+# a token that the analyzer passes through unchanged, used to tell documents apart when analyzing them in one call
+BATCH_SEPARATOR = "qqquackirbatchseparatorqqq"
+
+def set_analysis_cache(max_size=DEFAULT_CACHE_SIZE, path: str = None):
+    """
+    Configures the word level analysis cache, for this process and any worker processes it starts.
+
+    Args:
+        max_size (int): Maximum number of words to cache. 0 disables the cache.
+        path (str): Vocabulary file to load the cache from if it exists, and to save it to with save_analysis_cache.
+    """
+    global _analysis_cache
+    os.environ[ANALYSIS_CACHE_SIZE_ENV] = str(max_size)
+    if path is None:
+        os.environ.pop(ANALYSIS_CACHE_PATH_ENV, None)
+    else:
+        os.environ[ANALYSIS_CACHE_PATH_ENV] = path
+    _analysis_cache = None
+
+def get_analysis_cache() -> AnalysisCache:
+    """Returns the analysis cache of the selected analyzer, creating it and loading its vocabulary file on first use."""
+    global _analysis_cache
+    if _analysis_cache is None:
+        analyzer_name = os.environ.get(ANALYZER_ENV, AnalyzerType.LUCENE.value)
+        max_size = int(os.environ.get(ANALYSIS_CACHE_SIZE_ENV, DEFAULT_CACHE_SIZE))
+        _analysis_cache = AnalysisCache(analyze_batch, max_size, analyzer_name)
+        path = os.environ.get(ANALYSIS_CACHE_PATH_ENV)
+        if path is not None and max_size > 0:
+            _analysis_cache.load(path)
+    return _analysis_cache
+
+def save_analysis_cache(path: str = None):
+    """Saves the cached vocabulary to the given path, or to the path passed to set_analysis_cache."""
+    path = path or os.environ.get(ANALYSIS_CACHE_PATH_ENV)
+    if path is None:
+        raise ValueError("No path to save the analysis cache to.")
+    get_analysis_cache().save(path)
+
+def record_analyzed_words():
+    """
+    Records the words this process analyzes from now on, so that a worker process can hand them back with take_analyzed_words
+    for its parent to merge into its own analysis cache, which is the one saved by save_analysis_cache.
+    """
+    cache = get_analysis_cache()
+    if cache.max_size > 0:
+        cache.record_added()
+
+def take_analyzed_words() -> dict:
+    """Returns the words analyzed since record_analyzed_words or the last call, mapped to their analyzed tokens."""
+    return get_analysis_cache().take_added()
+
+def merge_analyzed_words(words: dict):
+    """Adds words a worker process analyzed to the analysis cache of this process."""
+    cache = get_analysis_cache()
+    if words and cache.max_size > 0:
+        cache.update(words)
+
+def analyze(to_tokenize: str) -> str:
+    return ' '.join(get_analyzer().analyze(to_tokenize))
+
+def analyze_batch(to_tokenize: list) -> list:
+    """Analyzes a list of strings with a single call into the analyzer, bypassing the analysis cache."""
+    if not to_tokenize:
+        return []
+    tokenized = [[]]
+    for token in get_analyzer().analyze(f" {BATCH_SEPARATOR} ".join(to_tokenize)):
+        if token == BATCH_SEPARATOR:
+            tokenized.append([])
+        else:
+            tokenized[-1].append(token)
+    if len(tokenized) != len(to_tokenize):
+        # some string contains the separator itself, so fall back to analyzing them one at a time
+        return [analyze(s) for s in to_tokenize]
+    return [' '.join(tokens) for tokens in tokenized]
 
 def tokenize(to_tokenize: str) -> str:
-    return ' '.join(analyzer.analyze(to_tokenize))
\ No newline at end of file
+    return tokenize_batch([to_tokenize])[0]
+
+def tokenize_batch(to_tokenize: list) -> list:
+    """Tokenizes a list of strings, analyzing the words missing from the analysis cache with a single call into the analyzer."""
+    cache = get_analysis_cache()
+    if cache.max_size <= 0:
+        return analyze_batch(to_tokenize)
+    return cache.tokenize_batch(to_tokenize)
+
+def _tokenize_batch_in_worker(to_tokenize: list) -> tuple:
+    record_analyzed_words()
+    return tokenize_batch(to_tokenize), take_analyzed_words()
+
+def analyzer_process_pool(workers: int) -> ProcessPoolExecutor:
+    """Returns a pool of worker processes for analyzing text, each loading its own analyzer."""
+    # spawn so that every worker starts its own JVM instead of inheriting the parent's
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+def tokenize_chunks(chunks, workers=1):
+    """
+    Tokenizes an iterable of lists of strings, yielding the tokenized lists in the same order.
+    With more than one worker, the lists are tokenized by a pool of processes that each load their own analyzer,
+    with at most two lists per worker in flight so that memory stays bounded. Every worker hands back the words it
+    analyzed with each list, which are merged into the analysis cache of this process.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            yield tokenize_batch(chunk)
+        return
+    with analyzer_process_pool(workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_tokenize_batch_in_worker, chunk))
+            if len(pending) >= 2 * workers:
+                tokenized, analyzed = pending.popleft().result()
+                merge_analyzed_words(analyzed)
+                yield tokenized
+        while pending:
+            tokenized, analyzed = pending.popleft().result()
+            merge_analyzed_words(analyzed)
+            yield tokenized
@@ -0,0 +1,128 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from collections import OrderedDict
+import threading
+import json
+import os
+
+DEFAULT_CACHE_SIZE = 262144
+
+class AnalysisCache:
+    """
+    A bounded LRU map from whitespace separated words to their analyzed tokens.
+    The analyzers never join characters across whitespace, so text is analyzed word by word and only the words
+    that are not cached yet are passed on to the analyzer.
+    """
+    def __init__(self, analyze_batch, max_size=DEFAULT_CACHE_SIZE, analyzer_name=None):
+        """
+        Args:
+            analyze_batch (callable): Tokenizes a list of strings, returning their tokens joined by whitespace.
+            max_size (int): Maximum number of words to keep. 0 disables the cache.
+            analyzer_name (str): Name of the analyzer, stored with the vocabulary so that it is not reused by another analyzer.
+        """
+        self.analyze_batch = analyze_batch
+        self.max_size = max_size
+        self.analyzer_name = analyzer_name
+        self.words = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # words analyzed since record_added, which worker processes hand back to their parent's cache
+        self.added = None
+        self.lock = threading.Lock()
+
+    def tokenize_batch(self, to_tokenize: list) -> list:
+        split = [s.split() for s in to_tokenize]
+        known = {}
+        missing = {}
+        with self.lock:
+            for words in split:
+                for word in words:
+                    if word in known or word in missing:
+                        continue
+                    analyzed = self.words.get(word)
+                    if analyzed is None:
+                        missing[word] = None
+                        self.misses += 1
+                    else:
+                        known[word] = analyzed
+                        self.words.move_to_end(word)
+                        self.hits += 1
+        if missing:
+            analyzed = dict(zip(missing, self.analyze_batch(list(missing))))
+            self.update(analyzed)
+            if self.added is not None:
+                with self.lock:
+                    self.added.update(analyzed)
+            known.update(analyzed)
+        return [' '.join(known[word] for word in words if known[word]) for words in split]
+
+    def update(self, words: dict):
+        with self.lock:
+            for word, analyzed in words.items():
+                self.words[word] = analyzed
+                self.words.move_to_end(word)
+            while len(self.words) > self.max_size:
+                self.words.popitem(last=False)
+
+    def record_added(self):
+        """Starts recording the words analyzed from now on, until they are taken with take_added."""
+        with self.lock:
+            if self.added is None:
+                self.added = {}
+
+    def take_added(self) -> dict:
+        """Returns the words analyzed since record_added or the last call, and starts over."""
+        with self.lock:
+            added = self.added or {}
+            if self.added is not None:
+                self.added = {}
+        return added
+
+    def clear(self):
+        with self.lock:
+            self.words.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.words),
+            "max_size": self.max_size
+        }
+
+    def load(self, path: str):
+        """Loads a vocabulary saved by a previous run, if the file exists."""
+        if not os.path.exists(path):
+            return
+        with open(path, 'r') as f:
+            saved = json.load(f)
+        if saved.get("analyzer") != self.analyzer_name:
+            raise ValueError(f"The analysis cache at {path} was built with the {saved.get('analyzer')} analyzer, not {self.analyzer_name}.")
+        self.update(saved["vocabulary"])
+
+    def save(self, path: str):
+        """Saves the cached vocabulary, most recently used words last, so that later runs can load it."""
+        with self.lock:
+            vocabulary = dict(self.words)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({"analyzer": self.analyzer_name, "vocabulary": vocabulary}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
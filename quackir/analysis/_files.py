@@ -0,0 +1,126 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from ._base import tokenize_chunks, analyzer_process_pool
+from quackir._base import count_lines
+import json
+import gzip
+from collections import deque
+from itertools import islice
+from tqdm import tqdm 
+
+def read_tsv_file(f):
+    for line in f:
+        parts = line.strip().split('\t')
+        id = parts[0]
+        content = ' '.join(parts[1:])
+        yield id, content
+
+def read_json_file(f):
+    for line in f:
+        obj = json.loads(line.strip())
+        obj_items = list(obj.items())
+        if not obj_items:
+            continue
+        _, id = obj_items[0]
+        if 'title' in obj and 'text' in obj:
+            content = f"{obj['title']} {obj['text']}"
+        elif 'contents' in obj:
+            content = obj['contents']
+        else:
+            content = ' '.join(str(v) for k, v in obj_items[1:])
+        yield id, content
+
+def tokenize_entries(entries, num_lines, workers=1, chunk_size=1000, progress_bar=True):
+    """Tokenizes (id, content) entries in chunks, keeping their order."""
+    tokenized_data = []
+    pending_ids = deque()
+
+    def chunks():
+        while True:
+            chunk = list(islice(entries, chunk_size))
+            if not chunk:
+                break
+            pending_ids.append([id for id, _ in chunk])
+            yield [content for _, content in chunk]
+
+    with tqdm(total=num_lines, desc="Processing lines", disable=not progress_bar) as progress:
+        for tokenized in tokenize_chunks(chunks(), workers):
+            ids = pending_ids.popleft()
+            tokenized_data.extend({id: content} for id, content in zip(ids, tokenized))
+            progress.update(len(ids))
+    return tokenized_data
+
+def tokenize_tsv_file(input_file, open_cmd, num_lines, workers=1, progress_bar=True):
+    with open_cmd(input_file, 'rt') as f:
+        return tokenize_entries(read_tsv_file(f), num_lines, workers, progress_bar=progress_bar)
+
+def tokenize_json_file(input_file, open_cmd, num_lines, workers=1, progress_bar=True):
+    with open_cmd(input_file, 'rt') as f:
+        return tokenize_entries(read_json_file(f), num_lines, workers, progress_bar=progress_bar)
+
+def tokenize_file(filename, workers=1, progress_bar=True):
+    open_cmd = open
+    if filename.endswith('.gz'):
+        open_cmd = gzip.open
+    num_lines = count_lines(filename, open_cmd)
+    if '.jsonl' in filename:
+        tokenized_data = tokenize_json_file(filename, open_cmd, num_lines, workers, progress_bar)
+    elif '.tsv' in filename:
+        tokenized_data = tokenize_tsv_file(filename, open_cmd, num_lines, workers, progress_bar)
+    else:
+        return []
+    if progress_bar:
+        print(f"Tokenized {len(tokenized_data)} items from {filename}")
+    return tokenized_data
+
+def write_tokenized_data(tokenized_data, f):
+    for item in tokenized_data:
+        s = json.dumps({"id": list(item.keys())[0], "contents": list(item.values())[0]})
+        f.write(s + '\n')
+
+def save_tokenized_data(tokenized_data, output_file):
+    with open(output_file, 'w') as f:
+        write_tokenized_data(tokenized_data, f)
+    print(f"Tokenized data saved to {output_file}")
+
+def tokenize_files(filenames, output_file, workers=1):
+    """
+    Tokenizes files into a single output file in the order given, with a progress bar across them.
+    With more than one worker, whole files are tokenized in parallel, one per worker process, and written in order.
+    """
+    num_items = 0
+    with open(output_file, 'w') as f, tqdm(total=len(filenames), desc="Processing files", unit="file") as progress:
+        def write(tokenized_data):
+            nonlocal num_items
+            write_tokenized_data(tokenized_data, f)
+            num_items += len(tokenized_data)
+            progress.update(1)
+
+        if workers <= 1:
+            for filename in filenames:
+                write(tokenize_file(filename, progress_bar=False))
+        else:
+            with analyzer_process_pool(workers) as executor:
+                pending = deque()
+                for filename in filenames:
+                    pending.append(executor.submit(tokenize_file, filename, 1, False))
+                    # files are held in memory until written, so only one per worker is kept waiting
+                    if len(pending) >= 2 * workers:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
+    print(f"Tokenized {num_items} items from {len(filenames)} files, saved to {output_file}")
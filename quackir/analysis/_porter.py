@@ -0,0 +1,337 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from functools import lru_cache
+import unicodedata
+
+# Lucene's EnglishAnalyzer.ENGLISH_STOP_WORDS_SET, the default for Pyserini's Lucene analyzer
+STOP_WORDS = frozenset([
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it", "no", "not",
+    "of", "on", "or", "such", "that", "the", "their", "then", "there", "these", "they", "this", "to", "was", "will", "with"
+])
+
+MAX_TOKEN_LENGTH = 255
+
+# word break classes from Unicode UAX #29, which Lucene's StandardTokenizer implements
+OTHER, LETTER, NUMERIC, KATAKANA, EXTEND_NUM_LET, EXTEND, MID_LETTER, MID_NUM, MID_NUM_LET, SINGLE_QUOTE, IDEOGRAPHIC, EMOJI = range(12)
+
+MID_LETTER_CHARS = frozenset(":··״‧︓﹕：")
+MID_NUM_CHARS = frozenset(",;;։،؍٬߸⁄︐︔﹐﹔，；")
+MID_NUM_LET_CHARS = frozenset(".‘’․﹒＇．")
+POSSESSIVE_APOSTROPHES = frozenset("'’＇")
+
+@lru_cache(maxsize=65536)
+def char_class(ch: str) -> int:
+    cp = ord(ch)
+    if 0x30a0 <= cp <= 0x30ff or 0x31f0 <= cp <= 0x31ff or 0xff66 <= cp <= 0xff9f:
+        return KATAKANA
+    # ideographs and hiragana are emitted by StandardTokenizer one character at a time
+    if (0x3040 <= cp <= 0x309f or 0x3400 <= cp <= 0x4dbf or 0x4e00 <= cp <= 0x9fff or 0xf900 <= cp <= 0xfaff
+            or 0x20000 <= cp <= 0x2fa1f):
+        return IDEOGRAPHIC
+    if ch.isalpha():
+        return LETTER
+    category = unicodedata.category(ch)
+    if category == "Nd":
+        return NUMERIC
+    if category == "Pc":
+        return EXTEND_NUM_LET
+    if category in ("Mn", "Me", "Mc") or (category == "Cf" and cp != 0x200b):
+        return EXTEND
+    if ch == "'":
+        return SINGLE_QUOTE
+    if ch in MID_NUM_LET_CHARS:
+        return MID_NUM_LET
+    if ch in MID_LETTER_CHARS:
+        return MID_LETTER
+    if ch in MID_NUM_CHARS:
+        return MID_NUM
+    if 0x1f000 <= cp <= 0x1faff or 0x2600 <= cp <= 0x27bf:
+        return EMOJI
+    return OTHER
+
+def joins(prev: int, cur: int) -> bool:
+    if prev in (LETTER, NUMERIC) and cur in (LETTER, NUMERIC):
+        return True
+    if prev == KATAKANA and cur == KATAKANA:
+        return True
+    if cur == EXTEND_NUM_LET and prev in (LETTER, NUMERIC, KATAKANA, EXTEND_NUM_LET):
+        return True
+    return prev == EXTEND_NUM_LET and cur in (LETTER, NUMERIC, KATAKANA)
+
+def joins_across(prev: int, mid: int, next: int) -> bool:
+    if prev == LETTER and next == LETTER:
+        return mid in (MID_LETTER, MID_NUM_LET, SINGLE_QUOTE)
+    if prev == NUMERIC and next == NUMERIC:
+        return mid in (MID_NUM, MID_NUM_LET, SINGLE_QUOTE)
+    return False
+
+def split_words(text: str) -> list:
+    """Splits text into words following the UAX #29 word break rules used by Lucene's StandardTokenizer."""
+    words = []
+    n = len(text)
+    i = 0
+    while i < n:
+        start_class = char_class(text[i])
+        if start_class in (IDEOGRAPHIC, EMOJI):
+            j = i + 1
+            while j < n and char_class(text[j]) == EXTEND:
+                j += 1
+            words.append(text[i:j])
+            i = j
+            continue
+        if start_class not in (LETTER, NUMERIC, KATAKANA, EXTEND_NUM_LET):
+            i += 1
+            continue
+        start = i
+        prev = start_class
+        has_alnum = start_class != EXTEND_NUM_LET
+        j = i + 1
+        while j < n:
+            cur = char_class(text[j])
+            if cur == EXTEND:
+                j += 1
+                continue
+            if joins(prev, cur):
+                prev = cur
+                has_alnum = has_alnum or cur != EXTEND_NUM_LET
+                j += 1
+                continue
+            if cur in (MID_LETTER, MID_NUM, MID_NUM_LET, SINGLE_QUOTE):
+                k = j + 1
+                while k < n and char_class(text[k]) == EXTEND:
+                    k += 1
+                if k < n and joins_across(prev, cur, char_class(text[k])):
+                    prev = char_class(text[k])
+                    j = k + 1
+                    continue
+            break
+        if has_alnum:
+            # StandardTokenizer chops words longer than its maximum token length
+            for offset in range(start, j, MAX_TOKEN_LENGTH):
+                words.append(text[offset:min(offset + MAX_TOKEN_LENGTH, j)])
+        i = j
+    return words
+
+class PorterStemmer:
+    """A port of Lucene's PorterStemmer, which follows Martin Porter's reference implementation of the algorithm."""
+    def __init__(self, word: str):
+        self.b = list(word)
+        self.k = len(word) - 1
+        self.k0 = 0
+        self.j = 0
+
+    def cons(self, i: int) -> bool:
+        ch = self.b[i]
+        if ch in "aeiou":
+            return False
+        if ch == "y":
+            return True if i == self.k0 else not self.cons(i - 1)
+        return True
+
+    def m(self) -> int:
+        n = 0
+        i = self.k0
+        while True:
+            if i > self.j:
+                return n
+            if not self.cons(i):
+                break
+            i += 1
+        i += 1
+        while True:
+            while True:
+                if i > self.j:
+                    return n
+                if self.cons(i):
+                    break
+                i += 1
+            i += 1
+            n += 1
+            while True:
+                if i > self.j:
+                    return n
+                if not self.cons(i):
+                    break
+                i += 1
+            i += 1
+
+    def vowel_in_stem(self) -> bool:
+        return any(not self.cons(i) for i in range(self.k0, self.j + 1))
+
+    def double_c(self, j: int) -> bool:
+        if j < self.k0 + 1:
+            return False
+        if self.b[j] != self.b[j - 1]:
+            return False
+        return self.cons(j)
+
+    def cvc(self, i: int) -> bool:
+        if i < self.k0 + 2 or not self.cons(i) or self.cons(i - 1) or not self.cons(i - 2):
+            return False
+        return self.b[i] not in "wxy"
+
+    def ends(self, s: str) -> bool:
+        length = len(s)
+        if length > self.k - self.k0 + 1:
+            return False
+        if "".join(self.b[self.k - length + 1:self.k + 1]) != s:
+            return False
+        self.j = self.k - length
+        return True
+
+    def set_to(self, s: str):
+        self.b[self.j + 1:self.k + 1] = list(s)
+        self.k = self.j + len(s)
+
+    def r(self, s: str):
+        if self.m() > 0:
+            self.set_to(s)
+
+    def step1(self):
+        if self.b[self.k] == "s":
+            if self.ends("sses"):
+                self.k -= 2
+            elif self.ends("ies"):
+                self.set_to("i")
+            elif self.b[self.k - 1] != "s":
+                self.k -= 1
+        if self.ends("eed"):
+            if self.m() > 0:
+                self.k -= 1
+        elif (self.ends("ed") or self.ends("ing")) and self.vowel_in_stem():
+            self.k = self.j
+            if self.ends("at"):
+                self.set_to("ate")
+            elif self.ends("bl"):
+                self.set_to("ble")
+            elif self.ends("iz"):
+                self.set_to("ize")
+            elif self.double_c(self.k):
+                ch = self.b[self.k]
+                self.k -= 1
+                if ch in "lsz":
+                    self.k += 1
+            elif self.m() == 1 and self.cvc(self.k):
+                self.set_to("e")
+
+    def step2(self):
+        if self.ends("y") and self.vowel_in_stem():
+            self.b[self.k] = "i"
+
+    STEP3_SUFFIXES = {
+        "a": [("ational", "ate"), ("tional", "tion")],
+        "c": [("enci", "ence"), ("anci", "ance")],
+        "e": [("izer", "ize")],
+        "l": [("bli", "ble"), ("alli", "al"), ("entli", "ent"), ("eli", "e"), ("ousli", "ous")],
+        "o": [("ization", "ize"), ("ation", "ate"), ("ator", "ate")],
+        "s": [("alism", "al"), ("iveness", "ive"), ("fulness", "ful"), ("ousness", "ous")],
+        "t": [("aliti", "al"), ("iviti", "ive"), ("biliti", "ble")],
+        "g": [("logi", "log")],
+    }
+
+    STEP4_SUFFIXES = {
+        "e": [("icate", "ic"), ("ative", ""), ("alize", "al")],
+        "i": [("iciti", "ic")],
+        "l": [("ical", "ic"), ("ful", "")],
+        "s": [("ness", "")],
+    }
+
+    STEP5_SUFFIXES = {
+        "a": ["al"],
+        "c": ["ance", "ence"],
+        "e": ["er"],
+        "i": ["ic"],
+        "l": ["able", "ible"],
+        "n": ["ant", "ement", "ment", "ent"],
+        "s": ["ism"],
+        "t": ["ate", "iti"],
+        "u": ["ous"],
+        "v": ["ive"],
+        "z": ["ize"],
+    }
+
+    def replace_suffix(self, candidates):
+        for suffix, replacement in candidates:
+            if self.ends(suffix):
+                self.r(replacement)
+                return
+
+    def step3(self):
+        if self.k == self.k0:
+            return
+        self.replace_suffix(self.STEP3_SUFFIXES.get(self.b[self.k - 1], []))
+
+    def step4(self):
+        self.replace_suffix(self.STEP4_SUFFIXES.get(self.b[self.k], []))
+
+    def step5(self):
+        if self.k == self.k0:
+            return
+        ch = self.b[self.k - 1]
+        if ch == "o":
+            if not ((self.ends("ion") and self.j >= 0 and self.b[self.j] in "st") or self.ends("ou")):
+                return
+        elif not any(self.ends(suffix) for suffix in self.STEP5_SUFFIXES.get(ch, [])):
+            return
+        if self.m() > 1:
+            self.k = self.j
+
+    def step6(self):
+        self.j = self.k
+        if self.b[self.k] == "e":
+            a = self.m()
+            if a > 1 or (a == 1 and not self.cvc(self.k - 1)):
+                self.k -= 1
+        if self.b[self.k] == "l" and self.double_c(self.k) and self.m() > 1:
+            self.k -= 1
+
+    def stem(self) -> str:
+        if self.k > self.k0 + 1:
+            self.step1()
+            self.step2()
+            self.step3()
+            self.step4()
+            self.step5()
+            self.step6()
+        return "".join(self.b[:self.k + 1])
+
+@lru_cache(maxsize=262144)
+def stem(word: str) -> str:
+    return PorterStemmer(word).stem()
+
+def lowercase(token: str) -> str:
+    lowered = token.lower()
+    if len(lowered) == len(token):
+        return lowered
+    # Java lowercases one code point at a time, e.g. dotted capital I becomes a plain i
+    return "".join(ch.lower()[0] for ch in token)
+
+class PorterAnalyzer:
+    """
+    A pure Python counterpart to Pyserini's default Lucene analyzer: StandardTokenizer, EnglishPossessiveFilter,
+    LowerCaseFilter, StopFilter with the English stop words, and PorterStemFilter.
+    """
+    def analyze(self, text: str) -> list:
+        tokens = []
+        for word in split_words(text):
+            if len(word) >= 2 and word[-2] in POSSESSIVE_APOSTROPHES and word[-1] in "sS":
+                word = word[:-2]
+            word = lowercase(word)
+            if word in STOP_WORDS:
+                continue
+            tokens.append(stem(word))
+        return tokens
@@ -0,0 +1,246 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from quackir._base import SearchType, SearchDB, IndexType, AnalyzerType, sanitize_table_name
+from quackir.index._base import DEFAULT_CHUNK_SIZE
+from ._search import run_search_benchmark
+from ._index import run_index_benchmark
+from ._fts import run_fts_benchmark, score_parity
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import subprocess
+import platform
+import argparse
+import json
+import time
+import os
+
+def git_commit():
+    """Returns the commit the benchmarked code is at, so that results can be compared across commits."""
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def run_in_process(benchmark, config: dict) -> dict:
+    # every run gets a fresh process, so that peak RSS and warm caches do not carry over from earlier runs
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(benchmark, config).result()
+
+def search_configs(args) -> list:
+    db_paths = {SearchDB.DUCKDB: args.duckdb_path, SearchDB.SQLITE: args.sqlite_path, SearchDB.POSTGRES: None}
+    configs = []
+    for corpus in args.corpora:
+        for db_type in args.db_type:
+            for method in args.search_methods:
+                if method == SearchType.SPARSE:
+                    tables = [args.sparse_table]
+                elif method == SearchType.DENSE:
+                    tables = [args.dense_table]
+                else:
+                    tables = args.hybrid_tables
+                configs.append({
+                    "db_type": db_type,
+                    "db_path": db_paths[db_type],
+                    "db_name": args.db_name,
+                    "db_user": args.db_user,
+                    "corpus": corpus,
+                    "method": method,
+                    "tables": [sanitize_table_name(table.format(corpus=corpus)) for table in tables],
+                    "topics": args.topics.format(corpus=corpus),
+                    "pretokenized": args.pretokenized,
+                    "analyzer": args.analyzer,
+                    "hits": args.hits,
+                    "warmup": args.warmup,
+                    "max_queries": args.max_queries
+                })
+    return configs
+
+def skip_reason(config: dict):
+    if config["db_type"] == SearchDB.SQLITE and config["method"] != SearchType.SPARSE:
+        return "SQLite only supports sparse search"
+    if not os.path.exists(config["topics"]):
+        return f"{config['topics']} not found"
+    return None
+
+def benchmark_search(args) -> list:
+    results = []
+    for config in search_configs(args):
+        label = f"{config['db_type'].value} {config['method'].value} {config['corpus']}"
+        reason = skip_reason(config)
+        if reason is not None:
+            print(f"{label}: skipped, {reason}")
+            results.append({"db_type": config["db_type"].value, "corpus": config["corpus"], "method": config["method"].value, "skipped": reason})
+            continue
+        try:
+            result = run_in_process(run_search_benchmark, config)
+        except Exception as e:
+            print(f"{label}: failed, {e}")
+            results.append({"db_type": config["db_type"].value, "corpus": config["corpus"], "method": config["method"].value, "error": str(e)})
+            continue
+        results.append(result)
+        if result["num_queries"] == 0:
+            print(f"{label}: no queries timed, peak RSS {result['peak_rss_mb']:.0f} MB")
+            continue
+        latency = result["latency"]
+        print(f"{label}: {result['qps']:.1f} queries per second, p50 {latency['p50_ms']:.2f} ms, p95 {latency['p95_ms']:.2f} ms, "
+              f"p99 {latency['p99_ms']:.2f} ms, tokenization {result['tokenize_share']:.1%}, peak RSS {result['peak_rss_mb']:.0f} MB")
+    return results
+
+def benchmark_index(args) -> list:
+    db_paths = {SearchDB.DUCKDB: args.duckdb_path, SearchDB.SQLITE: args.sqlite_path, SearchDB.POSTGRES: None}
+    results = []
+    for db_type in args.db_type:
+        label = f"{db_type.value} {args.index_type.value}"
+        if db_type == SearchDB.SQLITE and args.index_type != IndexType.SPARSE:
+            reason = "SQLite only supports sparse indexes"
+            print(f"{label}: skipped, {reason}")
+            results.append({"db_type": db_type.value, "index_type": args.index_type.value, "skipped": reason})
+            continue
+        config = {
+            "db_type": db_type,
+            "db_path": db_paths[db_type],
+            "db_name": args.db_name,
+            "db_user": args.db_user,
+            "input": args.input,
+            "index_type": args.index_type,
+            "table": sanitize_table_name(args.index),
+            "dimension": args.dimension,
+            "pretokenized": args.pretokenized,
+            "analyzer": args.analyzer,
+            "chunk_size": args.chunk_size,
+            "workers": args.workers,
+            "bulk": not args.no_bulk_load
+        }
+        try:
+            result = run_in_process(run_index_benchmark, config)
+        except Exception as e:
+            print(f"{label}: failed, {e}")
+            results.append({"db_type": db_type.value, "index_type": args.index_type.value, "error": str(e)})
+            continue
+        phases = ", ".join(f"{name} {phase['share']:.1%}" for name, phase in result["phases"].items())
+        print(f"{label}: {result['rows']} rows in {result['seconds']:.2f} s, {result['rows_per_second']:.0f} rows per second, "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB ({phases})")
+        results.append(result)
+    return results
+
+def benchmark_fts(args) -> list:
+    results = []
+    # scores of every configuration are compared with those of the first one built
+    reference = None
+    for spec in args.configs:
+        config = {
+            "db_path": args.sqlite_path,
+            "table": sanitize_table_name(args.index),
+            "spec": spec,
+            "topics": args.topics,
+            "pretokenized": args.pretokenized,
+            "analyzer": args.analyzer,
+            "hits": args.hits,
+            "warmup": args.warmup,
+            "max_queries": args.max_queries
+        }
+        try:
+            result = run_in_process(run_fts_benchmark, config)
+        except Exception as e:
+            print(f"{spec}: failed, {e}")
+            results.append({"db_type": SearchDB.SQLITE.value, "spec": spec, "error": str(e)})
+            continue
+        run = result.pop("run")
+        if reference is None:
+            reference = (spec, run)
+        result["parity"] = {"reference": reference[0], **score_parity(reference[1], run)}
+        latency, parity = result["latency"], result["parity"]
+        build = f"{spec}: built in {result['build_seconds']:.2f} s, index {result['index_mb']:.1f} MB, database {result['db_mb']:.1f} MB"
+        if result["num_queries"] == 0:
+            print(f"{build}, no queries timed")
+        else:
+            print(f"{build}, {result['qps']:.1f} queries per second, p50 {latency['p50_ms']:.2f} ms, p95 {latency['p95_ms']:.2f} ms, "
+                  f"{parity['same_ranking']:.0%} of queries ranked as {parity['reference']}, max score difference {parity['max_score_diff']:.4f}")
+        results.append(result)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark QuackIR across backends and corpora.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    search_parser = subparsers.add_parser("search", help="Benchmark search latency and throughput for every backend, search method and corpus.")
+    search_parser.add_argument("--db-type", type=SearchDB, choices=list(SearchDB), nargs='+', required=True, help="Databases to benchmark.")
+    search_parser.add_argument("--duckdb-path", type=str, default="duck.db", help="Path to the DuckDB database.")
+    search_parser.add_argument("--sqlite-path", type=str, default="sqlite.db", help="Path to the SQLite database.")
+    search_parser.add_argument("--db-name", type=str, default="quackir", help="Name of the database for Postgres.")
+    search_parser.add_argument("--db-user", type=str, default="postgres", help="Username for Postgres.")
+    search_parser.add_argument("--corpora", type=str, nargs='+', required=True, help="Corpora to benchmark, substituted for {corpus} in the topics and table names.")
+    search_parser.add_argument("--search-methods", type=SearchType, choices=list(SearchType), nargs='+', default=[SearchType.SPARSE], help="Search methods to benchmark.")
+    search_parser.add_argument("--topics", type=str, default="collections/beir-v1.0.0/combined_queries/{corpus}/queries.jsonl", help="Queries of each corpus, in jsonl format with the fields id, contents and vector, or in tsv format for sparse search.")
+    search_parser.add_argument("--pretokenized", action='store_true', default=False, help="Indicate if the queries are pretokenized, in which case no time is spent tokenizing.")
+    search_parser.add_argument("--analyzer", type=AnalyzerType, choices=list(AnalyzerType), default=AnalyzerType.LUCENE, help="Analyzer to tokenize queries with.")
+    search_parser.add_argument("--sparse-table", type=str, default="{corpus}", help="Table of each corpus for sparse search.")
+    search_parser.add_argument("--dense-table", type=str, default="{corpus}_dense", help="Table of each corpus for dense search.")
+    search_parser.add_argument("--hybrid-tables", type=str, nargs=2, default=["{corpus}_sparse", "{corpus}_dense"], help="Sparse and dense tables of each corpus for hybrid search.")
+    search_parser.add_argument("--hits", type=int, default=1000, help="Number of results per query.")
+    search_parser.add_argument("--warmup", type=int, default=10, help="Number of queries to run before timing starts.")
+    search_parser.add_argument("--max-queries", type=int, default=None, help="Number of queries to time per run. Default is all of them.")
+    search_parser.add_argument("--output", type=str, required=True, help="Path to save the results to, in JSON format.")
+
+    index_parser = subparsers.add_parser("index", help="Benchmark indexing the same corpus into every backend, phase by phase.")
+    index_parser.add_argument("--db-type", type=SearchDB, choices=list(SearchDB), nargs='+', required=True, help="Databases to benchmark.")
+    index_parser.add_argument("--duckdb-path", type=str, default="duck.db", help="Path to the DuckDB database.")
+    index_parser.add_argument("--sqlite-path", type=str, default="sqlite.db", help="Path to the SQLite database.")
+    index_parser.add_argument("--db-name", type=str, default="quackir", help="Name of the database for Postgres.")
+    index_parser.add_argument("--db-user", type=str, default="postgres", help="Username for Postgres.")
+    index_parser.add_argument("--input", type=str, required=True, help="Path to the file or folder containing the corpus to index.")
+    index_parser.add_argument("--index-type", type=IndexType, choices=list(IndexType), default=IndexType.SPARSE, help="Type of index to create.")
+    index_parser.add_argument("--index", type=str, default="bench", help="Name of the table to create, replacing any table of that name.")
+    index_parser.add_argument("--dimension", type=int, default=768, help="Dimension of the embedding vector.")
+    index_parser.add_argument("--pretokenized", action='store_true', default=False, help="Indicate if the contents are pretokenized.")
+    index_parser.add_argument("--analyzer", type=AnalyzerType, choices=list(AnalyzerType), default=AnalyzerType.LUCENE, help="Analyzer to tokenize contents with.")
+    index_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Number of jsonl lines to read, tokenize and insert at a time.")
+    index_parser.add_argument("--workers", type=int, default=1, help="Number of processes to tokenize contents with.")
+    index_parser.add_argument("--no-bulk-load", action='store_true', default=False, help="Insert jsonl rows from Python even when the database's native bulk loading path applies.")
+    index_parser.add_argument("--output", type=str, required=True, help="Path to save the results to, in JSON format.")
+
+    fts_parser = subparsers.add_parser("fts", help="Benchmark building and searching SQLite FTS5 indexes of a loaded table in several configurations.")
+    fts_parser.add_argument("--sqlite-path", type=str, default="sqlite.db", help="Path to the SQLite database holding the table, which is copied for every configuration.")
+    fts_parser.add_argument("--index", type=str, default="corpus", help="Sparse table to build the index of.")
+    fts_parser.add_argument("--configs", type=str, nargs='+', default=["default"], help="Configurations to build, as comma separated options of SQLiteIndexer.fts_index and pragmas, such as detail=column,pgsz=8192,optimize.")
+    fts_parser.add_argument("--topics", type=str, required=True, help="Queries in jsonl format with the fields id and contents, or in tsv format.")
+    fts_parser.add_argument("--pretokenized", action='store_true', default=False, help="Indicate if the queries are pretokenized, in which case no time is spent tokenizing.")
+    fts_parser.add_argument("--analyzer", type=AnalyzerType, choices=list(AnalyzerType), default=AnalyzerType.LUCENE, help="Analyzer to tokenize queries with.")
+    fts_parser.add_argument("--hits", type=int, default=1000, help="Number of results per query.")
+    fts_parser.add_argument("--warmup", type=int, default=10, help="Number of queries to run before timing starts.")
+    fts_parser.add_argument("--max-queries", type=int, default=None, help="Number of queries to time per configuration. Default is all of them.")
+    fts_parser.add_argument("--output", type=str, required=True, help="Path to save the results to, in JSON format.")
+
+    args = parser.parse_args()
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "command": args.command
+    }
+    if args.command == "search":
+        report["results"] = benchmark_search(args)
+    elif args.command == "index":
+        report["results"] = benchmark_index(args)
+    elif args.command == "fts":
+        report["results"] = benchmark_fts(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results saved to {args.output}")
@@ -0,0 +1,145 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from quackir._base import SearchDB, SearchType
+from quackir.analysis import tokenize
+from quackir.index._sqlite import SQLiteIndexer, SQLITE_PRAGMAS
+from quackir.search._sqlite import SQLiteSearcher
+from ._search import run_search_benchmark, read_topics
+from time import perf_counter
+import tempfile
+import shutil
+import os
+
+def parse_fts_config(spec: str) -> tuple:
+    """
+    Parses a configuration such as "detail=column,pgsz=8192,optimize" into the params of SQLiteIndexer.fts_index
+    and the pragmas to build with. Options given without a value are switched on; "default" is no options at all.
+    """
+    params, pragmas = {}, {}
+    for option in spec.split(","):
+        option = option.strip()
+        if not option or option == "default":
+            continue
+        name, _, value = option.partition("=")
+        if name in SQLITE_PRAGMAS:
+            pragmas[name] = value
+        else:
+            params[name] = value if value else True
+    return params, pragmas
+
+def fts_size_mb(conn, table_name: str) -> float:
+    # the FTS5 index lives in its shadow tables, fts_{table}_data, _idx, _docsize and _config
+    size = conn.execute("SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name LIKE ? ESCAPE '\\'", (f"fts\\_{table_name}\\_%",)).fetchone()[0]
+    return size / (1024 * 1024)
+
+def search_run(db_path: str, table_name: str, config: dict) -> dict:
+    """Searches the queries timed by run_search_benchmark once more, untimed, and returns their results by query id."""
+    queries = read_topics(config["topics"])
+    if config.get("max_queries") is not None:
+        queries = queries[:config["max_queries"]]
+    searcher = SQLiteSearcher(db_path)
+    try:
+        return {str(query_id): searcher.fts_search(contents if config["pretokenized"] else tokenize(contents), top_n=config["hits"], table_name=table_name)
+                for query_id, contents, _ in queries}
+    finally:
+        searcher.close()
+
+def score_parity(reference: dict, run: dict) -> dict:
+    """
+    Compares the results of a configuration with those of a reference one: the share of queries ranked identically,
+    the mean share of the reference's results also returned, and the largest difference between scores at the same rank.
+    """
+    same_ranking, overlap, max_score_diff = 0, 0.0, 0.0
+    for query_id, expected in reference.items():
+        actual = run.get(query_id, [])
+        same_ranking += [doc_id for doc_id, _ in expected] == [doc_id for doc_id, _ in actual]
+        overlap += len({doc_id for doc_id, _ in expected} & {doc_id for doc_id, _ in actual}) / len(expected) if expected else 1.0
+        for (_, expected_score), (_, actual_score) in zip(expected, actual):
+            max_score_diff = max(max_score_diff, abs(expected_score - actual_score))
+    num_queries = len(reference)
+    return {
+        "same_ranking": same_ranking / num_queries if num_queries else 1.0,
+        "overlap": overlap / num_queries if num_queries else 1.0,
+        "max_score_diff": max_score_diff
+    }
+
+def run_fts_benchmark(config: dict) -> dict:
+    """
+    Builds the FTS5 index of an SQLite table in one configuration, on a copy of the database, and reports the time
+    the build took, the size of the index and of the database, and the latency of sparse search over it.
+    Meant to run in a fresh process, so that peak RSS covers this run alone.
+
+    Args:
+        config (dict): db_path and table of a loaded sparse table; spec, the configuration to build with as parsed by
+            parse_fts_config; and topics, pretokenized, analyzer, hits, warmup and max_queries for run_search_benchmark.
+
+    Returns:
+        dict: The configuration, the build time and its phases, the sizes in megabytes, the search benchmark results,
+            and the run, the results of every query, for score_parity.
+    """
+    params, pragmas = parse_fts_config(config["spec"])
+    table_name = config["table"]
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, os.path.basename(config["db_path"]))
+        shutil.copyfile(config["db_path"], db_path)
+        indexer = SQLiteIndexer(db_path)
+        indexer.enable_profile()
+        try:
+            indexer.set_pragmas(pragmas)
+            start = perf_counter()
+            indexer.fts_index(table_name, params)
+            build_seconds = perf_counter() - start
+            index_mb = fts_size_mb(indexer.conn, table_name)
+            # pages freed by dropping the index the copy came with are not counted
+            page_size, page_count, freelist_count = (indexer.conn.execute(f"PRAGMA {pragma}").fetchone()[0] for pragma in ["page_size", "page_count", "freelist_count"])
+            db_mb = page_size * (page_count - freelist_count) / (1024 * 1024)
+        finally:
+            indexer.close()
+        search = run_search_benchmark({
+            "db_type": SearchDB.SQLITE,
+            "db_path": db_path,
+            "db_name": None,
+            "db_user": None,
+            "corpus": config["spec"],
+            "method": SearchType.SPARSE,
+            "tables": [table_name],
+            "topics": config["topics"],
+            "pretokenized": config["pretokenized"],
+            "analyzer": config["analyzer"],
+            "hits": config["hits"],
+            "warmup": config["warmup"],
+            "max_queries": config["max_queries"]
+        })
+        run = search_run(db_path, table_name, config)
+    record = indexer.profile.records[-1]
+    return {
+        "db_type": SearchDB.SQLITE.value,
+        "table": table_name,
+        "spec": config["spec"],
+        "params": params,
+        "pragmas": pragmas,
+        "build_seconds": build_seconds,
+        "build_phases": {phase["phase"]: phase["seconds"] for phase in record["phases"]},
+        "index_mb": index_mb,
+        "db_mb": db_mb,
+        "num_queries": search["num_queries"],
+        "qps": search["qps"],
+        "latency": search["latency"],
+        "search": search["search"],
+        "peak_rss_mb": search["peak_rss_mb"],
+        "run": run
+    }
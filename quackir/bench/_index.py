@@ -0,0 +1,81 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from quackir._base import IndexType, peak_rss_mb
+from quackir.analysis import set_analyzer
+from quackir.index._util import get_indexer
+from time import perf_counter
+import os
+
+def input_files(path: str) -> list:
+    if not os.path.isdir(path):
+        return [path]
+    with os.scandir(path) as files:
+        return sorted(file.path for file in files if file.is_file())
+
+def run_index_benchmark(config: dict) -> dict:
+    """
+    Indexes a corpus into one backend as quackir.index does, with the indexer's profile enabled, so that the time
+    of every file and index build is split into reading, parsing, tokenizing, inserting and building.
+    Meant to run in a fresh process, so that peak RSS covers this run alone.
+
+    Args:
+        config (dict): db_type, db_path, db_name and db_user for get_indexer; input, index_type, table, dimension,
+            pretokenized, analyzer, chunk_size, workers and bulk for indexing.
+
+    Returns:
+        dict: The config, the number of rows indexed, the wall time and rows per second of the whole run,
+            the time spent in every phase across operations, every operation the profile recorded, and peak RSS in megabytes.
+    """
+    set_analyzer(config["analyzer"])
+    index_type = config["index_type"]
+    table_name = config["table"]
+    indexer = get_indexer(config["db_type"], db_path=config["db_path"], db_name=config["db_name"], db_user=config["db_user"])
+    indexer.enable_profile()
+    try:
+        start = perf_counter()
+        indexer.init_table(table_name, index_type, config["dimension"])
+        init_seconds = perf_counter() - start
+        indexer.load_files(table_name, input_files(config["input"]), index_type, config["pretokenized"], config["chunk_size"], config["bulk"], config["workers"])
+        if index_type == IndexType.SPARSE:
+            indexer.fts_index(table_name)
+        seconds = perf_counter() - start
+        num_rows = indexer.get_num_rows(table_name)
+    finally:
+        indexer.close()
+
+    phases = {"init_table": init_seconds}
+    for record in indexer.profile.records:
+        for phase in record["phases"]:
+            name = phase["phase"] if record["operation"] == "load_table" else record["operation"]
+            phases[name] = phases.get(name, 0.0) + phase["seconds"]
+    return {
+        "db_type": config["db_type"].value,
+        "input": config["input"],
+        "index_type": index_type.value,
+        "table": table_name,
+        "pretokenized": config["pretokenized"],
+        "bulk": config["bulk"],
+        "workers": config["workers"],
+        "rows": num_rows,
+        "bytes_read": sum(record.get("bytes_read", 0) for record in indexer.profile.records),
+        "seconds": seconds,
+        "rows_per_second": num_rows / seconds if seconds > 0 else 0.0,
+        "phases": {name: {"seconds": phase_seconds, "share": phase_seconds / seconds if seconds > 0 else 0.0} for name, phase_seconds in phases.items()},
+        "operations": indexer.profile.records,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_children_mb": peak_rss_mb(children=True)
+    }
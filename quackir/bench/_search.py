@@ -0,0 +1,113 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from quackir._base import SearchType, peak_rss_mb
+from quackir.analysis import tokenize, set_analyzer
+from quackir.search._util import get_searcher
+from time import perf_counter_ns
+from io import StringIO
+import numpy as np
+import gzip
+import json
+
+PERCENTILES = [50, 95, 99]
+
+def read_topics(path: str) -> list:
+    """Reads queries in jsonl or tsv format, optionally compressed with gzip, as (query_id, contents, vector) tuples."""
+    open_cmd = gzip.open if path.endswith('.gz') else open
+    queries = []
+    with open_cmd(path, 'rt') as f:
+        for line in f:
+            if '.jsonl' in path:
+                query = json.loads(line)
+            else:
+                parts = line.rstrip('\n').split('\t')
+                query = {"id": parts[0], "contents": parts[1]}
+            queries.append((query.get("id", query.get("qid")), query.get("contents"), query.get("vector")))
+    return queries
+
+def summarize_latencies(latencies_ns: list) -> dict:
+    """Reports the mean and percentiles of a list of latencies in nanoseconds, in milliseconds."""
+    if not latencies_ns:
+        return {}
+    latencies_ms = np.asarray(latencies_ns, dtype=np.float64) / 1e6
+    summary = {"mean_ms": float(latencies_ms.mean())}
+    for percentile in PERCENTILES:
+        summary[f"p{percentile}_ms"] = float(np.percentile(latencies_ms, percentile))
+    return summary
+
+def run_search_benchmark(config: dict) -> dict:
+    """
+    Times the queries of one corpus against one backend with one search method, one query at a time.
+    Every query is split into three stages: tokenization, the search itself, which is dominated by the database,
+    and writing the results as run file lines, to memory so that disk speed does not count. Meant to run in a fresh process, so that peak RSS covers this run alone.
+
+    Args:
+        config (dict): db_type, db_path, db_name and db_user for get_searcher; method, tables and hits for the search;
+            topics, pretokenized and analyzer for the queries; warmup, the number of queries to run untimed first;
+            and max_queries, the number of queries to time, all of them if None.
+
+    Returns:
+        dict: The config, the number of queries, queries per second, latency summaries of each stage and of whole
+            queries, the share of time spent tokenizing, and peak RSS in megabytes.
+    """
+    set_analyzer(config["analyzer"])
+    method = config["method"]
+    queries = read_topics(config["topics"])
+    if config.get("max_queries") is not None:
+        queries = queries[:config["max_queries"]]
+    searcher = get_searcher(config["db_type"], db_path=config["db_path"], db_name=config["db_name"], db_user=config["db_user"], read_only=True)
+    run_file = StringIO()
+
+    def run(query) -> tuple:
+        query_id, contents, vector = query
+        start = perf_counter_ns()
+        if method != SearchType.DENSE and not config["pretokenized"]:
+            contents = tokenize(contents)
+        tokenized = perf_counter_ns()
+        results = searcher.search(method, query_id=query_id, query_string=contents, query_embedding=vector,
+                                  top_n=config["hits"], tokenize_query=False, table_names=config["tables"])
+        searched = perf_counter_ns()
+        run_file.writelines(f"{query_id} Q0 {doc_id} {rank} {score} bench\n" for rank, (doc_id, score) in enumerate(results, 1))
+        done = perf_counter_ns()
+        return tokenized - start, searched - tokenized, done - searched
+
+    try:
+        for query in queries[:config["warmup"]]:
+            run(query)
+        start = perf_counter_ns()
+        timings = [run(query) for query in queries]
+        elapsed_ns = perf_counter_ns() - start
+    finally:
+        searcher.close()
+
+    tokenize_ns, search_ns, postprocess_ns = (list(stage) for stage in zip(*timings)) if timings else ([], [], [])
+    total_ns = [sum(stages) for stages in timings]
+    return {
+        "db_type": config["db_type"].value,
+        "corpus": config["corpus"],
+        "method": method.value,
+        "tables": config["tables"],
+        "hits": config["hits"],
+        "num_queries": len(timings),
+        "qps": len(timings) / (elapsed_ns / 1e9) if elapsed_ns else 0.0,
+        "latency": summarize_latencies(total_ns),
+        "tokenize": summarize_latencies(tokenize_ns),
+        "search": summarize_latencies(search_ns),
+        "postprocess": summarize_latencies(postprocess_ns),
+        "tokenize_share": sum(tokenize_ns) / sum(total_ns) if sum(total_ns) else 0.0,
+        "peak_rss_mb": peak_rss_mb()
+    }
@@ -0,0 +1,43 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from quackir._base import FusionMethod, ScoreNormalization
+from ._base import read_run, fuse_runs, write_run
+import argparse
+import time
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fuse run files in TREC format into one.")
+    parser.add_argument("--runs", type=str, nargs='+', required=True, help="Paths to the run files to fuse.")
+    parser.add_argument("--output", type=str, required=True, help="Path to save the fused run to.")
+    parser.add_argument("--method", type=FusionMethod, choices=list(FusionMethod), default=FusionMethod.RRF, help="Method of fusion.")
+    parser.add_argument("--k", type=int, default=60, help="Parameter k of reciprocal rank fusion. Ignored for other methods.")
+    parser.add_argument("--depth", type=int, default=None, help="Number of results of every query of every run to fuse. Default is all of them.")
+    parser.add_argument("--hits", type=int, default=1000, help="Number of fused results to keep per query.")
+    parser.add_argument("--weights", type=float, nargs='+', default=None, help="Weight of every run for weighted fusion, in the order of --runs. Default is an equal share each.")
+    parser.add_argument("--normalization", type=ScoreNormalization, choices=list(ScoreNormalization), default=ScoreNormalization.MINMAX, help="How scores are rescaled before combsum, combmnz and weighted fusion.")
+    parser.add_argument("--run-tag", type=str, default=None, help="Tag to identify the fused run in the output file.")
+
+    args = parser.parse_args()
+    if args.depth is not None and args.depth < 1:
+        raise ValueError("Depth must be at least 1.")
+    runs = [read_run(path) for path in args.runs]
+    start = time.perf_counter()
+    fused = fuse_runs(runs, args.method, args.hits, args.k, args.weights, args.normalization, args.depth)
+    elapsed = time.perf_counter() - start
+    print(f"Fused {len(runs)} runs over {len(fused)} queries in {elapsed * 1000:.1f} ms.")
+    write_run(fused, args.output, args.run_tag or f"{args.method.value}_fusion")
+    print(f"Fused run saved to {args.output}")
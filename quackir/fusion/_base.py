@@ -0,0 +1,113 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from quackir._base import FusionMethod, ScoreNormalization
+import numpy as np
+
+def normalize_scores(scores: np.ndarray, normalization: ScoreNormalization = ScoreNormalization.MINMAX) -> np.ndarray:
+    """Rescales the scores of one ranked list to [0, 1] with minmax, or to zero mean and unit variance with zscore."""
+    if normalization == ScoreNormalization.MINMAX:
+        spread = scores.max() - scores.min()
+        return (scores - scores.min()) / spread if spread > 0 else np.ones_like(scores)
+    if normalization == ScoreNormalization.ZSCORE:
+        deviation = scores.std()
+        return (scores - scores.mean()) / deviation if deviation > 0 else np.zeros_like(scores)
+    return scores
+
+def fuse(ranked_lists: list, method: FusionMethod = FusionMethod.RRF, top_n=1000, k=60, weights: list = None,
+         normalization: ScoreNormalization = ScoreNormalization.MINMAX, depth: int = None) -> list:
+    """
+    Fuses the ranked lists of one query into one.
+
+    Args:
+        ranked_lists (list): Lists of (id, score) tuples, each ordered by descending score.
+        method (FusionMethod): rrf sums 1 / (k + rank) over the lists a document is in; combsum sums its normalized scores;
+            combmnz multiplies that sum by the number of lists it is in; weighted sums its normalized scores times the weight of each list.
+        top_n (int): Number of fused results to return.
+        k (int): Parameter k of reciprocal rank fusion.
+        weights (list): Weight of every list, for weighted fusion. Default is an equal share each.
+        normalization (ScoreNormalization): How the scores of every list are rescaled before they are combined. Not considered for rrf.
+        depth (int): Number of results of every list to fuse. Default is all of them.
+
+    Returns:
+        list: (id, score) tuples ordered by descending fused score, documents tied on score in the order they are first seen.
+    """
+    ranked_lists = [results[:depth] if depth else results for results in ranked_lists]
+    if weights is None:
+        weights = [1.0 / len(ranked_lists)] * len(ranked_lists) if method == FusionMethod.WEIGHTED else [1.0] * len(ranked_lists)
+    elif len(weights) != len(ranked_lists):
+        raise ValueError(f"Expected a weight for each of the {len(ranked_lists)} ranked lists, got {len(weights)}.")
+    positions = {}
+    rows = []
+    contributions = []
+    for results, weight in zip(ranked_lists, weights):
+        if not results:
+            continue
+        rows.append(np.fromiter((positions.setdefault(doc_id, len(positions)) for doc_id, _ in results), dtype=np.int64, count=len(results)))
+        if method == FusionMethod.RRF:
+            contributions.append(weight / (k + np.arange(1, len(results) + 1, dtype=np.float64)))
+        else:
+            scores = np.fromiter((score for _, score in results), dtype=np.float64, count=len(results))
+            contributions.append(weight * normalize_scores(scores, normalization))
+    if not positions:
+        return []
+    rows = np.concatenate(rows)
+    fused = np.bincount(rows, weights=np.concatenate(contributions), minlength=len(positions))
+    if method == FusionMethod.COMBMNZ:
+        fused *= np.bincount(rows, minlength=len(positions))
+    order = np.lexsort((np.arange(len(positions)), -fused))[:top_n]
+    doc_ids = list(positions)
+    return [(doc_ids[row], float(fused[row])) for row in order.tolist()]
+
+def read_run(path: str) -> dict:
+    """Reads a run file in TREC format into lists of (id, score) tuples keyed by query id, each ordered by rank."""
+    runs = {}
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 6:
+                continue
+            query_id, _, doc_id, rank, score = parts[:5]
+            runs.setdefault(query_id, []).append((int(rank), doc_id, float(score)))
+    return {query_id: [(doc_id, score) for _, doc_id, score in sorted(results, key=lambda result: (result[0], -result[2]))]
+            for query_id, results in runs.items()}
+
+def fuse_runs(runs: list, method: FusionMethod = FusionMethod.RRF, top_n=1000, k=60, weights: list = None,
+              normalization: ScoreNormalization = ScoreNormalization.MINMAX, depth: int = None) -> dict:
+    """
+    Fuses runs read with read_run query by query, as in fuse. A query missing from some of the runs is fused from the others,
+    which keep their weights.
+
+    Returns:
+        dict: Fused (id, score) tuples keyed by query id, with the queries in the order they are first seen.
+    """
+    query_ids = list(dict.fromkeys(query_id for run in runs for query_id in run))
+    if weights is None:
+        weights = [1.0 / len(runs)] * len(runs) if method == FusionMethod.WEIGHTED else [1.0] * len(runs)
+    elif len(weights) != len(runs):
+        raise ValueError(f"Expected a weight for each of the {len(runs)} runs, got {len(weights)}.")
+    fused = {}
+    for query_id in query_ids:
+        present = [(run[query_id], weight) for run, weight in zip(runs, weights) if query_id in run]
+        fused[query_id] = fuse([results for results, _ in present], method, top_n, k, [weight for _, weight in present], normalization, depth)
+    return fused
+
+def write_run(results: dict, path: str, run_tag: str):
+    """Writes (id, score) tuples keyed by query id to a run file in TREC format."""
+    with open(path, 'w') as f:
+        for query_id, query_results in results.items():
+            for rank, (doc_id, score) in enumerate(query_results, 1):
+                f.write(f"{query_id} Q0 {doc_id} {rank} {score} {run_tag}\n")
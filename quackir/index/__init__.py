@@ -16,4 +16,5 @@
 
 from ._duck import DuckDBIndexer
 from ._postgres import PostgresIndexer
-from ._sqlite import SQLiteIndexer
\ No newline at end of file
+from ._sqlite import SQLiteIndexer
+from ._shard import ShardedIndexer
\ No newline at end of file
@@ -14,8 +14,13 @@
 # limitations under the License.
 #
 
-from quackir._base import IndexType, _add_db_parser_arguments, _load_env, SearchDB, sanitize_table_name
+from quackir._base import IndexType, ANNType, AnalyzerType, UpdateMode, EmbeddingPrecision, _add_db_parser_arguments, _load_env, SearchDB, sanitize_table_name
 from ._util import get_indexer
+from ._shard import ShardedIndexer
+from ._base import DEFAULT_CHUNK_SIZE
+from ._sqlite import FTS_DETAILS, SQLITE_PRAGMAS
+from quackir.search._matrix import MATRIX_DTYPES
+from quackir.analysis import set_analyzer, set_analysis_cache, save_analysis_cache
 import sys
 import argparse
 import os
@@ -29,31 +34,113 @@ if __name__ == "__main__":
     parser.add_argument("--index", type=str, default="corpus", help="Name of the table to create")
     parser.add_argument("--pretokenized", action='store_true', default=False, help="Indicates if the contents are pretokenized. Default is False, meaning the contents will be tokenized during indexing.")
     parser.add_argument("--dimension", type=int, default=768, help="Dimension of the embedding vector")
+    parser.add_argument("--precision", type=EmbeddingPrecision, choices=list(EmbeddingPrecision), default=None, help="How embeddings of a dense index are stored. DuckDB supports float64, float32 and int8; PostgreSQL supports float32 and float16. Default is float64 in DuckDB and float32 in PostgreSQL.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Number of jsonl lines or parquet rows to read, tokenize and insert at a time.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes to tokenize contents with, each loading its own analyzer. For a folder, each process reads and tokenizes whole files. Not considered if the contents are pretokenized.")
+    parser.add_argument("--analyzer", type=AnalyzerType, choices=list(AnalyzerType), default=AnalyzerType.LUCENE, help="Analyzer to tokenize contents with: Pyserini's Lucene analyzer, or its pure Python port that does not start a JVM.")
+    parser.add_argument("--analysis-cache", type=str, default=None, help="Path to a vocabulary file that caches the analyzed form of every word, loaded if it exists and saved when done.")
+    parser.add_argument("--dense-matrix", type=str, default=None, help="Directory to export the embeddings of a dense index to, as a memory-mapped matrix for quackir.search.")
+    parser.add_argument("--dense-matrix-dtype", type=str, choices=MATRIX_DTYPES, default="float32", help="Precision of the exported dense matrix.")
+    parser.add_argument("--impact-index", type=str, default=None, help="Directory to export the BM25 index of a sparse DuckDB index to, as memory-mapped postings for quackir.search.")
+    parser.add_argument("--ann-index", type=ANNType, choices=list(ANNType), default=None, help="Approximate nearest neighbor index to build over a dense index. DuckDB supports hnsw; PostgreSQL supports hnsw and ivfflat.")
+    parser.add_argument("--ann-m", type=int, default=None, help="Maximum number of neighbors per node of an hnsw index.")
+    parser.add_argument("--ann-ef-construction", type=int, default=None, help="Size of the candidate list while building an hnsw index.")
+    parser.add_argument("--ann-lists", type=int, default=None, help="Number of lists of an ivfflat index.")
+    parser.add_argument("--fts-detail", type=str, choices=FTS_DETAILS, default=None, help="Detail an SQLite FTS5 index keeps of every term: positions (full), columns, or only the rows it appears in. Default is full.")
+    parser.add_argument("--fts-contentless", action='store_true', default=False, help="Build a contentless SQLite FTS5 index, which only indexes the contents and finds ids through the table.")
+    parser.add_argument("--fts-pgsz", type=int, default=None, help="Page size in bytes of the b-tree of an SQLite FTS5 index.")
+    parser.add_argument("--fts-automerge", type=int, default=None, help="Number of segments of a level an SQLite FTS5 index merges as it grows, or 0 to leave merging to --fts-optimize.")
+    parser.add_argument("--fts-crisismerge", type=int, default=None, help="Number of segments of a level at which an SQLite FTS5 index merges them at once.")
+    parser.add_argument("--fts-optimize", action='store_true', default=False, help="Merge all segments of an SQLite FTS5 index into one once it is built.")
+    parser.add_argument("--sqlite-pragmas", type=str, nargs='+', default=[], metavar="NAME=VALUE", help=f"Pragmas to set on the SQLite connection while indexing, any of {', '.join(SQLITE_PRAGMAS)}.")
+    parser.add_argument("--no-bulk-load", action='store_true', default=False, help="Insert jsonl rows from Python even when the database's native bulk loading path applies.")
+    update_group = parser.add_mutually_exclusive_group()
+    update_group.add_argument("--append", dest="update", action='store_const', const=UpdateMode.APPEND, default=None, help="Add the input to the existing table, updating its indexes in place instead of rebuilding them. Ids are expected to be new.")
+    update_group.add_argument("--upsert", dest="update", action='store_const', const=UpdateMode.UPSERT, help="Add the input to the existing table like --append, replacing rows whose id is already in it.")
+    parser.add_argument("--resume", action='store_true', default=False, help="Keep the table if files were loaded into it before, and skip the files its manifest records as loaded.")
+    parser.add_argument("--shards", type=int, default=1, help="Number of shards to partition the index into by a hash of the id, each a table with its own full text search or approximate nearest neighbor index, searched concurrently with quackir.search --shards. Not supported in SQLite.")
+    parser.add_argument("--shard-files", action='store_true', default=False, help="Keep every shard of a DuckDB index in a database file of its own, named after --db-path, instead of a table of its own in --db-path.")
+    parser.add_argument("--profile-log", type=str, default=None, help="Path to append the wall time, rows per second and peak memory of every phase of indexing to, in jsonl format.")
 
     args = parser.parse_args()
     _load_env(args)
+    set_analyzer(args.analyzer)
+    set_analysis_cache(path=args.analysis_cache)
     if args.db_type == SearchDB.SQLITE and args.index_type != IndexType.SPARSE:
         print("Sorry, SQLite indexing currently only supports the sparse method.")
         sys.exit()
 
+    if args.db_type == SearchDB.DUCKDB and args.ann_index and args.update is None and args.precision != EmbeddingPrecision.FLOAT32:
+        raise ValueError("DuckDB's hnsw index only indexes single precision arrays. Index with --precision float32.")
+
+    if os.path.isdir(args.input):
+        with os.scandir(args.input) as files:
+            file_paths = sorted(file.path for file in files if file.is_file())
+    else:
+        file_paths = [args.input]
+    args.index = sanitize_table_name(args.index)
+
+    if args.shards > 1:
+        if args.update is not None or args.resume:
+            raise ValueError("Sharded indexes are built anew, and cannot be updated in place or resumed.")
+        if args.dense_matrix or args.impact_index:
+            raise ValueError("Sharded indexes cannot be exported to a dense matrix or an impact index.")
+        indexer = ShardedIndexer(args.db_type, args.index, args.shards, db_path=args.db_path, db_name=args.db_name,
+                                 db_user=args.db_user, separate_files=args.shard_files)
+        if args.profile_log:
+            indexer.enable_profile(args.profile_log)
+        indexer.init_tables(args.index_type, args.dimension, args.precision)
+        indexer.load_files(file_paths, args.index_type, args.pretokenized, args.chunk_size, not args.no_bulk_load, args.workers)
+        if args.analysis_cache:
+            save_analysis_cache()
+        print(f"{indexer.get_num_rows()} rows partitioned into {args.shards} shards of {args.index}")
+        if args.index_type == IndexType.SPARSE:
+            indexer.fts_index()
+            print("Sparse index created in every shard.")
+        elif args.ann_index:
+            indexer.ann_index(args.ann_index, {"m": args.ann_m, "ef_construction": args.ann_ef_construction, "lists": args.ann_lists})
+            print(f"{args.ann_index.value} index created in every shard.")
+        indexer.close()
+        sys.exit()
+
     indexer = get_indexer(
         db_type=args.db_type,
         db_path=args.db_path,
         db_name=args.db_name,
         db_user=args.db_user
     )
+    if args.profile_log:
+        indexer.enable_profile(args.profile_log)
+    if args.sqlite_pragmas and args.db_type == SearchDB.SQLITE:
+        indexer.set_pragmas(dict(pragma.split("=", 1) for pragma in args.sqlite_pragmas))
 
-    args.index = sanitize_table_name(args.index)
-    indexer.init_table(args.index, args.index_type, args.dimension)
-    
-    if os.path.isdir(args.input):
-        with os.scandir(args.input) as files:
-            for file in files:
-                if file.is_file():
-                    indexer.load_table(args.index, file.path, args.index_type, args.pretokenized)
+    if args.update is not None:
+        print(f"Updating {args.index} in place.")
+    elif args.resume and indexer.loaded_files(args.index):
+        print(f"Resuming {args.index}, skipping the files loaded before.")
     else:
-        indexer.load_table(args.index, args.input, args.index_type, args.pretokenized)
+        indexer.init_table(args.index, args.index_type, args.dimension, args.precision)
+    
+    indexer.load_files(args.index, file_paths, args.index_type, args.pretokenized, args.chunk_size, not args.no_bulk_load, args.workers, args.resume, args.update)
+    if args.analysis_cache:
+        save_analysis_cache()
     
+    table_info = indexer.table_info(args.index)
     if args.index_type == IndexType.SPARSE:
-        indexer.fts_index(args.index)
-        print("Sparse index created.")
\ No newline at end of file
+        if args.update is not None and table_info.has_fts_index:
+            print("Sparse index updated.")
+        else:
+            fts_params = {"detail": args.fts_detail, "contentless": args.fts_contentless, "pgsz": args.fts_pgsz,
+                          "automerge": args.fts_automerge, "crisismerge": args.fts_crisismerge, "optimize": args.fts_optimize}
+            indexer.fts_index(args.index, fts_params)
+            print("Sparse index created.")
+        if args.impact_index:
+            indexer.export_impact_index(args.index, args.impact_index, args.chunk_size)
+    else:
+        if args.dense_matrix:
+            indexer.export_dense_matrix(args.index, args.dense_matrix, args.dense_matrix_dtype, args.chunk_size)
+        if args.ann_index and args.update is not None and table_info.has_ann_index:
+            print("Approximate nearest neighbor index updated.")
+        elif args.ann_index:
+            indexer.ann_index(args.index, args.ann_index, {"m": args.ann_m, "ef_construction": args.ann_ef_construction, "lists": args.ann_lists})
+            print(f"{args.ann_index.value} index created.")
@@ -14,50 +14,445 @@
 # limitations under the License.
 #
 
-from abc import ABC, abstractmethod
-from quackir._base import IndexType
+from abc import abstractmethod
+from quackir._base import IndexType, ANNType, UpdateMode, EmbeddingPrecision, TableInfoCache, VERSION_TABLE
+from quackir.analysis import tokenize_chunks, analyzer_process_pool, record_analyzed_words, take_analyzed_words, merge_analyzed_words
+from quackir.search._matrix import DenseMatrix
+from ._profile import IndexProfile, profiled
+from collections import deque
+from itertools import islice
+from time import perf_counter
+from tqdm import tqdm
+import tempfile
+import uuid
+import pyarrow as pa
+import pyarrow.dataset as ds
+import gzip
+import json
+import os
+
+DEFAULT_CHUNK_SIZE = 10000
+# records the files loaded into every table, so that loading a folder can be resumed
+MANIFEST_TABLE = "quackir_manifest"
+
+def read_jsonl_chunks(file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, workers=1, profile: IndexProfile = None):
+    """
+    Streams rows from a jsonl file, which can be compressed with gzip, so that memory stays flat regardless of its size.
+    Contents are tokenized a chunk at a time, in a pool of worker processes if workers is more than 1.
+    Time spent reading, parsing and tokenizing, and inserting while the caller holds a chunk, goes to the profile if given.
+    With workers, tokenizing is the time spent waiting on them.
+
+    Yields:
+        list: At most chunk_size (id, contents) rows for sparse indexes, with the contents tokenized unless pretokenized,
+        or (id, vector) rows for dense indexes.
+    """
+    if profile is None:
+        profile = IndexProfile()
+
+    def read_docs():
+        open_cmd = gzip.open if file_path.endswith('.gz') else open
+        with open_cmd(file_path, 'rt') as file:
+            while True:
+                start = perf_counter()
+                lines = list(islice(file, chunk_size))
+                read = perf_counter()
+                profile.add("read", read - start)
+                if not lines:
+                    break
+                docs = [json.loads(line) for line in lines if line.strip()]
+                profile.add("parse", perf_counter() - read)
+                yield docs
+
+    def rows():
+        if index_type != IndexType.SPARSE:
+            for docs in read_docs():
+                yield [(d["id"], d["vector"]) for d in docs]
+        elif pretokenized:
+            for docs in read_docs():
+                yield [(d["id"], d["contents"]) for d in docs]
+        else:
+            pending_ids = deque()
+
+            def contents():
+                for docs in read_docs():
+                    pending_ids.append([d["id"] for d in docs])
+                    yield [d["contents"] for d in docs]
+
+            tokenized_chunks = tokenize_chunks(contents(), workers)
+            while True:
+                # reading and parsing happen within the tokenizer's loop, and are not tokenizing
+                start = perf_counter()
+                reading = profile.elapsed("read", "parse")
+                tokenized = next(tokenized_chunks, None)
+                profile.add("tokenize", perf_counter() - start - (profile.elapsed("read", "parse") - reading))
+                if tokenized is None:
+                    break
+                yield list(zip(pending_ids.popleft(), tokenized))
+
+    for chunk in rows():
+        start = perf_counter()
+        yield chunk
+        profile.add("insert", perf_counter() - start)
+
+def read_parquet_batches(file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, workers=1, profile: IndexProfile = None):
+    """
+    Streams a parquet file as Arrow record batches of at most chunk_size rows, read with pyarrow.dataset, so that only
+    the id and contents or vector columns are read and memory stays flat regardless of the size of the file. The id is
+    the column named id, or else the first column, and the contents or vector is the column of that name, or else the
+    second column. Contents are tokenized a batch at a time as in read_jsonl_chunks, unless pretokenized.
+
+    Yields:
+        pyarrow.RecordBatch: At most chunk_size rows with the columns id and contents for sparse indexes, or id and vector for dense indexes.
+    """
+    if profile is None:
+        profile = IndexProfile()
+    value_name = "contents" if index_type == IndexType.SPARSE else "vector"
+    dataset = ds.dataset(file_path, format="parquet")
+    names = dataset.schema.names
+    if len(names) < 2:
+        raise ValueError(f"Expected an id column and a {value_name} column in {file_path}, got {names}.")
+    id_column = "id" if "id" in names else names[0]
+    value_column = value_name if value_name in names else next(name for name in names if name != id_column)
+
+    def read_batches():
+        batches = iter(dataset.to_batches(columns=[id_column, value_column], batch_size=chunk_size))
+        while True:
+            start = perf_counter()
+            batch = next(batches, None)
+            profile.add("read", perf_counter() - start)
+            if batch is None:
+                break
+            if batch.num_rows > 0:
+                yield pa.RecordBatch.from_arrays([batch.column(0).cast(pa.string()), batch.column(1)], names=["id", value_name])
+
+    def batches():
+        if index_type != IndexType.SPARSE or pretokenized:
+            yield from read_batches()
+            return
+        pending_ids = deque()
+
+        def contents():
+            for batch in read_batches():
+                pending_ids.append(batch.column(0))
+                yield batch.column(1).to_pylist()
+
+        tokenized_chunks = tokenize_chunks(contents(), workers)
+        while True:
+            start = perf_counter()
+            reading = profile.elapsed("read")
+            tokenized = next(tokenized_chunks, None)
+            profile.add("tokenize", perf_counter() - start - (profile.elapsed("read") - reading))
+            if tokenized is None:
+                break
+            yield pa.RecordBatch.from_arrays([pending_ids.popleft(), pa.array(tokenized, type=pa.string())], names=["id", value_name])
+
+    for batch in batches():
+        start = perf_counter()
+        yield batch
+        profile.add("insert", perf_counter() - start)
+
+def is_loadable(file_path: str) -> bool:
+    return file_path.endswith('.jsonl') or file_path.endswith('.jsonl.gz') or file_path.endswith('.parquet')
+
+def stage_tokenized_file(file_path: str, staging_path: str, chunk_size=DEFAULT_CHUNK_SIZE) -> tuple:
+    """
+    Tokenizes the contents of a jsonl or parquet file into a pretokenized jsonl file, in a worker process of Indexer.load_files.
+
+    Returns:
+        tuple: The staging path, and the words the worker analyzed, for the parent's analysis cache.
+    """
+    record_analyzed_words()
+    if file_path.endswith('.parquet'):
+        chunks = (zip(batch.column(0).to_pylist(), batch.column(1).to_pylist()) for batch in read_parquet_batches(file_path, IndexType.SPARSE, chunk_size=chunk_size))
+    else:
+        chunks = read_jsonl_chunks(file_path, IndexType.SPARSE, chunk_size=chunk_size)
+    with open(staging_path, 'w') as f:
+        for rows in chunks:
+            f.write(''.join(json.dumps({"id": id, "contents": contents}) + "\n" for id, contents in rows))
+    return staging_path, take_analyzed_words()
+
+class Indexer(TableInfoCache):
+    # placeholder for query parameters in the database's driver
+    PARAM = "?"
+
+    def __init__(self):
+        super().__init__()
+        self.profile = IndexProfile()
+        self.manifest_name = None
+
+    def enable_profile(self, log_path: str = None):
+        """
+        Records the wall time, rows per second and peak memory of every phase of loading and indexing tables,
+        in profile.records, and appended to log_path in jsonl format if given.
+        """
+        self.profile.enable(log_path)
 
-class Indexer(ABC):
-    @abstractmethod
     def get_index_type(self, table_name: str) -> IndexType:
-        pass
+        return self.table_info(table_name).index_type
 
-    @abstractmethod
     def get_num_rows(self, table_name: str) -> int:
         """Get the number of rows in the specified table."""
-        pass
+        return self.table_info(table_name).num_rows
 
-    def load_table(self, table_name: str, file_path: str, index_type: IndexType = None, pretokenized=False):
-        """Load data into the specified table."""
+    def load_table(self, table_name: str, file_path: str, index_type: IndexType = None, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, bulk=True, workers=1, manifest_name: str = None, update: UpdateMode = None):
+        """
+        Load data into the specified table.
+        If manifest_name is given, the file is recorded under it in the manifest, in the same transaction that loads it.
+        If update is given, rows are appended or upserted into a table that already exists, with its full text search index
+        kept up to date in place, as described in update_jsonl_table.
+        """
         if index_type == None:
             index_type = self.get_index_type(table_name)
-        if file_path.endswith('.jsonl'):
-            self.load_jsonl_table(table_name, file_path, index_type, pretokenized)
-        elif file_path.endswith('.parquet'):
-            if index_type != IndexType.DENSE:
-                raise ValueError("Loading parquet currently only supports dense indexes")
-            self.load_parquet_table(table_name, file_path, index_type, pretokenized)
-        else:
+        if not is_loadable(file_path):
             return
+        num_rows = self.get_num_rows(table_name)
+        self.manifest_name = manifest_name
+        try:
+            with self.profile.operation("load_table", self, table_name, file_path, count_rows=lambda: self.get_num_rows(table_name) - num_rows):
+                if file_path.endswith('.parquet'):
+                    if update == UpdateMode.UPSERT:
+                        raise ValueError("Upserting currently only supports jsonl files")
+                    if update is not None and index_type == IndexType.SPARSE:
+                        raise ValueError("Updating sparse tables in place currently only supports jsonl files")
+                    self.load_parquet_table(table_name, file_path, index_type, pretokenized, chunk_size, workers)
+                elif update is not None:
+                    self.update_jsonl_table(table_name, file_path, index_type, pretokenized, chunk_size, bulk, workers, update == UpdateMode.UPSERT)
+                else:
+                    self.load_jsonl_table(table_name, file_path, index_type, pretokenized, chunk_size, bulk, workers)
+                self.mark_changed(table_name)
+        finally:
+            self.manifest_name = None
         
         print(f"{self.get_num_rows(table_name)} rows loaded into {table_name} with {self.__class__.__name__}")
 
+    def load_files(self, table_name: str, file_paths: list, index_type: IndexType = None, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, bulk=True, workers=1, resume=False, update: UpdateMode = None):
+        """
+        Loads files into a table in the order given, with a progress bar across them. Every file is recorded in the manifest
+        under its name in the same transaction that loads it, and with resume, files recorded before are skipped,
+        so that a load that was stopped picks up after the last file it finished. With update, files are appended or upserted
+        as in load_table.
+        With more than one worker and contents to tokenize, whole files are read and tokenized in parallel, one per worker process,
+        into pretokenized staging files in the temporary directory. This process loads them in order, as the only writer,
+        through the database's bulk loading path.
+        """
+        if index_type == None:
+            index_type = self.get_index_type(table_name)
+        file_paths = [file_path for file_path in file_paths if is_loadable(file_path)]
+        loaded = self.loaded_files(table_name) if resume else set()
+        pending = [file_path for file_path in file_paths if os.path.basename(file_path) not in loaded]
+        with tqdm(total=len(file_paths), initial=len(file_paths) - len(pending), desc=f"Loading {table_name}", unit="file") as progress:
+            if workers <= 1 or index_type != IndexType.SPARSE or pretokenized or len(pending) <= 1:
+                for file_path in pending:
+                    self.load_table(table_name, file_path, index_type, pretokenized, chunk_size, bulk, workers, os.path.basename(file_path), update)
+                    progress.update(1)
+                return
+            with tempfile.TemporaryDirectory(prefix="quackir-") as staging_dir, analyzer_process_pool(workers) as executor:
+                # one file ahead of the workers, so that they are not idle while the next file is loaded
+                in_flight = deque()
+
+                def load_next():
+                    file_path, staged = in_flight.popleft()
+                    with self.profile.operation("wait_for_staging", self, table_name):
+                        staging_path, analyzed = staged.result()
+                    merge_analyzed_words(analyzed)
+                    self.load_table(table_name, staging_path, index_type, True, chunk_size, bulk, 1, os.path.basename(file_path), update)
+                    os.remove(staging_path)
+                    progress.update(1)
+
+                for i, file_path in enumerate(pending):
+                    in_flight.append((file_path, executor.submit(stage_tokenized_file, file_path, os.path.join(staging_dir, f"{i}.jsonl"), chunk_size)))
+                    if len(in_flight) > workers:
+                        load_next()
+                while in_flight:
+                    load_next()
+
+    def execute(self, query: str, params=()) -> list:
+        """Runs a statement in the connection's current transaction, returning the rows it selects."""
+        cur = self.conn.cursor()
+        cur.execute(query, params)
+        rows = cur.fetchall() if cur.description else []
+        cur.close()
+        return rows
+
+    def init_manifest(self):
+        self.execute(f"CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (table_name TEXT, file_name TEXT)")
+
+    def loaded_files(self, table_name: str) -> set:
+        """Names of the files recorded in the manifest as loaded into a table."""
+        self.init_manifest()
+        rows = self.execute(f"SELECT file_name FROM {MANIFEST_TABLE} WHERE table_name = {self.PARAM}", (table_name,))
+        self.conn.commit()
+        return {row[0] for row in rows}
+
+    def record_loaded_file(self, table_name: str):
+        """
+        Records the file being loaded in the manifest, if load_table was given a name for it.
+        Backends call this right before committing a load, so that a file is either loaded and recorded, or neither.
+        """
+        if self.manifest_name is None:
+            return
+        self.init_manifest()
+        self.execute(f"INSERT INTO {MANIFEST_TABLE} (table_name, file_name) VALUES ({self.PARAM}, {self.PARAM})", (table_name, self.manifest_name))
+
+    def forget_loaded_files(self, table_name: str):
+        """Removes a table from the manifest, once it is created anew."""
+        self.init_manifest()
+        self.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE table_name = {self.PARAM}", (table_name,))
+        self.conn.commit()
+
+    def mark_changed(self, table_name: str):
+        """
+        Forgets what is known about a table once a change to it is complete, and stamps it with a new version
+        for cached search results, once per load, update, delete or index build rather than on every refresh.
+        """
+        self.invalidate_table_info(table_name)
+        self.stamp_version(table_name)
+
+    def stamp_version(self, table_name: str):
+        self.execute(f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (table_name TEXT PRIMARY KEY, version TEXT)")
+        self.execute(f"DELETE FROM {VERSION_TABLE} WHERE table_name = {self.PARAM}", (table_name,))
+        self.execute(f"INSERT INTO {VERSION_TABLE} (table_name, version) VALUES ({self.PARAM}, {self.PARAM})", (table_name, uuid.uuid4().hex))
+        self.conn.commit()
+
     @abstractmethod
-    def load_parquet_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False):
+    def load_parquet_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+        """
+        Load a parquet file into the specified table in a single transaction, as Arrow record batches from read_parquet_batches,
+        so that neither the file nor the table's share of it is ever held in memory at once.
+        """
         pass
 
+    def read_jsonl_chunks(self, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+        return read_jsonl_chunks(file_path, index_type, pretokenized, chunk_size, workers, self.profile)
+
+    def read_parquet_batches(self, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+        return read_parquet_batches(file_path, index_type, pretokenized, chunk_size, workers, self.profile)
+
+    @staticmethod
+    def can_bulk_load(index_type: IndexType, pretokenized=False) -> bool:
+        """Whether rows can go from a jsonl file to the database as they are, without tokenization in Python."""
+        return index_type == IndexType.DENSE or pretokenized
+
     @abstractmethod
-    def load_jsonl_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False):
+    def load_jsonl_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, bulk=True, workers=1):
+        """
+        Load a jsonl file into the specified table.
+        If bulk is set, the database's native bulk loading path is used whenever it applies.
+        Otherwise, contents are tokenized by the given number of worker processes.
+        """
         pass
     
+    def update_jsonl_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, bulk=True, workers=1, upsert=False):
+        """
+        Adds the rows of a jsonl file to a table that already exists, in a single transaction. If the full text search index
+        of a sparse table has been built, it is updated in place instead of being rebuilt, and so are approximate nearest
+        neighbor indexes. With upsert, rows whose id is already in the table are replaced; otherwise, ids are expected to be new.
+        """
+        raise ValueError(f"{self.__class__.__name__} does not support updating tables in place.")
+
+    def delete_rows(self, table_name: str, ids: list):
+        """Deletes the rows with the given ids from a table, updating its full text search index in place."""
+        raise ValueError(f"{self.__class__.__name__} does not support deleting rows.")
+
     @abstractmethod
-    def init_table(self, table_name: str, index_type: IndexType, embedding_dim=768): 
+    def init_table(self, table_name: str, index_type: IndexType, embedding_dim=768, precision: EmbeddingPrecision = None):
+        """
+        Creates an empty table, replacing any table of the same name.
+
+        Args:
+            precision (EmbeddingPrecision): How the embeddings of a dense table are stored. Default is the widest type the database has.
+        """
         pass
     
     @abstractmethod
-    def fts_index(self, table_name: str = "corpus"):
-        """Perform the indexing operation."""
+    def fts_index(self, table_name: str = "corpus", params: dict = None):
+        """
+        Perform the indexing operation. Implementations are wrapped with @profiled("fts_index").
+
+        Args:
+            params (dict): Options of the full text search index where the database has any, as for SQLite's FTS5.
+        """
         pass
 
+    def ann_index(self, table_name: str, method: ANNType = ANNType.HNSW, params: dict = None):
+        """
+        Builds an approximate nearest neighbor index over the embeddings of a dense table, for cosine similarity.
+
+        Args:
+            method (ANNType): hnsw, or ivfflat where supported.
+            params (dict): Build parameters: m and ef_construction for hnsw, lists for ivfflat. Unset ones use the database's defaults.
+        """
+        raise ValueError(f"{self.__class__.__name__} does not support approximate nearest neighbor indexes.")
+
+    def bm25_stats(self, table_name: str) -> tuple:
+        """
+        Returns the statistics BM25 scores a sparse table with, once its full text search index is built.
+
+        Returns:
+            tuple: The number of documents, their total length, and a pyarrow.Table of the document frequency df of every term.
+        """
+        raise ValueError(f"{self.__class__.__name__} does not support changing BM25 statistics.")
+
+    def set_bm25_stats(self, table_name: str, num_docs: int, avgdl: float, dfs: pa.Table):
+        """
+        Replaces the statistics BM25 scores a sparse table with, so that it is scored as part of a larger collection,
+        as the shards of a ShardedIndexer are. Terms of the table missing from dfs keep their document frequency.
+
+        Args:
+            dfs (pyarrow.Table): The document frequency df of every term, in the larger collection.
+        """
+        raise ValueError(f"{self.__class__.__name__} does not support changing BM25 statistics.")
+
+    def export_impact_index(self, table_name: str, path: str, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Exports the BM25 index of a sparse table to memory-mapped postings of precomputed impacts,
+        which searchers can attach to answer sparse search with early termination instead of a full scan.
+
+        Args:
+            path (str): Directory to write the index to.
+        """
+        raise ValueError(f"{self.__class__.__name__} does not support exporting impact indexes.")
+
+    def iter_embeddings(self, table_name: str, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Streams the (id, embedding) rows of a dense table in chunks, at the full precision the table keeps."""
+        cur = self.conn.cursor()
+        cur.execute(f"SELECT id, {self.full_precision_column(table_name)} FROM {table_name}")
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            # pgvector columns are fetched as text
+            yield [(id, json.loads(embedding) if isinstance(embedding, str) else embedding) for id, embedding in rows]
+        cur.close()
+
+    def full_precision_column(self, table_name: str) -> str:
+        """The column holding the embeddings of a dense table at full precision."""
+        return "embedding"
+
+    @profiled("export_dense_matrix")
+    def export_dense_matrix(self, table_name: str, path: str, dtype="float32", chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Exports the embeddings of a dense table to a memory-mapped matrix of normalized rows,
+        which searchers can attach to answer dense and hybrid search without the database.
+
+        Args:
+            path (str): Directory to write the matrix to.
+            dtype (str): float32; float16 to halve the size of the matrix; or int8 to quantize every row with its scale,
+                keeping the float32 rows alongside to rescore the candidates found by scanning the int8 ones.
+        """
+        if self.get_index_type(table_name) != IndexType.DENSE:
+            raise ValueError(f"Only dense tables can be exported to a matrix, and {table_name} is not dense.")
+        num_rows = self.get_num_rows(table_name)
+        chunks = self.iter_embeddings(table_name, chunk_size)
+        first_chunk = next(chunks, [])
+        dimension = len(first_chunk[0][1]) if first_chunk else 0
+
+        def all_chunks():
+            yield first_chunk
+            yield from chunks
+
+        DenseMatrix.write(path, table_name, all_chunks(), num_rows, dimension, dtype)
+        print(f"{num_rows} embeddings from {table_name} exported to {path}")
+
     def close(self):
         self.conn.close()
\ No newline at end of file
@@ -14,53 +14,342 @@
 # limitations under the License.
 #
 
-from ._base import Indexer
-from quackir._base import IndexType
-from quackir.analysis import tokenize
+from ._base import Indexer, DEFAULT_CHUNK_SIZE
+from ._profile import profiled
+from quackir._base import IndexType, ANNType, EmbeddingPrecision, TableInfo
+from quackir.search._duck import describe_duckdb_table, embedding_precision, DUCKDB_EMBEDDING_TYPES, RESCORE_COLUMN
+from quackir.search._impact import ImpactIndex
+from quackir.search._matrix import quantize_rows
+from contextlib import contextmanager
+from itertools import chain
+import numpy as np
+import pyarrow as pa
 import duckdb
-import json
 
 class DuckDBIndexer(Indexer):
     def __init__(self, db_path="duck.db"):
+        super().__init__()
         self.conn = duckdb.connect(db_path)
 
-    def get_index_type(self, table_name: str) -> IndexType:
-        table_description = self.conn.execute(f"DESCRIBE {table_name}").fetchall()
-        column_names = [row[0] for row in table_description]
-        if "contents" in column_names:
-            return IndexType.SPARSE
-        elif "embedding" in column_names:
-            return IndexType.DENSE
-        else:
-            raise ValueError(f"Unknown index type for table {table_name}. Ensure it has either an 'embedding' column or a 'contents' column.")
+    def describe_table(self, table_name: str) -> TableInfo:
+        return describe_duckdb_table(self.conn, table_name)
+
+    def execute(self, query: str, params=()) -> list:
+        # a cursor would be a separate connection, outside of the current transaction
+        return self.conn.execute(query, params).fetchall()
+
+    @contextmanager
+    def transaction(self, table_name: str):
+        """Loads a file in a single transaction, which also records it in the manifest."""
+        self.conn.begin()
+        try:
+            yield
+            self.record_loaded_file(table_name)
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
 
-    def init_table(self, table_name: str, index_type: IndexType, embedding_dim=768):
+    def init_table(self, table_name: str, index_type: IndexType, embedding_dim=768, precision: EmbeddingPrecision = None):
+        precision = precision or EmbeddingPrecision.FLOAT64
+        if index_type == IndexType.DENSE and precision not in DUCKDB_EMBEDDING_TYPES:
+            raise ValueError(f"DuckDB has no {precision.value} type, use one of {', '.join(p.value for p in DUCKDB_EMBEDDING_TYPES)}.")
         self.conn.execute(f"""DROP TABLE IF EXISTS {table_name}""")
         if index_type == IndexType.SPARSE:
             self.conn.execute(f"""CREATE TABLE {table_name} (id VARCHAR, contents VARCHAR)""")
         elif index_type == IndexType.DENSE:
-            self.conn.execute(f"""CREATE TABLE {table_name} (id VARCHAR, embedding DOUBLE[{embedding_dim}])""")
+            rescore = f", {RESCORE_COLUMN} FLOAT[{embedding_dim}]" if precision == EmbeddingPrecision.INT8 else ""
+            self.conn.execute(f"""CREATE TABLE {table_name} (id VARCHAR, embedding {DUCKDB_EMBEDDING_TYPES[precision]}[{embedding_dim}]{rescore})""")
         else:
             raise ValueError(f"Unknown index type: {index_type}")
+        self.invalidate_table_info(table_name)
+        self.forget_loaded_files(table_name)
         
-    def load_jsonl_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False):
-        with open(file_path, 'r') as file:
-            data = [json.loads(line) for line in file]
-        rows = [[d["id"], d["contents"] if "contents" in d else d["vector"]] for d in data]
-        if index_type == IndexType.SPARSE and not pretokenized:
-            rows = [[d["id"], tokenize(d["contents"])] for d in data]
+    def load_jsonl_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, bulk=True, workers=1):
+        with self.transaction(table_name):
+            self.insert_jsonl(table_name, file_path, index_type, pretokenized, chunk_size, bulk, workers)
+
+    def insert_jsonl(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, bulk=True, workers=1):
+        if bulk and self.can_bulk_load(index_type, pretokenized):
+            with self.profile.phase("bulk_load"):
+                self.bulk_load_jsonl_table(table_name, file_path, index_type)
+            return
+        # rows may be staged in a temp table, whose precision is looked up here rather than cached
+        precision = self.column_precision(table_name) if index_type == IndexType.DENSE else None
+        for rows in self.read_jsonl_chunks(file_path, index_type, pretokenized, chunk_size, workers):
+            if index_type == IndexType.SPARSE:
+                self.conn.executemany(f"insert into {table_name} (id, contents) values (?, ?)", rows)
+            elif index_type == IndexType.DENSE:
+                self.insert_embeddings(table_name, rows, precision)
+
+    def column_precision(self, table_name: str) -> EmbeddingPrecision:
+        column_type = self.conn.execute("SELECT data_type FROM duckdb_columns() WHERE table_name = ? AND column_name = 'embedding'", [table_name]).fetchone()[0]
+        return embedding_precision(column_type)
+
+    def insert_embeddings(self, table_name: str, rows: list, precision: EmbeddingPrecision):
+        """
+        Inserts a chunk of (id, embedding) rows as an Arrow table of fixed size lists in the column's own precision,
+        which DuckDB scans in place instead of converting a Python list of floats per row.
+        """
+        vectors = np.asarray([embedding for _, embedding in rows], dtype=np.float64 if precision == EmbeddingPrecision.FLOAT64 else np.float32)
+        chunk = {"id": [str(id) for id, _ in rows]}
+        if precision == EmbeddingPrecision.INT8:
+            chunk[RESCORE_COLUMN] = pa.FixedSizeListArray.from_arrays(pa.array(vectors.reshape(-1)), vectors.shape[1])
+            vectors, _ = quantize_rows(vectors)
+        chunk["embedding"] = pa.FixedSizeListArray.from_arrays(pa.array(vectors.reshape(-1)), vectors.shape[1])
+        columns = self.embedding_columns(precision)
+        self.conn.register("quackir_chunk", pa.table(chunk))
+        try:
+            self.conn.execute(f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM quackir_chunk")
+        finally:
+            self.conn.unregister("quackir_chunk")
+
+    def full_precision_column(self, table_name: str) -> str:
+        # int8 tables keep the float32 vectors they were quantized from
+        return RESCORE_COLUMN if self.table_info(table_name).precision == EmbeddingPrecision.INT8 else "embedding"
+
+    @staticmethod
+    def embedding_columns(precision: EmbeddingPrecision) -> str:
+        """The columns rows of a dense table are inserted into, which for int8 tables include the float32 vectors they are rescored with."""
+        return f"id, embedding, {RESCORE_COLUMN}" if precision == EmbeddingPrecision.INT8 else "id, embedding"
+
+    @staticmethod
+    def embedding_select(source: str, id_column: str, vector_column: str, precision: EmbeddingPrecision) -> str:
+        """Builds a query selecting the embedding_columns of rows from source, quantizing the vectors for int8 columns."""
+        if precision != EmbeddingPrecision.INT8:
+            return f"SELECT {id_column} AS id, {vector_column} AS embedding FROM {source}"
+        # the same quantization as quantize_rows, with the largest absolute value of a row found once
+        return f"""
+            SELECT id, list_transform(vector, x -> coalesce(round(x * 127 / nullif(max_abs, 0)), 0)) AS embedding, vector::FLOAT[] AS {RESCORE_COLUMN}
+            FROM (SELECT {id_column} AS id, {vector_column} AS vector, list_max(list_transform({vector_column}, x -> abs(x))) AS max_abs FROM {source})
+        """
+
+    def update_jsonl_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, bulk=True, workers=1, upsert=False):
+        info = self.table_info(table_name)
+        if info.has_ann_index:
+            # tables with an hnsw index can only be changed with vss loaded
+            self.conn.execute("LOAD vss")
+        with self.transaction(table_name):
+            # rows are staged first, so that the full text search index is updated from them in one pass
+            self.conn.execute(f"CREATE OR REPLACE TEMP TABLE quackir_changes AS SELECT * FROM {table_name} LIMIT 0")
+            self.insert_jsonl("quackir_changes", file_path, index_type, pretokenized, chunk_size, bulk, workers)
+            self.check_new_ids(table_name, upsert)
+            with self.profile.phase("update_index"):
+                if upsert:
+                    self.remove_rows(table_name, "SELECT id FROM quackir_changes", info.has_fts_index)
+                if info.has_fts_index:
+                    self.add_fts_docs(table_name, "quackir_changes")
+            with self.profile.phase("insert"):
+                self.conn.execute(f"INSERT INTO {table_name} SELECT * FROM quackir_changes")
+            self.conn.execute("DROP TABLE quackir_changes")
+
+    def check_new_ids(self, table_name: str, upsert: bool):
+        """
+        Raises if the rows staged in quackir_changes repeat an id, or, unless upserting, have the id of a row of the table.
+        DuckDB tables have no primary key, so this stands in for the one PostgreSQL and SQLite enforce.
+        """
+        repeated = self.conn.execute("SELECT id FROM quackir_changes GROUP BY id HAVING COUNT(*) > 1 LIMIT 5").fetchall()
+        if repeated:
+            raise ValueError(f"The input repeats ids, such as {', '.join(row[0] for row in repeated)}.")
+        if upsert:
+            return
+        existing = self.conn.execute(f"SELECT id FROM quackir_changes SEMI JOIN {table_name} USING (id) LIMIT 5").fetchall()
+        if existing:
+            raise ValueError(f"Appended rows have ids already in {table_name}, such as {', '.join(row[0] for row in existing)}. Use --upsert to replace them.")
+
+    def delete_rows(self, table_name: str, ids: list):
+        info = self.table_info(table_name)
+        if info.has_ann_index:
+            self.conn.execute("LOAD vss")
+        with self.transaction(table_name):
+            self.conn.execute("CREATE OR REPLACE TEMP TABLE quackir_deleted (id VARCHAR)")
+            self.conn.executemany("INSERT INTO quackir_deleted VALUES (?)", [[id] for id in ids])
+            self.remove_rows(table_name, "SELECT id FROM quackir_deleted", info.has_fts_index)
+            self.conn.execute("DROP TABLE quackir_deleted")
+        self.mark_changed(table_name)
+
+    def remove_rows(self, table_name: str, ids_query: str, has_fts_index: bool):
+        if has_fts_index:
+            self.remove_fts_docs(table_name, ids_query)
+        self.conn.execute(f"DELETE FROM {table_name} WHERE id IN ({ids_query})")
+
+    def remove_fts_docs(self, table_name: str, ids_query: str):
+        """Takes documents out of the tables of the full text search index, as if they had never been indexed."""
+        fts_schema = f"fts_main_{table_name}"
+        self.conn.execute(f"CREATE OR REPLACE TEMP TABLE quackir_removed AS SELECT docid FROM {fts_schema}.docs WHERE name IN ({ids_query})")
+        self.conn.execute(f"""
+            UPDATE {fts_schema}.dict SET df = dict.df - removed.df
+            FROM (
+                SELECT termid, COUNT(DISTINCT docid) AS df
+                FROM {fts_schema}.terms
+                WHERE docid IN (SELECT docid FROM quackir_removed)
+                GROUP BY termid
+            ) AS removed
+            WHERE dict.termid = removed.termid
+        """)
+        self.conn.execute(f"DELETE FROM {fts_schema}.dict WHERE df <= 0")
+        self.conn.execute(f"DELETE FROM {fts_schema}.terms WHERE docid IN (SELECT docid FROM quackir_removed)")
+        self.conn.execute(f"DELETE FROM {fts_schema}.docs WHERE docid IN (SELECT docid FROM quackir_removed)")
+        self.conn.execute("DROP TABLE quackir_removed")
+        self.update_fts_stats(table_name)
+
+    def add_fts_docs(self, table_name: str, source_table: str):
+        """
+        Adds the rows of source_table to the tables of the full text search index, tokenized as create_fts_index does,
+        so that match_bm25 scores them as if the index had been rebuilt.
+        """
+        fts_schema = f"fts_main_{table_name}"
+        self.conn.execute(f"""
+            CREATE OR REPLACE TEMP TABLE quackir_added AS
+            SELECT (SELECT COALESCE(MAX(docid), -1) FROM {fts_schema}.docs) + ROW_NUMBER() OVER () AS docid, id AS name, contents
+            FROM {source_table}
+        """)
+        self.conn.execute(f"""
+            CREATE OR REPLACE TEMP TABLE quackir_added_terms AS
+            SELECT docid, term
+            FROM (SELECT docid, stem(unnest({fts_schema}.tokenize(contents)), 'none') AS term FROM quackir_added)
+            WHERE term <> ''
+        """)
+        self.conn.execute(f"""
+            INSERT INTO {fts_schema}.dict (termid, term, df)
+            SELECT (SELECT COALESCE(MAX(termid), -1) FROM {fts_schema}.dict) + ROW_NUMBER() OVER (ORDER BY term), term, 0
+            FROM (SELECT DISTINCT term FROM quackir_added_terms WHERE term NOT IN (SELECT term FROM {fts_schema}.dict))
+        """)
+        self.conn.execute(f"""
+            UPDATE {fts_schema}.dict SET df = dict.df + added.df
+            FROM (SELECT term, COUNT(DISTINCT docid) AS df FROM quackir_added_terms GROUP BY term) AS added
+            WHERE dict.term = added.term
+        """)
+        self.conn.execute(f"""
+            INSERT INTO {fts_schema}.terms (docid, fieldid, termid)
+            SELECT added.docid, (SELECT fieldid FROM {fts_schema}.fields WHERE field = 'contents'), dict.termid
+            FROM quackir_added_terms AS added
+            JOIN {fts_schema}.dict AS dict ON dict.term = added.term
+        """)
+        self.conn.execute(f"""
+            INSERT INTO {fts_schema}.docs (docid, name, len)
+            SELECT added.docid, added.name, COALESCE(doc_terms.len, 0)
+            FROM quackir_added AS added
+            LEFT JOIN (SELECT docid, COUNT(*) AS len FROM quackir_added_terms GROUP BY docid) AS doc_terms ON doc_terms.docid = added.docid
+        """)
+        self.conn.execute("DROP TABLE quackir_added_terms")
+        self.conn.execute("DROP TABLE quackir_added")
+        self.update_fts_stats(table_name)
+
+    def update_fts_stats(self, table_name: str):
+        fts_schema = f"fts_main_{table_name}"
+        self.conn.execute(f"""
+            UPDATE {fts_schema}.stats SET
+                num_docs = (SELECT COUNT(docid) FROM {fts_schema}.docs),
+                avgdl = (SELECT SUM(len) / COUNT(len) FROM {fts_schema}.docs)
+        """)
+
+    def bm25_stats(self, table_name: str) -> tuple:
+        fts_schema = f"fts_main_{table_name}"
+        num_docs, total_len = self.conn.execute(f"SELECT COUNT(*), COALESCE(SUM(len), 0) FROM {fts_schema}.docs").fetchone()
+        return num_docs, total_len, self.conn.execute(f"SELECT term, df FROM {fts_schema}.dict").arrow()
+
+    def set_bm25_stats(self, table_name: str, num_docs: int, avgdl: float, dfs: pa.Table):
+        fts_schema = f"fts_main_{table_name}"
+        self.conn.register("quackir_dfs", dfs)
+        try:
+            with self.transaction(table_name):
+                self.conn.execute(f"UPDATE {fts_schema}.dict SET df = dfs.df FROM quackir_dfs AS dfs WHERE dict.term = dfs.term")
+                self.conn.execute(f"UPDATE {fts_schema}.stats SET num_docs = ?, avgdl = ?", [num_docs, avgdl])
+        finally:
+            self.conn.unregister("quackir_dfs")
+        self.mark_changed(table_name)
+
+    def bulk_load_jsonl_table(self, table_name: str, file_path: str, index_type: IndexType):
+        file_path = file_path.replace("'", "''")
         if index_type == IndexType.SPARSE:
-            self.conn.executemany(f"insert into {table_name} (id, contents) values (?, ?)", rows)
+            self.conn.execute(f"""
+                INSERT INTO {table_name} (id, contents)
+                SELECT id, contents FROM read_json('{file_path}', format = 'newline_delimited', columns = {{'id': 'VARCHAR', 'contents': 'VARCHAR'}})
+            """)
         elif index_type == IndexType.DENSE:
-            self.conn.executemany(f"""insert into {table_name} (id, embedding) values (?, ?)""", rows)
- 
-    def load_parquet_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False):
-        column_names = self.conn.execute(f"DESCRIBE SELECT * FROM read_parquet('{file_path}')").fetchall()
-        self.conn.execute(f"""INSERT INTO {table_name} SELECT {column_names[0][0]} as id, {column_names[1][0]} as embedding FROM read_parquet('{file_path}')""")
-
-    def get_num_rows(self, table_name: str) -> int:
-        result = self.conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()
-        return result[0] if result else 0
-
-    def fts_index(self, table_name: str = "corpus"):
-        self.conn.execute(f"PRAGMA create_fts_index({table_name}, id, contents, stemmer = 'none', stopwords = 'none', ignore = 'a^', strip_accents = 0, lower = 0, overwrite = 1)")
\ No newline at end of file
+            source = f"read_json('{file_path}', format = 'newline_delimited', columns = {{'id': 'VARCHAR', 'vector': 'DOUBLE[]'}})"
+            precision = self.column_precision(table_name)
+            self.conn.execute(f"INSERT INTO {table_name} ({self.embedding_columns(precision)}) {self.embedding_select(source, 'id', 'vector', precision)}")
+
+    def load_parquet_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+        batches = self.read_parquet_batches(file_path, index_type, pretokenized, chunk_size, workers)
+        first_batch = next(batches, None)
+        with self.transaction(table_name):
+            if first_batch is None:
+                return
+            if index_type == IndexType.SPARSE:
+                columns, query = "id, contents", "SELECT id, contents FROM quackir_batches"
+            else:
+                precision = self.column_precision(table_name)
+                columns, query = self.embedding_columns(precision), self.embedding_select("quackir_batches", "id", "vector", precision)
+            # DuckDB scans the batches as they are produced, without converting them to Python objects
+            self.conn.register("quackir_batches", pa.RecordBatchReader.from_batches(first_batch.schema, chain([first_batch], batches)))
+            try:
+                self.conn.execute(f"INSERT INTO {table_name} ({columns}) {query}")
+            finally:
+                self.conn.unregister("quackir_batches")
+
+    @profiled("fts_index")
+    def fts_index(self, table_name: str = "corpus", params: dict = None):
+        self.conn.execute(f"PRAGMA create_fts_index({table_name}, id, contents, stemmer = 'none', stopwords = 'none', ignore = 'a^', strip_accents = 0, lower = 0, overwrite = 1)")
+        self.mark_changed(table_name)
+
+    @profiled("ann_index")
+    def ann_index(self, table_name: str, method: ANNType = ANNType.HNSW, params: dict = None):
+        if method != ANNType.HNSW:
+            raise ValueError(f"DuckDB only supports hnsw indexes, not {method.value}.")
+        params = params or {}
+        info = self.table_info(table_name)
+        if info.precision != EmbeddingPrecision.FLOAT32:
+            # converting the column would change what the table stores, and the scores of exact search over it
+            raise ValueError(f"vss only indexes single precision arrays, and {table_name} stores {info.precision.value} embeddings. Re-index it with --precision float32.")
+        self.conn.execute("INSTALL vss; LOAD vss; SET hnsw_enable_experimental_persistence = true")
+        options = ["metric = 'cosine'"]
+        if params.get("m") is not None:
+            options.append(f"M = {int(params['m'])}")
+        if params.get("ef_construction") is not None:
+            options.append(f"ef_construction = {int(params['ef_construction'])}")
+        self.conn.execute(f"DROP INDEX IF EXISTS {table_name}_hnsw")
+        self.conn.execute(f"CREATE INDEX {table_name}_hnsw ON {table_name} USING HNSW (embedding) WITH ({', '.join(options)})")
+        self.mark_changed(table_name)
+
+    @profiled("export_impact_index")
+    def export_impact_index(self, table_name: str, path: str, chunk_size=DEFAULT_CHUNK_SIZE):
+        if self.get_index_type(table_name) != IndexType.SPARSE:
+            raise ValueError(f"Only sparse tables can be exported to an impact index, and {table_name} is not sparse.")
+        fts_schema = f"fts_main_{table_name}"
+        # rows are numbered in id order, which breaks ties as DuckDB's search does, and every term has one posting per document
+        # of the table it occurs in, which is df unless the table is a shard scored with the document frequencies of the whole collection
+        ids = [row[0] for row in self.conn.execute(f"SELECT name FROM {fts_schema}.docs ORDER BY name").fetchall()]
+        term_counts = self.conn.execute(f"""
+            SELECT dict.term, COUNT(DISTINCT terms.docid)
+            FROM {fts_schema}.dict AS dict
+            JOIN {fts_schema}.terms AS terms ON terms.termid = dict.termid
+            GROUP BY dict.termid, dict.term
+            ORDER BY dict.termid
+        """).fetchall()
+        num_postings = sum(count for _, count in term_counts)
+        # the impact of a posting is its term's contribution to the BM25 score of the document, as in match_bm25
+        postings = self.conn.execute(f"""
+            WITH 
+            doc_rows AS (
+                SELECT docid, len, ROW_NUMBER() OVER (ORDER BY name) - 1 AS row
+                FROM {fts_schema}.docs
+            ),
+            term_tf AS (
+                SELECT termid, docid, COUNT(*) AS tf
+                FROM {fts_schema}.terms
+                GROUP BY termid, docid
+            )
+            SELECT CAST(doc_rows.row AS INTEGER) AS row,
+                log((((SELECT num_docs FROM {fts_schema}.stats) - dict.df) + 0.5) / (dict.df + 0.5) + 1) *
+                    ((tf * (0.9 + 1)) / (tf + (0.9 * ((1 - 0.4) + (0.4 * (len / (SELECT avgdl FROM {fts_schema}.stats))))))) AS impact
+            FROM term_tf
+            JOIN doc_rows ON doc_rows.docid = term_tf.docid
+            JOIN {fts_schema}.dict AS dict ON dict.termid = term_tf.termid
+            ORDER BY term_tf.termid, doc_rows.row
+        """).fetch_record_batch(chunk_size)
+        chunks = ((batch.column(0).to_numpy(), batch.column(1).to_numpy()) for batch in postings)
+        ImpactIndex.write(path, table_name, ids, term_counts, chunks, num_postings)
+        print(f"{num_postings} postings of {len(term_counts)} terms from {table_name} exported to {path}")
@@ -14,75 +14,357 @@
 # limitations under the License.
 #
 
-from ._base import Indexer
-from quackir._base import IndexType
-from quackir.analysis import tokenize
+from ._base import Indexer, DEFAULT_CHUNK_SIZE
+from ._profile import profiled
+from quackir._base import IndexType, ANNType, EmbeddingPrecision, TableInfo
+from quackir.search._postgres import describe_postgres_table, embedding_precision, POSTGRES_EMBEDDING_TYPES
 import psycopg2
 from psycopg2.extras import execute_values
-import pandas as pd
-from io import StringIO
+from contextlib import contextmanager
+import numpy as np
+import pyarrow as pa
+from io import BytesIO
+import struct
+import gzip
 import json
 
+# the signature, flags and header extension length that open COPY's binary format, and the field count that ends it
+BINARY_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+BINARY_COPY_TRAILER = struct.pack(">h", -1)
+
+def binary_copy_embeddings(ids: list, vectors, precision: EmbeddingPrecision) -> BytesIO:
+    """
+    Encodes (id, embedding) rows in COPY's binary format. Every embedding is sent the way pgvector receives it in
+    binary: its dimension and an unused int16, then its values as big-endian float4 for vector or float2 for halfvec.
+    """
+    vectors = np.asarray(vectors, dtype=">f2" if precision == EmbeddingPrecision.FLOAT16 else ">f4")
+    dimension = vectors.shape[1]
+    width = vectors.itemsize * dimension
+    vector_header = struct.pack(">ihh", 4 + width, dimension, 0)
+    data = vectors.tobytes()
+    buffer = BytesIO()
+    buffer.write(BINARY_COPY_HEADER)
+    for i, id in enumerate(ids):
+        id_bytes = str(id).encode()
+        buffer.write(struct.pack(">hi", 2, len(id_bytes)))
+        buffer.write(id_bytes)
+        buffer.write(vector_header)
+        buffer.write(data[i * width:(i + 1) * width])
+    buffer.write(BINARY_COPY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+def read_jsonl_rows(file_path: str):
+    open_cmd = gzip.open if file_path.endswith('.gz') else open
+    with open_cmd(file_path, 'rt') as file:
+        for line in file:
+            if line.strip():
+                d = json.loads(line)
+                yield d["id"], d["contents"]
+
+class CopyTextStream:
+    """A read-only file-like object that turns (id, contents) rows into rows in COPY text format as they are read."""
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.pending = ""
+
+    @staticmethod
+    def escape(value: str) -> str:
+        # postgres does not allow null characters
+        value = value.replace("\x00", "\uFFFD")
+        return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+    def format_row(self, id, contents: str) -> str:
+        return f"{self.escape(str(id))}\t{self.escape(contents)}\n"
+
+    def read(self, size=-1):
+        rows = [self.pending]
+        length = len(self.pending)
+        while size < 0 or length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            row = self.format_row(*row)
+            rows.append(row)
+            length += len(row)
+        data = "".join(rows)
+        if size < 0:
+            self.pending = ""
+            return data
+        self.pending = data[size:]
+        return data[:size]
+
 class PostgresIndexer(Indexer):
+    TSVECTOR_COLUMN = "contents_tsv tsvector GENERATED ALWAYS AS (to_tsvector('simple', contents)) STORED"
+    PARAM = "%s"
+
     def __init__(self, db_name="quackir", user="postgres"):
+        super().__init__()
         self.conn = psycopg2.connect(dbname=db_name, user=user)
 
-    def get_index_type(self, table_name: str) -> IndexType:
-        cur = self.conn.cursor()
-        cur.execute(f"SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table_name,))
-        columns = [row[0] for row in cur.fetchall()]
-        if "contents" in columns:
-            return IndexType.SPARSE
-        elif "embedding" in columns:
-            return IndexType.DENSE
-        else:
-            raise ValueError(f"Unknown index type for table {table_name}. Ensure it has either an 'embedding' column or a 'contents' column.")
+    def describe_table(self, table_name: str) -> TableInfo:
+        return describe_postgres_table(self.conn, table_name)
+
+    @contextmanager
+    def transaction(self, table_name: str):
+        """Loads a file in a single transaction, which also records it in the manifest, and rolls it back on failure."""
+        try:
+            yield
+            self.record_loaded_file(table_name)
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
 
-    def init_table(self, table_name: str, index_type: IndexType, embedding_dim=768):
+    def init_table(self, table_name: str, index_type: IndexType, embedding_dim=768, precision: EmbeddingPrecision = None):
+        precision = precision or EmbeddingPrecision.FLOAT32
+        if index_type == IndexType.DENSE and precision not in POSTGRES_EMBEDDING_TYPES:
+            raise ValueError(f"pgvector has no {precision.value} type, use one of {', '.join(p.value for p in POSTGRES_EMBEDDING_TYPES)}.")
         cur = self.conn.cursor()
         cur.execute(f"drop table if exists {table_name}")  
+        for stats_table in self.bm25_stats_tables(table_name):
+            cur.execute(f"drop table if exists {stats_table}")
         if index_type == IndexType.SPARSE:
-            cur.execute(f"create table {table_name} (id text primary key, contents text);")
+            # contents are parsed into a tsvector once, as they are inserted
+            cur.execute(f"create table {table_name} (id text primary key, contents text, {self.TSVECTOR_COLUMN});")
         elif index_type == IndexType.DENSE:
-            cur.execute(f"create table {table_name} (id text primary key, embedding vector({embedding_dim}));")
+            cur.execute(f"create table {table_name} (id text primary key, embedding {POSTGRES_EMBEDDING_TYPES[precision]}({embedding_dim}));")
         else:
             raise ValueError(f"Unknown index type: {index_type}")
         self.conn.commit()
+        self.invalidate_table_info(table_name)
+        self.forget_loaded_files(table_name)
 
-    def load_jsonl_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False):
-        with open(file_path, 'r') as file:
-            data = [json.loads(line) for line in file]
-        # postgres does not allow null characters
-        rows = [(d["id"], d["contents"].replace("\x00", "\uFFFD") if "contents" in d else d["vector"]) for d in data]
-        if index_type == IndexType.SPARSE and not pretokenized:
-            rows = [(d["id"], tokenize(d["contents"])) for d in data]
+    def load_jsonl_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, bulk=True, workers=1):
+        with self.transaction(table_name):
+            self.insert_jsonl(table_name, file_path, index_type, pretokenized, chunk_size, bulk, workers)
+
+    def insert_jsonl(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, bulk=True, workers=1):
         cur = self.conn.cursor()
-        if index_type == IndexType.SPARSE:
+        if index_type == IndexType.DENSE:
+            # embeddings go through binary COPY a chunk at a time, with or without bulk loading, rather than as text
+            precision = self.column_precision(cur, table_name)
+            for rows in self.read_jsonl_chunks(file_path, index_type, pretokenized, chunk_size, workers):
+                self.copy_embeddings(cur, table_name, [id for id, _ in rows], [embedding for _, embedding in rows], precision)
+            return
+        if bulk and self.can_bulk_load(index_type, pretokenized):
+            with self.profile.phase("bulk_load"):
+                self.bulk_load_jsonl_table(table_name, file_path, index_type)
+            return
+        for rows in self.read_jsonl_chunks(file_path, index_type, pretokenized, chunk_size, workers):
+            # postgres does not allow null characters
+            rows = [(id, contents.replace("\x00", "\uFFFD")) for id, contents in rows]
             execute_values(cur, f"INSERT INTO {table_name} (id, contents) VALUES %s", rows)
-        elif index_type == IndexType.DENSE:
-            execute_values(cur, f"INSERT INTO {table_name} (id, embedding) VALUES %s", rows)
+
+    def bulk_load_jsonl_table(self, table_name: str, file_path: str, index_type: IndexType):
+        cur = self.conn.cursor()
+        cur.copy_expert(f"COPY {table_name} (id, contents) FROM STDIN", CopyTextStream(read_jsonl_rows(file_path)))
+
+    @staticmethod
+    def column_precision(cur, table_name: str) -> EmbeddingPrecision:
+        # rows may be staged in a temp table, whose type is looked up here rather than cached
+        cur.execute("SELECT atttypid::regtype::text FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'embedding'", (table_name,))
+        return embedding_precision(cur.fetchone()[0])
+
+    @staticmethod
+    def copy_embeddings(cur, table_name: str, ids: list, vectors, precision: EmbeddingPrecision):
+        if len(ids) > 0:
+            cur.copy_expert(f"COPY {table_name} (id, embedding) FROM STDIN WITH (FORMAT binary)", binary_copy_embeddings(ids, vectors, precision))
+
+    def update_jsonl_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, bulk=True, workers=1, upsert=False):
+        column = "contents" if index_type == IndexType.SPARSE else "embedding"
+        # the GIN and approximate nearest neighbor indexes follow the table on their own, while the BM25 statistics are updated here
+        has_fts_index = index_type == IndexType.SPARSE and self.table_info(table_name).has_fts_index
+        with self.transaction(table_name):
+            cur = self.conn.cursor()
+            cur.execute(f"CREATE TEMP TABLE quackir_changes ON COMMIT DROP AS SELECT id, {column} FROM {table_name} LIMIT 0")
+            self.insert_jsonl("quackir_changes", file_path, index_type, pretokenized, chunk_size, bulk, workers)
+            self.check_new_ids(cur, table_name, upsert)
+            with self.profile.phase("update_index"):
+                if upsert and has_fts_index:
+                    self.remove_bm25_docs(cur, table_name, "SELECT id FROM quackir_changes")
+                on_conflict = f"ON CONFLICT (id) DO UPDATE SET {column} = EXCLUDED.{column}" if upsert else ""
+                cur.execute(f"INSERT INTO {table_name} (id, {column}) SELECT id, {column} FROM quackir_changes {on_conflict}")
+                if has_fts_index:
+                    self.add_bm25_docs(cur, table_name, "SELECT id FROM quackir_changes")
+                    self.update_bm25_stats(cur, table_name)
+
+    @staticmethod
+    def check_new_ids(cur, table_name: str, upsert: bool):
+        """
+        Raises if the rows staged in quackir_changes repeat an id, or, unless upserting, have the id of a row of the table,
+        with the same errors as DuckDB rather than the primary key's violation or ON CONFLICT's refusal to update a row twice.
+        """
+        cur.execute("SELECT id FROM quackir_changes GROUP BY id HAVING COUNT(*) > 1 LIMIT 5")
+        repeated = cur.fetchall()
+        if repeated:
+            raise ValueError(f"The input repeats ids, such as {', '.join(row[0] for row in repeated)}.")
+        if upsert:
+            return
+        cur.execute(f"SELECT id FROM quackir_changes WHERE EXISTS (SELECT 1 FROM {table_name} WHERE {table_name}.id = quackir_changes.id) LIMIT 5")
+        existing = cur.fetchall()
+        if existing:
+            raise ValueError(f"Appended rows have ids already in {table_name}, such as {', '.join(row[0] for row in existing)}. Use --upsert to replace them.")
+
+    def delete_rows(self, table_name: str, ids: list):
+        info = self.table_info(table_name)
+        has_fts_index = info.index_type == IndexType.SPARSE and info.has_fts_index
+        with self.transaction(table_name):
+            cur = self.conn.cursor()
+            cur.execute("CREATE TEMP TABLE quackir_deleted (id text) ON COMMIT DROP")
+            execute_values(cur, "INSERT INTO quackir_deleted (id) VALUES %s", [(id,) for id in ids])
+            if has_fts_index:
+                self.remove_bm25_docs(cur, table_name, "SELECT id FROM quackir_deleted")
+            cur.execute(f"DELETE FROM {table_name} WHERE id IN (SELECT id FROM quackir_deleted)")
+            if has_fts_index:
+                self.update_bm25_stats(cur, table_name)
+        self.mark_changed(table_name)
+
+    def load_parquet_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+        batches = self.read_parquet_batches(file_path, index_type, pretokenized, chunk_size, workers)
+        with self.transaction(table_name):
+            cur = self.conn.cursor()
+            if index_type == IndexType.SPARSE:
+                # one COPY streams every batch, a row at a time
+                rows = (row for batch in batches for row in zip(batch.column(0).to_pylist(), batch.column(1).to_pylist()))
+                cur.copy_expert(f"COPY {table_name} (id, contents) FROM STDIN", CopyTextStream(rows))
+            else:
+                precision = self.column_precision(cur, table_name)
+                for batch in batches:
+                    # the vectors of a batch are one contiguous array of values, reshaped without going through Python lists
+                    vectors = batch.column(1).flatten().to_numpy(zero_copy_only=False).reshape(batch.num_rows, -1)
+                    self.copy_embeddings(cur, table_name, batch.column(0).to_pylist(), vectors, precision)
+
+    @profiled("ann_index")
+    def ann_index(self, table_name: str, method: ANNType = ANNType.HNSW, params: dict = None):
+        params = params or {}
+        if method == ANNType.HNSW:
+            options = [f"{name} = {int(params[name])}" for name in ("m", "ef_construction") if params.get(name) is not None]
+        elif method == ANNType.IVFFLAT:
+            options = [f"lists = {int(params['lists'])}"] if params.get("lists") is not None else []
+        else:
+            raise ValueError(f"Unknown approximate nearest neighbor index: {method}")
+        with_options = f" WITH ({', '.join(options)})" if options else ""
+        operator_class = f"{POSTGRES_EMBEDDING_TYPES[self.table_info(table_name).precision]}_cosine_ops"
+        cur = self.conn.cursor()
+        for ann_type in ANNType:
+            cur.execute(f'DROP INDEX IF EXISTS "{table_name}_{ann_type.value}"')
+        cur.execute(f'CREATE INDEX "{table_name}_{method.value}" ON "{table_name}" USING {method.value} (embedding {operator_class}){with_options}')
+        self.conn.commit()
+        self.mark_changed(table_name)
+
+    def iter_embeddings(self, table_name: str, chunk_size=DEFAULT_CHUNK_SIZE):
+        # a named cursor keeps the rows on the server, instead of fetching the whole table at once
+        cur = self.conn.cursor(name=f"export_{table_name}")
+        cur.itersize = chunk_size
+        cur.execute(f"SELECT id, embedding FROM {table_name}")
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [(id, json.loads(embedding)) for id, embedding in rows]
+        cur.close()
         self.conn.commit()
 
     @staticmethod
-    def format_vector_for_pg(v):
-        return f"[{', '.join(f'{x:.8f}' for x in v)}]"
-
-    def load_parquet_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False):
-        df = pd.read_parquet(file_path)
-        df["vector"] = df["vector"].apply(self.format_vector_for_pg)
-        buffer = StringIO()
-        df.to_csv(buffer, index=False, header=False)
-        buffer.seek(0)
+    def bm25_stats_tables(table_name: str) -> list:
+        return [f"{table_name}_bm25_doclen", f"{table_name}_bm25_df", f"{table_name}_bm25_stats"]
+
+    def remove_bm25_docs(self, cur, table_name: str, ids_query: str):
+        """Takes the rows with the selected ids out of the BM25 statistics, before they are changed or deleted."""
+        doclen_table, df_table, _ = self.bm25_stats_tables(table_name)
+        cur.execute(f"""
+            UPDATE {df_table} SET df = {df_table}.df - removed.df
+            FROM (
+                SELECT lexeme AS term, COUNT(*)::double precision AS df
+                FROM {table_name}, unnest(contents_tsv)
+                WHERE id IN ({ids_query})
+                GROUP BY lexeme
+            ) AS removed
+            WHERE {df_table}.term = removed.term
+        """)
+        cur.execute(f"DELETE FROM {df_table} WHERE df <= 0")
+        cur.execute(f"DELETE FROM {doclen_table} WHERE id IN ({ids_query})")
+
+    def add_bm25_docs(self, cur, table_name: str, ids_query: str):
+        """Adds the rows with the selected ids to the BM25 statistics, once they are in the table."""
+        doclen_table, df_table, _ = self.bm25_stats_tables(table_name)
+        cur.execute(f"""
+            INSERT INTO {doclen_table} (id, len)
+            SELECT id, COALESCE((SELECT SUM(array_length(positions, 1)) FROM unnest(contents_tsv)), 0)::double precision
+            FROM {table_name}
+            WHERE id IN ({ids_query})
+        """)
+        cur.execute(f"""
+            INSERT INTO {df_table} (term, df)
+            SELECT lexeme, COUNT(*)::double precision
+            FROM {table_name}, unnest(contents_tsv)
+            WHERE id IN ({ids_query})
+            GROUP BY lexeme
+            ON CONFLICT (term) DO UPDATE SET df = {df_table}.df + EXCLUDED.df
+        """)
+
+    def update_bm25_stats(self, cur, table_name: str):
+        doclen_table, _, stats_table = self.bm25_stats_tables(table_name)
+        cur.execute(f"""
+            UPDATE {stats_table} SET num_docs = totals.num_docs, avgdl = totals.avgdl
+            FROM (SELECT COUNT(*)::double precision AS num_docs, COALESCE(AVG(len), 0)::double precision AS avgdl FROM {doclen_table}) AS totals
+        """)
+
+    def bm25_stats(self, table_name: str) -> tuple:
+        doclen_table, df_table, _ = self.bm25_stats_tables(table_name)
         cur = self.conn.cursor()
-        cur.copy_expert(f"COPY {table_name} FROM STDIN WITH CSV", buffer)
+        cur.execute(f"SELECT COUNT(*), COALESCE(SUM(len), 0) FROM {doclen_table}")
+        num_docs, total_len = cur.fetchone()
+        cur.execute(f"SELECT term, df FROM {df_table}")
+        rows = cur.fetchall()
         self.conn.commit()
+        return num_docs, total_len, pa.table({"term": pa.array([term for term, _ in rows], type=pa.string()),
+                                              "df": pa.array([df for _, df in rows], type=pa.float64())})
 
-    def get_num_rows(self, table_name: str) -> int:
+    def set_bm25_stats(self, table_name: str, num_docs: int, avgdl: float, dfs: pa.Table):
+        _, df_table, stats_table = self.bm25_stats_tables(table_name)
         cur = self.conn.cursor()
-        cur.execute(f"select count(*) from {table_name}")
-        result = cur.fetchone()
-        return result[0] if result else 0
+        cur.execute("CREATE TEMP TABLE quackir_dfs (term text, df double precision) ON COMMIT DROP")
+        rows = zip(dfs.column("term").to_pylist(), (repr(float(df)) for df in dfs.column("df").to_pylist()))
+        cur.copy_expert("COPY quackir_dfs (term, df) FROM STDIN", CopyTextStream(rows))
+        cur.execute(f"UPDATE {df_table} SET df = dfs.df FROM quackir_dfs AS dfs WHERE {df_table}.term = dfs.term")
+        cur.execute(f"UPDATE {stats_table} SET num_docs = %s, avgdl = %s", (num_docs, avgdl))
+        self.conn.commit()
+        self.mark_changed(table_name)
 
-    def fts_index(self, table_name: str = "corpus"):
+    @profiled("fts_index")
+    def fts_index(self, table_name: str = "corpus", params: dict = None):
+        """
+        Indexes the stored tsvector column with GIN, and builds the statistics BM25 needs: the length of every document,
+        the document frequency of every term, and the number of documents and their average length.
+        """
+        doclen_table, df_table, stats_table = self.bm25_stats_tables(table_name)
         cur = self.conn.cursor()
-        cur.execute(f'''CREATE INDEX "corpus_contents_gin" ON "{table_name}" USING gin(to_tsvector('simple', contents));''')
\ No newline at end of file
+        # tables created before the column was introduced get it here
+        cur.execute(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {self.TSVECTOR_COLUMN}")
+        cur.execute(f'DROP INDEX IF EXISTS "{table_name}_contents_tsv_gin"')
+        cur.execute(f'CREATE INDEX "{table_name}_contents_tsv_gin" ON "{table_name}" USING gin(contents_tsv)')
+        for stats in (doclen_table, df_table, stats_table):
+            cur.execute(f"DROP TABLE IF EXISTS {stats}")
+        cur.execute(f"""
+            CREATE TABLE {doclen_table} AS
+            SELECT id, COALESCE((SELECT SUM(array_length(positions, 1)) FROM unnest(contents_tsv)), 0)::double precision AS len
+            FROM {table_name}
+        """)
+        cur.execute(f"ALTER TABLE {doclen_table} ADD PRIMARY KEY (id)")
+        cur.execute(f"""
+            CREATE TABLE {df_table} AS
+            SELECT word AS term, ndoc::double precision AS df
+            FROM ts_stat('SELECT contents_tsv FROM {table_name}')
+        """)
+        cur.execute(f"ALTER TABLE {df_table} ADD PRIMARY KEY (term)")
+        cur.execute(f"""
+            CREATE TABLE {stats_table} AS
+            SELECT COUNT(*)::double precision AS num_docs, COALESCE(AVG(len), 0)::double precision AS avgdl
+            FROM {doclen_table}
+        """)
+        self.conn.commit()
+        cur.execute(f"ANALYZE {table_name}, {doclen_table}, {df_table}, {stats_table}")
+        self.conn.commit()
+        self.mark_changed(table_name)
@@ -0,0 +1,122 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from quackir._base import peak_rss_mb
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+import json
+import os
+
+class IndexProfile:
+    """
+    Where the time of indexing goes. Every operation on a table, such as loading a file or building an index,
+    is split into phases: reading and parsing jsonl, tokenizing, inserting rows, bulk loads done by the database
+    itself, and whatever else the operation spends time on. Reading, tokenizing and inserting interleave a chunk
+    at a time, so phases are accumulated while the operation runs and recorded when it ends, each with its wall time,
+    rows per second and the peak RSS of the process by the time it last ran. Records are kept in memory and appended
+    to a log in jsonl format if one is given. Nothing is recorded until the profile is enabled.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.log_path = None
+        self.records = []
+        self.current = None
+
+    def enable(self, log_path: str = None):
+        self.enabled = True
+        self.log_path = log_path
+
+    @contextmanager
+    def operation(self, operation: str, indexer, table_name: str, file_path: str = None, count_rows=None):
+        """
+        Times an operation on a table, with count_rows called once it is done to get the number of rows it handled.
+        An operation started within another one is timed as a phase of the outer one.
+        """
+        if not self.enabled or self.current is not None:
+            with self.phase(operation):
+                yield
+            return
+        record = {"operation": operation, "indexer": indexer.__class__.__name__, "table": table_name}
+        if file_path is not None:
+            record["file"] = file_path
+            record["bytes_read"] = os.path.getsize(file_path)
+        self.current = {}
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            phases, self.current = self.current, None
+        record["rows"] = count_rows() if count_rows is not None else None
+        self.finish(record, phases, seconds)
+
+    @contextmanager
+    def phase(self, phase: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, perf_counter() - start)
+
+    def add(self, phase: str, seconds: float):
+        """Adds time to a phase of the current operation."""
+        if self.current is None:
+            return
+        totals = self.current.setdefault(phase, [0.0, 0.0])
+        totals[0] += seconds
+        totals[1] = peak_rss_mb()
+
+    def elapsed(self, *phases) -> float:
+        """Time spent so far in the given phases of the current operation."""
+        if self.current is None:
+            return 0.0
+        return sum(self.current[phase][0] for phase in phases if phase in self.current)
+
+    def finish(self, record: dict, phases: dict, seconds: float):
+        rows = record["rows"]
+        # an operation that is not split any further is a phase of its own
+        other = seconds - sum(phase_seconds for phase_seconds, _ in phases.values())
+        if other > 0:
+            phases["other" if phases else record["operation"]] = [other, peak_rss_mb()]
+        record["seconds"] = seconds
+        record["rows_per_second"] = rows / seconds if rows and seconds > 0 else None
+        if "bytes_read" in record:
+            record["mb_per_second"] = record["bytes_read"] / (1024 * 1024) / seconds if seconds > 0 else None
+        record["peak_rss_mb"] = peak_rss_mb()
+        # tokenization workers count once they have exited
+        record["peak_rss_children_mb"] = peak_rss_mb(children=True)
+        record["phases"] = [{
+            "phase": phase,
+            "seconds": phase_seconds,
+            "share": phase_seconds / seconds if seconds > 0 else None,
+            "rows_per_second": rows / phase_seconds if rows and phase_seconds > 0 else None,
+            "peak_rss_mb": peak_rss
+        } for phase, (phase_seconds, peak_rss) in phases.items()]
+        self.records.append(record)
+        if self.log_path:
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+
+def profiled(operation: str):
+    """Times an indexer method that takes the table name first as an operation of the indexer's profile."""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, table_name: str, *args, **kwargs):
+            with self.profile.operation(operation, self, table_name, count_rows=lambda: self.get_num_rows(table_name)):
+                return method(self, table_name, *args, **kwargs)
+        return wrapper
+    return decorator
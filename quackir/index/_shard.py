@@ -0,0 +1,133 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from ._base import DEFAULT_CHUNK_SIZE, is_loadable, read_jsonl_chunks, read_parquet_batches
+from ._util import get_indexer
+from quackir._base import IndexType, ANNType, SearchDB, EmbeddingPrecision, shard_of, shard_locations
+from contextlib import ExitStack
+from tqdm import tqdm
+import pyarrow as pa
+import tempfile
+import json
+import os
+
+class ShardedIndexer:
+    """
+    Builds an index partitioned into shards by a hash of the id, each a table with its own full text search or approximate
+    nearest neighbor index, so that a ShardedSearcher can search them concurrently and merge their results. Shards are
+    tables of one database, or with separate_files, DuckDB database files of their own, as laid out by shard_locations.
+
+    The full text search index of every shard is built from its own documents, and then given the statistics of the whole
+    corpus: the number of documents, their average length and the document frequency of every term. Every document is then
+    scored by BM25 exactly as it is in an index that is not sharded. Since the statistics of every shard depend on all of
+    them, shards are built anew rather than updated in place. SQLite is not supported, since FTS5 scores BM25 with the
+    statistics of its own index only.
+    """
+    def __init__(self, db_type: SearchDB, table_name: str, num_shards: int, db_path: str = "database.db", db_name: str = "quackir", db_user: str = "postgres", separate_files=False):
+        if db_type == SearchDB.SQLITE:
+            raise ValueError("SQLite indexes cannot be sharded, since FTS5 cannot score BM25 with the statistics of the whole corpus.")
+        if separate_files and db_type != SearchDB.DUCKDB:
+            raise ValueError("Only DuckDB shards can be kept in database files of their own.")
+        if num_shards < 1:
+            raise ValueError("Number of shards must be at least 1.")
+        self.table_name = table_name
+        self.shards = []
+        indexers = {}
+        for shard_path, shard_table in shard_locations(table_name, num_shards, db_path, separate_files):
+            if shard_path not in indexers:
+                indexers[shard_path] = get_indexer(db_type, db_path=shard_path, db_name=db_name, db_user=db_user)
+            self.shards.append((indexers[shard_path], shard_table))
+        self.indexers = list(indexers.values())
+
+    def enable_profile(self, log_path: str = None):
+        for indexer in self.indexers:
+            indexer.enable_profile(log_path)
+
+    def init_tables(self, index_type: IndexType, embedding_dim=768, precision: EmbeddingPrecision = None):
+        for indexer, shard_table in self.shards:
+            indexer.init_table(shard_table, index_type, embedding_dim, precision)
+
+    def partition_files(self, file_paths: list, staging_dir: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, workers=1) -> list:
+        """
+        Splits the rows of jsonl and parquet files into a pretokenized jsonl file per shard in staging_dir,
+        tokenizing contents in a pool of worker processes if workers is more than 1, as read_jsonl_chunks does.
+
+        Returns:
+            list: The path of the staging file of every shard.
+        """
+        profile = self.indexers[0].profile
+        value_name = "contents" if index_type == IndexType.SPARSE else "vector"
+        staging_paths = [os.path.join(staging_dir, f"shard{shard}.jsonl") for shard in range(len(self.shards))]
+        with ExitStack() as stack:
+            staging_files = [stack.enter_context(open(path, 'w')) for path in staging_paths]
+            for file_path in tqdm(file_paths, desc=f"Partitioning {self.table_name}", unit="file"):
+                num_rows = 0
+                with profile.operation("partition", self.indexers[0], self.table_name, file_path, count_rows=lambda: num_rows):
+                    if file_path.endswith('.parquet'):
+                        batches = read_parquet_batches(file_path, index_type, pretokenized, chunk_size, workers, profile)
+                        chunks = (zip(batch.column(0).to_pylist(), batch.column(1).to_pylist()) for batch in batches)
+                    else:
+                        chunks = read_jsonl_chunks(file_path, index_type, pretokenized, chunk_size, workers, profile)
+                    for rows in chunks:
+                        lines = [[] for _ in staging_files]
+                        for id, value in rows:
+                            lines[shard_of(id, len(staging_files))].append(json.dumps({"id": id, value_name: value}) + "\n")
+                            num_rows += 1
+                        for staging_file, shard_lines in zip(staging_files, lines):
+                            staging_file.write(''.join(shard_lines))
+        return staging_paths
+
+    def load_files(self, file_paths: list, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, bulk=True, workers=1):
+        """
+        Partitions files across the shards, which init_tables created, and loads every shard from its staging file
+        in the temporary directory, pretokenized, through the database's bulk loading path.
+        """
+        file_paths = [file_path for file_path in file_paths if is_loadable(file_path)]
+        with tempfile.TemporaryDirectory(prefix="quackir-") as staging_dir:
+            staging_paths = self.partition_files(file_paths, staging_dir, index_type, pretokenized, chunk_size, workers)
+            for (indexer, shard_table), staging_path in zip(self.shards, staging_paths):
+                indexer.load_table(shard_table, staging_path, index_type, True, chunk_size, bulk)
+                os.remove(staging_path)
+
+    def fts_index(self, params: dict = None):
+        """Builds the full text search index of every shard, and shares the statistics of the whole corpus with them."""
+        for indexer, shard_table in self.shards:
+            indexer.fts_index(shard_table, params)
+        self.share_bm25_stats()
+
+    def share_bm25_stats(self):
+        """Gives every shard the number of documents, average length and document frequencies of all shards together."""
+        num_docs, total_len, dfs = 0, 0, []
+        for indexer, shard_table in self.shards:
+            shard_docs, shard_len, shard_dfs = indexer.bm25_stats(shard_table)
+            num_docs += shard_docs
+            total_len += shard_len
+            dfs.append(shard_dfs)
+        dfs = pa.concat_tables(dfs).group_by("term").aggregate([("df", "sum")])
+        dfs = pa.table({"term": dfs.column("term"), "df": dfs.column("df_sum")})
+        avgdl = total_len / num_docs if num_docs else 0.0
+        for indexer, shard_table in self.shards:
+            indexer.set_bm25_stats(shard_table, num_docs, avgdl, dfs)
+
+    def ann_index(self, method: ANNType = ANNType.HNSW, params: dict = None):
+        for indexer, shard_table in self.shards:
+            indexer.ann_index(shard_table, method, params)
+
+    def get_num_rows(self) -> int:
+        return sum(indexer.get_num_rows(shard_table) for indexer, shard_table in self.shards)
+
+    def close(self):
+        for indexer in self.indexers:
+            indexer.close()
@@ -14,25 +14,32 @@
 # limitations under the License.
 #
 
-from ._base import Indexer
-from quackir._base import IndexType
-from quackir.analysis import tokenize
+from ._base import Indexer, DEFAULT_CHUNK_SIZE
+from ._profile import profiled
+from quackir._base import IndexType, EmbeddingPrecision, TableInfo
+from quackir.search._sqlite import describe_sqlite_table
 import sqlite3
-import json
+
+FTS_DETAILS = ["full", "column", "none"]
+SQLITE_PRAGMAS = ["journal_mode", "synchronous", "cache_size", "mmap_size"]
 
 class SQLiteIndexer(Indexer):
     def __init__(self, db_path="sqlite.db"):
+        super().__init__()
         self.conn = sqlite3.connect(db_path)
 
-    def get_index_type(self, table_name: str) -> IndexType:
-        cur = self.conn.execute(f'select * from {table_name}')
-        names = list(map(lambda x: x[0], cur.description))
-        if "contents" in names:
-            return IndexType.SPARSE
-        else:
-            raise ValueError(f"Unknown index type for table {table_name}. Ensure it has a 'contents' column. SQLite only supports sparse indexes currently.")
+    def describe_table(self, table_name: str) -> TableInfo:
+        return describe_sqlite_table(self.conn, table_name)
+
+    def set_pragmas(self, pragmas: dict):
+        """Sets journal_mode, synchronous, cache_size and mmap_size on the indexer's connection, skipping those that are None."""
+        for name, value in pragmas.items():
+            if name not in SQLITE_PRAGMAS:
+                raise ValueError(f"Unsupported pragma {name}, expected one of {', '.join(SQLITE_PRAGMAS)}.")
+            if value is not None:
+                self.conn.execute(f"PRAGMA {name} = {value}")
 
-    def init_table(self, table_name: str, index_type: IndexType, embedding_dim=768):
+    def init_table(self, table_name: str, index_type: IndexType, embedding_dim=768, precision: EmbeddingPrecision = None):
         if index_type != IndexType.SPARSE:
             raise ValueError(f"SQLite only supports FTS indexing, got {index_type}")
         self.conn.execute(f"DROP TABLE IF EXISTS {table_name}")
@@ -42,36 +49,128 @@ class SQLiteIndexer(Indexer):
                 contents TEXT
             )
         """)
+        self.invalidate_table_info(table_name)
+        self.forget_loaded_files(table_name)
 
-    def load_parquet_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False):
-        pass
-
-    def load_jsonl_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False):
+    def load_parquet_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
         if index_type != IndexType.SPARSE:
             raise ValueError("Sorry, SQLite indexing currently only supports the sparse method.")
-        with open(file_path, 'r') as f:
-            data = [json.loads(line) for line in f]
-        rows = [(d["id"], d["contents"]) for d in data]
-        if not pretokenized:
-            rows = [(d["id"], tokenize(d["contents"])) for d in data]
-        self.conn.executemany(f"INSERT INTO {table_name} (id, contents) VALUES (?, ?)", rows)
+        batches = self.read_parquet_batches(file_path, index_type, pretokenized, chunk_size, workers)
+        chunks = (list(zip(batch.column(0).to_pylist(), batch.column(1).to_pylist())) for batch in batches)
+        self.insert_rows(table_name, chunks, True, f"INSERT INTO {table_name} (id, contents) VALUES (?, ?)")
+
+    def load_jsonl_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, bulk=True, workers=1):
+        self.insert_jsonl(table_name, file_path, index_type, pretokenized, chunk_size, bulk, workers, f"INSERT INTO {table_name} (id, contents) VALUES (?, ?)")
+
+    def update_jsonl_table(self, table_name: str, file_path: str, index_type: IndexType, pretokenized=False, chunk_size=DEFAULT_CHUNK_SIZE, bulk=True, workers=1, upsert=False):
+        # once the full text search index is built, triggers keep it in step with every change to the table
+        statement = f"INSERT INTO {table_name} (id, contents) VALUES (?, ?)"
+        if upsert:
+            statement += " ON CONFLICT (id) DO UPDATE SET contents = excluded.contents"
+        self.insert_jsonl(table_name, file_path, index_type, pretokenized, chunk_size, bulk, workers, statement)
+
+    def delete_rows(self, table_name: str, ids: list):
+        self.conn.executemany(f"DELETE FROM {table_name} WHERE id = ?", [(id,) for id in ids])
         self.conn.commit()
+        self.mark_changed(table_name)
+
+    def insert_jsonl(self, table_name: str, file_path: str, index_type: IndexType, pretokenized: bool, chunk_size: int, bulk: bool, workers: int, statement: str):
+        if index_type != IndexType.SPARSE:
+            raise ValueError("Sorry, SQLite indexing currently only supports the sparse method.")
+        self.insert_rows(table_name, self.read_jsonl_chunks(file_path, index_type, pretokenized, chunk_size, workers), bulk, statement)
+
+    def insert_rows(self, table_name: str, chunks, bulk: bool, statement: str):
+        if not bulk:
+            for rows in chunks:
+                self.conn.executemany(statement, rows)
+            self.record_loaded_file(table_name)
+            self.conn.commit()
+            return
+        # the file is inserted in a single transaction, with syncing and the rollback journal relaxed until it is done
+        synchronous = self.conn.execute("PRAGMA synchronous").fetchone()[0]
+        journal_mode = self.conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.conn.execute("PRAGMA synchronous = OFF")
+        self.conn.execute("PRAGMA journal_mode = MEMORY")
+        try:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(statement, (row for rows in chunks for row in rows))
+            self.record_loaded_file(table_name)
+            self.conn.commit()
+        finally:
+            # the pragmas cannot be restored inside a transaction left open by a failed load
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            self.conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+            self.conn.execute(f"PRAGMA synchronous = {synchronous}")
     
-    def get_num_rows(self, table_name: str) -> int:
-        result = self.conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()
-        return result[0] if result else 0
+    @profiled("fts_index")
+    def fts_index(self, table_name: str = "corpus", params: dict = None):
+        """
+        Builds the FTS5 index of a table from its contents, and adds triggers that keep it up to date
+        as rows are inserted, updated and deleted from then on.
 
-    def fts_index(self, table_name: str = "corpus"):
+        Args:
+            table_name (str): Name of the table to index.
+            params (dict): Options of the FTS5 table, left to SQLite's defaults when missing or None.
+                detail is full, column or none; contentless indexes only the contents, without keeping the ids
+                or reading them from the table, which changes BM25 scores since document lengths no longer count the ids; pgsz, automerge and crisismerge tune the b-tree pages and merging
+                of segments while the index is built and updated; optimize merges all segments into one at the end.
+        """
+        params = params or {}
+        detail = params.get("detail") or "full"
+        if detail not in FTS_DETAILS:
+            raise ValueError(f"Unsupported detail {detail}, expected one of {', '.join(FTS_DETAILS)}.")
+        contentless = bool(params.get("contentless"))
+        # without the content to read term frequencies back from, FTS5 scores every match 0 unless it keeps full detail
+        if contentless and detail != "full":
+            raise ValueError("A contentless FTS5 index can only be ranked by BM25 with detail=full.")
+        columns = "contents" if contentless else "id, contents"
+        content = "content=''" if contentless else f"content='{table_name}', content_rowid='rowid'"
+
+        for trigger in self.fts_triggers(table_name):
+            self.conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
         self.conn.execute(f"drop table if exists fts_{table_name}")
         self.conn.execute(f"""
             CREATE VIRTUAL TABLE fts_{table_name} USING fts5(
-                id, contents,
-                content='{table_name}', content_rowid='rowid', tokenize = 'porter' 
+                {columns},
+                {content}, detail={detail}, tokenize = 'porter' 
             )
         """)
+        for option in ["pgsz", "automerge", "crisismerge"]:
+            if params.get(option) is not None:
+                self.conn.execute(f"INSERT INTO fts_{table_name} (fts_{table_name}, rank) VALUES ('{option}', {int(params[option])})")
+
+        with self.profile.phase("build"):
+            if contentless:
+                self.conn.execute(f"INSERT INTO fts_{table_name} (rowid, contents) SELECT rowid, contents FROM {table_name}")
+            else:
+                self.conn.execute(f"INSERT INTO fts_{table_name} (fts_{table_name}) VALUES ('rebuild')")
+        if params.get("optimize"):
+            with self.profile.phase("optimize"):
+                self.conn.execute(f"INSERT INTO fts_{table_name} (fts_{table_name}) VALUES ('optimize')")
 
-        self.conn.execute(
-            f"INSERT INTO fts_{table_name} (id, contents) SELECT id, contents FROM {table_name};"
-        )
+        old_columns = ", ".join(f"old.{column}" for column in columns.split(", "))
+        new_columns = ", ".join(f"new.{column}" for column in columns.split(", "))
+        insert_trigger, delete_trigger, update_trigger = self.fts_triggers(table_name)
+        self.conn.execute(f"""
+            CREATE TRIGGER {insert_trigger} AFTER INSERT ON {table_name} BEGIN
+                INSERT INTO fts_{table_name} (rowid, {columns}) VALUES (new.rowid, {new_columns});
+            END
+        """)
+        self.conn.execute(f"""
+            CREATE TRIGGER {delete_trigger} AFTER DELETE ON {table_name} BEGIN
+                INSERT INTO fts_{table_name} (fts_{table_name}, rowid, {columns}) VALUES ('delete', old.rowid, {old_columns});
+            END
+        """)
+        self.conn.execute(f"""
+            CREATE TRIGGER {update_trigger} AFTER UPDATE ON {table_name} BEGIN
+                INSERT INTO fts_{table_name} (fts_{table_name}, rowid, {columns}) VALUES ('delete', old.rowid, {old_columns});
+                INSERT INTO fts_{table_name} (rowid, {columns}) VALUES (new.rowid, {new_columns});
+            END
+        """)
         self.conn.commit()
-        
\ No newline at end of file
+        self.mark_changed(table_name)
+
+    @staticmethod
+    def fts_triggers(table_name: str) -> list:
+        return [f"{table_name}_fts_insert", f"{table_name}_fts_delete", f"{table_name}_fts_update"]
@@ -16,4 +16,6 @@
 
 from ._duck import DuckDBSearcher
 from ._postgres import PostgresSearcher
-from ._sqlite import SQLiteSearcher
\ No newline at end of file
+from ._sqlite import SQLiteSearcher
+from ._cache import ResultCache
+from ._shard import ShardedSearcher
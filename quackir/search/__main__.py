@@ -14,8 +14,10 @@
 # limitations under the License.
 #
 
-from quackir._base import SearchType, SearchDB, _add_db_parser_arguments, _load_env, sanitize_table_name
+from quackir._base import SearchType, SearchDB, AnalyzerType, FusionMethod, ScoreNormalization, _add_db_parser_arguments, _load_env, sanitize_table_name
 from ._util import get_searcher, _custom_sort_key
+from ._parallel import run_search
+from quackir.analysis import set_analyzer, set_analysis_cache, save_analysis_cache
 import argparse
 import json
 import sys
@@ -32,17 +34,46 @@ if __name__ == "__main__":
     parser.add_argument("--index", type=str, default=["corpus"], nargs='+', help="Name of the table to search in. Accepts two values for hybrid search, one sparse and one dense; one value for sparse or dense search.")
     parser.add_argument("--pretokenized", action='store_true', default=False, help="Indicate if the queries are pretokenized. Default is False, meaning the queries will be tokenized during search.")
     parser.add_argument("--hits", type=int, default=1000, help="Number of top results to return")
+    parser.add_argument("--analyzer", type=AnalyzerType, choices=list(AnalyzerType), default=AnalyzerType.LUCENE, help="Analyzer to tokenize queries with: Pyserini's Lucene analyzer, or its pure Python port that does not start a JVM.")
+    parser.add_argument("--analysis-cache", type=str, default=None, help="Path to a vocabulary file that caches the analyzed form of every word, loaded if it exists and saved when done.")
     parser.add_argument("--rrf-k", type=int, default=60, help="Parameter k needed for reciprocal rank fusion. Ignored for other search methods.")
+    parser.add_argument("--rrf-depth", type=int, default=None, help="Number of results of each of the sparse and dense searches to fuse for reciprocal rank fusion. Default is the number of hits.")
+    parser.add_argument("--fusion", type=FusionMethod, choices=list(FusionMethod), default=FusionMethod.RRF, help="Method of fusing the sparse and dense results of hybrid search. Methods other than rrf fuse them in Python.")
+    parser.add_argument("--fusion-weights", type=float, nargs=2, default=None, help="Weights of the sparse and dense results for weighted fusion. Default is 0.5 each.")
+    parser.add_argument("--fusion-normalization", type=ScoreNormalization, choices=list(ScoreNormalization), default=ScoreNormalization.MINMAX, help="How the scores of the sparse and dense results are rescaled before combsum, combmnz and weighted fusion.")
+    parser.add_argument("--concurrent-rrf", action='store_true', default=False, help="Run the sparse and dense searches of reciprocal rank fusion concurrently, on separate database connections.")
+    parser.add_argument("--dense-matrix", type=str, default=None, help="Path to a dense matrix exported by quackir.index, to answer dense search on its table with instead of the database.")
+    parser.add_argument("--impact-index", type=str, default=None, help="Path to an impact index exported by quackir.index, to answer sparse search on its table with instead of the database.")
+    parser.add_argument("--ef-search", type=int, default=None, help="Size of the candidate list per query for hnsw indexes. Higher values trade latency for recall.")
+    parser.add_argument("--probes", type=int, default=None, help="Number of lists probed per query for ivfflat indexes. Higher values trade latency for recall.")
+    parser.add_argument("--sqlite-mmap-size", type=int, default=None, help="Bytes of an SQLite database to read through memory mapping instead of the page cache.")
+    parser.add_argument("--sqlite-shared-cache", action='store_true', default=False, help="Share one page cache between the connections of the searcher and its threads to an SQLite database.")
+    parser.add_argument("--result-cache-mb", type=int, default=None, help="Megabytes of search results to cache in memory, so that repeated queries are not searched again. Default is 256 if --result-cache-path is given, and no cache otherwise.")
+    parser.add_argument("--result-cache-path", type=str, default=None, help="Path to an SQLite database to cache search results in on disk, shared between processes and runs.")
+    parser.add_argument("--shards", type=int, default=None, help="Number of shards of the indexes to search, as built by quackir.index --shards. Every search is sent to all shards concurrently, and their results are merged.")
+    parser.add_argument("--shard-files", action='store_true', default=False, help="Indicate that every shard of a DuckDB index is in a database file of its own, as built by quackir.index --shard-files.")
+    parser.add_argument("--batch-size", type=int, default=1, help="Number of queries to search for at once. Default is 1, meaning queries are searched one at a time.")
+    workers = parser.add_mutually_exclusive_group()
+    workers.add_argument("--threads", type=int, default=1, help="Number of threads to shard queries across, each with its own database connection.")
+    workers.add_argument("--processes", type=int, default=1, help="Number of processes to shard queries across, each with its own database connection.")
 
     parser.add_argument("--output", type=str, required=True, help="Path to save the search results") 
     parser.add_argument("--run-tag", type=str, help="Tag to identify the run in the output file")
 
     args = parser.parse_args()
     _load_env(args)
+    set_analyzer(args.analyzer)
+    set_analysis_cache(path=args.analysis_cache)
 
-    if args.db_type == SearchDB.SQLITE and args.search_method != None and args.search_method != SearchType.SPARSE:
-        print("Sorry, SQLite search currently only supports the sparse method.")
+    if args.db_type == SearchDB.SQLITE and args.search_method != None and args.search_method != SearchType.SPARSE and not args.dense_matrix:
+        print("Sorry, SQLite search currently only supports the sparse method, unless dense search is answered from a dense matrix.")
         sys.exit()
+    if args.batch_size < 1:
+        raise ValueError("Batch size must be at least 1.")
+    if args.threads < 1 or args.processes < 1:
+        raise ValueError("Number of threads and processes must be at least 1.")
+    if args.rrf_depth is not None and args.rrf_depth < 1:
+        raise ValueError("RRF depth must be at least 1.")
     if len(args.index) > 2:
         raise ValueError("Invalid number of table names provided. Must be 1 or 2.")
     if len(args.index) == 2 and args.search_method != None and args.search_method != SearchType.HYBRID:
@@ -50,21 +81,40 @@ if __name__ == "__main__":
     if args.search_method == SearchType.HYBRID and len(args.index) != 2:
         raise ValueError("Hybrid search requires exactly two table names, one for sparse and one for dense search.")
 
-    searcher = get_searcher(
-        db_type=args.db_type,
-        db_path=args.db_path,
-        db_name=args.db_name,
-        db_user=args.db_user
-    )
+    searcher_args = {
+        "db_type": args.db_type,
+        "db_path": args.db_path,
+        "db_name": args.db_name,
+        "db_user": args.db_user,
+        "dense_matrices": [args.dense_matrix] if args.dense_matrix else None,
+        "impact_indexes": [args.impact_index] if args.impact_index else None,
+        "ann_params": {"ef_search": args.ef_search, "probes": args.probes},
+        "concurrent_rrf": args.concurrent_rrf,
+        "sqlite_mmap_size": args.sqlite_mmap_size,
+        "sqlite_shared_cache": args.sqlite_shared_cache,
+        "result_cache_mb": args.result_cache_mb,
+        "result_cache_path": args.result_cache_path,
+        "fusion_params": {"method": args.fusion, "weights": args.fusion_weights, "normalization": args.fusion_normalization},
+        "shards": args.shards,
+        "shard_files": args.shard_files
+    }
+    searcher = get_searcher(**searcher_args, read_only=True)
 
     args.index = [sanitize_table_name(index) for index in args.index]
 
+    def get_search_type(table_name):
+        if table_name in searcher.dense_matrices:
+            return SearchType.DENSE
+        if table_name in searcher.impact_indexes:
+            return SearchType.SPARSE
+        return searcher.get_search_type(table_name=table_name)
+
     if not args.search_method:
         if len(args.index) == 1:
-            args.search_method = searcher.get_search_type(table_name=args.index[0])
+            args.search_method = get_search_type(args.index[0])
         elif len(args.index) == 2:
-            searcher_type1 = searcher.get_search_type(table_name=args.index[0])
-            searcher_type2 = searcher.get_search_type(table_name=args.index[1])
+            searcher_type1 = get_search_type(args.index[0])
+            searcher_type2 = get_search_type(args.index[1])
             if searcher_type1 != searcher_type2:
                 args.search_method = SearchType.HYBRID
             else:
@@ -87,27 +137,29 @@ if __name__ == "__main__":
             queries.append(query)
     print(f"Loaded {len(queries)} queries from {args.topics}")
 
-    all_results = []
-    all_times = []
-    for query in tqdm(queries, desc=f"Processing {args.run_tag}", unit="query", total=len(queries)):
-        query_id = query.get("id", query.get("qid", None))
-        start_time = time.time()
-        results = searcher.search(
-            method=args.search_method,
-            query_id=query_id,
-            query_string=query.get("contents", None),
-            query_embedding=query.get("vector", None),
-            top_n=args.hits,
-            tokenize_query=not args.pretokenized,
-            table_names=args.index,
-            rrf_k=args.rrf_k
-        )
-        end_time = time.time()
-        all_times.append(end_time - start_time)
-        for rank, (doc_id, score) in enumerate(results, 1):
-            all_results.append((query_id, doc_id, score, rank))
-
-    print(f"Processed at {len(queries) / sum(all_times)} queries per second.")
+    blocks = []
+    for batch_start in range(0, len(queries), args.batch_size):
+        blocks.append([(query.get("id", query.get("qid", None)), query.get("contents", None), query.get("vector", None))
+                       for query in queries[batch_start:batch_start + args.batch_size]])
+    search_args = {
+        "method": args.search_method,
+        "top_n": args.hits,
+        "tokenize_query": not args.pretokenized,
+        "table_names": args.index,
+        "rrf_k": args.rrf_k,
+        "rrf_depth": args.rrf_depth
+    }
+
+    start_time = time.perf_counter()
+    with tqdm(desc=f"Processing {args.run_tag}", unit="query", total=len(queries)) as progress:
+        all_results = run_search(searcher, blocks, search_args, threads=args.threads, processes=args.processes,
+                                 searcher_args=searcher_args, progress=progress)
+    end_time = time.perf_counter()
+    searcher.close()
+    if args.analysis_cache:
+        save_analysis_cache()
+
+    print(f"Processed at {len(queries) / (end_time - start_time)} queries per second.")
     all_results.sort(key=_custom_sort_key) 
 
     with open(args.output, "w") as f:
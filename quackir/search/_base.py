@@ -14,33 +14,256 @@
 # limitations under the License.
 #
 
-from quackir._base import SearchType
-from quackir.analysis import tokenize
-from abc import ABC, abstractmethod
+from quackir._base import SearchType, FusionMethod, ScoreNormalization, TableInfoCache, VERSION_TABLE
+from quackir.fusion import fuse
+from quackir.analysis import tokenize, tokenize_batch
+from ._matrix import DenseMatrix
+from ._impact import ImpactIndex
+from ._cache import ResultCache
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+class Searcher(TableInfoCache):
+    def __init__(self):
+        super().__init__()
+        # dense tables answered from memory-mapped matrices rather than the database, keyed by table name
+        self.dense_matrices = {}
+        # sparse tables answered from exported impact indexes rather than the database, keyed by table name
+        self.impact_indexes = {}
+        # search time parameters of approximate nearest neighbor indexes, keyed by name
+        self.ann_params = {}
+        # whether hybrid search runs its sparse and dense legs concurrently, the dense one on a leg worker
+        self.concurrent_rrf = False
+        self.leg_worker = None
+        self.leg_executor = None
+        # ranked lists of earlier sparse and dense searches, shared with workers
+        self.result_cache = None
+        # how hybrid search fuses its legs when it fuses them here rather than in the database
+        self.fusion_params = {"method": FusionMethod.RRF, "weights": None, "normalization": ScoreNormalization.MINMAX}
+
+    def attach_dense_matrix(self, path: str):
+        """Answers dense and hybrid search on the table a DenseMatrix was exported from with the matrix."""
+        matrix = DenseMatrix(path)
+        self.dense_matrices[matrix.table_name] = matrix
+
+    def attach_impact_index(self, path: str):
+        """Answers sparse and hybrid search on the table an ImpactIndex was exported from with the index."""
+        index = ImpactIndex(path)
+        self.impact_indexes[index.table_name] = index
+
+    def set_ann_params(self, ef_search: int = None, probes: int = None):
+        """
+        Sets how much of an approximate nearest neighbor index is explored per query, trading latency for recall.
+
+        Args:
+            ef_search (int): Size of the candidate list for hnsw indexes.
+            probes (int): Number of lists to probe for ivfflat indexes.
+        """
+        self.ann_params = {name: value for name, value in (("ef_search", ef_search), ("probes", probes)) if value is not None}
+        self.apply_ann_params()
+
+    def apply_ann_params(self):
+        pass
+
+    def set_concurrent_rrf(self, concurrent_rrf: bool):
+        """Runs the dense leg of hybrid searches on a connection of its own, while the sparse leg runs on this one."""
+        self.concurrent_rrf = concurrent_rrf
+
+    def set_fusion(self, method: FusionMethod = FusionMethod.RRF, weights: list = None, normalization: ScoreNormalization = ScoreNormalization.MINMAX):
+        """
+        Sets how hybrid search fuses its sparse and dense legs, as described in quackir.fusion.fuse. Databases only fuse
+        by reciprocal rank fusion, so other methods run each leg on its own and fuse them here.
+
+        Args:
+            weights (list): Weights of the sparse and dense legs, for weighted fusion.
+        """
+        self.fusion_params = {"method": method, "weights": weights, "normalization": normalization}
+
+    def set_result_cache(self, result_cache: ResultCache):
+        """
+        Answers sparse and dense searches on database tables from a ResultCache when they were searched before,
+        at the same version of the table. Hybrid searches then cache each leg on its own and fuse them here,
+        so that fusing with another k does not search again. Tables without a version stamp are not cached.
+        """
+        self.result_cache = result_cache
+
+    def share_settings(self, worker):
+        """Gives a worker the dense matrices, impact indexes, table metadata, result cache, hybrid and fusion settings and approximate nearest neighbor parameters of this searcher."""
+        worker.dense_matrices = self.dense_matrices
+        worker.impact_indexes = self.impact_indexes
+        worker.table_infos = self.table_infos
+        worker.result_cache = self.result_cache
+        worker.set_concurrent_rrf(self.concurrent_rrf)
+        worker.set_fusion(**self.fusion_params)
+        worker.set_ann_params(**self.ann_params)
+        return worker
 
-class Searcher(ABC):
     @staticmethod
     def filter_id(results, query_id):
         return [res for res in results if res[0] != query_id]
 
-    def search(self, method: SearchType, query_id: str = None, query_string: str = None, query_embedding: str = None, top_n=5, tokenize_query=True, table_names: list =["corpus"], rrf_k=60):
+    def search(self, method: SearchType, query_id: str = None, query_string: str = None, query_embedding: str = None, top_n=5, tokenize_query=True, table_names: list =["corpus"], rrf_k=60, rrf_depth=None):
         results = []
         if method != SearchType.DENSE and tokenize_query:
             query_string = tokenize(query_string)
         if method == SearchType.SPARSE:
-            results = self.fts_search(query_string, top_n=top_n, table_name=table_names[0])
+            results = self.sparse_results([query_string], top_n=top_n, table_name=table_names[0])[0]
         elif method == SearchType.DENSE:
-            results = self.embedding_search(query_embedding, top_n=top_n, table_name=table_names[0])
+            results = self.dense_results([query_embedding], top_n=top_n, table_name=table_names[0])[0]
+        elif method == SearchType.HYBRID and self.fuses_legs(table_names):
+            results = self.fused_rrf_search([query_string], [query_embedding], top_n=top_n, k=rrf_k, table_names=table_names, depth=rrf_depth)[0]
         elif method == SearchType.HYBRID:
-            results = self.rrf_search(query_string, query_embedding, top_n=top_n, k=rrf_k, table_names=table_names)
+            results = self.rrf_search(query_string, query_embedding, top_n=top_n, k=rrf_k, table_names=table_names, depth=rrf_depth)
         else:
             raise ValueError(f"Unknown search method: {method}")
         
         return self.filter_id(results, query_id)
+
+    def batch_search(self, method: SearchType, queries: list, top_n=5, tokenize_query=True, table_names: list = ["corpus"], rrf_k=60, rrf_depth=None):
+        """
+        Searches for a block of queries at once.
+
+        Args:
+            queries (list): Tuples of (query_id, query_string, query_embedding).
+
+        Returns:
+            list: The results of each query, in the same order as queries.
+        """
+        query_ids = [query[0] for query in queries]
+        query_strings = [query[1] for query in queries]
+        query_embeddings = [query[2] for query in queries]
+        if method != SearchType.DENSE and tokenize_query:
+            query_strings = tokenize_batch(query_strings)
+        if method == SearchType.SPARSE:
+            results = self.sparse_results(query_strings, top_n=top_n, table_name=table_names[0])
+        elif method == SearchType.DENSE:
+            results = self.dense_results(query_embeddings, top_n=top_n, table_name=table_names[0])
+        elif method == SearchType.HYBRID and self.fuses_legs(table_names):
+            results = self.fused_rrf_search(query_strings, query_embeddings, top_n=top_n, k=rrf_k, table_names=table_names, depth=rrf_depth)
+        elif method == SearchType.HYBRID:
+            results = self.batch_rrf_search(query_strings, query_embeddings, top_n=top_n, k=rrf_k, table_names=table_names, depth=rrf_depth)
+        else:
+            raise ValueError(f"Unknown search method: {method}")
+
+        return [self.filter_id(res, query_id) for res, query_id in zip(results, query_ids)]
+
+    @staticmethod
+    def group_batch_results(rows, num_queries):
+        """Splits (query index, id, score) rows ordered by query index and score into one list per query."""
+        results = [[] for _ in range(num_queries)]
+        for query_idx, doc_id, score in rows:
+            results[query_idx].append((doc_id, score))
+        return results
+
+    def has_attached(self, table_names: list) -> bool:
+        return any(table_name in self.dense_matrices or table_name in self.impact_indexes for table_name in table_names)
+
+    def fuses_legs(self, table_names: list) -> bool:
+        """Whether hybrid search runs its sparse and dense legs on their own and fuses them with fused_rrf_search."""
+        return (self.concurrent_rrf or self.result_cache is not None or self.has_attached(table_names)
+                or self.fusion_params["method"] != FusionMethod.RRF)
+
+    def table_version(self, table_name: str):
+        """Returns the version stamp indexers last wrote for a table, or None if it has none."""
+        try:
+            row = self.conn.execute(f"SELECT version FROM {VERSION_TABLE} WHERE table_name = ?", (table_name,)).fetchone()
+        except Exception as error:
+            # databases indexed before version stamps were written have no table of them
+            if self.is_missing_table(error):
+                return None
+            raise
+        return row[0] if row is not None else None
+
+    def is_missing_table(self, error: Exception) -> bool:
+        """Whether an error raised by the database means that a queried table does not exist."""
+        return False
+
+    def cached_results(self, method: SearchType, queries: list, top_n: int, table_name: str, search) -> list:
+        """
+        Returns the results of queries from the result cache where they are cached, and from search otherwise,
+        which is called once with the queries that are not and returns their results in order.
+        """
+        if self.result_cache is None:
+            return search(queries)
+        version = self.table_version(table_name)
+        if version is None:
+            return search(queries)
+        self.result_cache.check_version(table_name, version)
+        keys = [self.result_cache.key(table_name, version, method.value, query, top_n) for query in queries]
+        results = [self.result_cache.get(key) for key in keys]
+        missing = [i for i, cached in enumerate(results) if cached is None]
+        if missing:
+            for i, found in zip(missing, search([queries[i] for i in missing])):
+                results[i] = found
+                self.result_cache.put(keys[i], table_name, version, found)
+        return results
+
+    def split_hybrid_tables(self, table_names: list) -> tuple:
+        """Returns the sparse and dense tables of a hybrid search."""
+        if table_names[0] in self.impact_indexes or table_names[1] in self.dense_matrices:
+            return table_names[0], table_names[1]
+        if table_names[1] in self.impact_indexes or table_names[0] in self.dense_matrices:
+            return table_names[1], table_names[0]
+        if self.get_search_type(table_names[0]) == SearchType.SPARSE:
+            return table_names[0], table_names[1]
+        return table_names[1], table_names[0]
+
+    def sparse_results(self, query_strings: list, top_n=5, table_name="corpus"):
+        if table_name in self.impact_indexes:
+            return self.impact_indexes[table_name].search(query_strings, top_n=top_n)
+        return self.cached_results(SearchType.SPARSE, query_strings, top_n, table_name, lambda queries: self.database_sparse_results(queries, top_n, table_name))
+
+    def dense_results(self, query_embeddings: list, top_n=5, table_name="corpus"):
+        if table_name in self.dense_matrices:
+            return self.dense_matrices[table_name].search(query_embeddings, top_n=top_n)
+        return self.cached_results(SearchType.DENSE, query_embeddings, top_n, table_name, lambda queries: self.database_dense_results(queries, top_n, table_name))
+
+    def database_sparse_results(self, query_strings: list, top_n=5, table_name="corpus"):
+        if len(query_strings) == 1:
+            return [self.fts_search(query_strings[0], top_n=top_n, table_name=table_name)]
+        return self.batch_fts_search(query_strings, top_n=top_n, table_name=table_name)
+
+    def database_dense_results(self, query_embeddings: list, top_n=5, table_name="corpus"):
+        if len(query_embeddings) == 1:
+            return [self.embedding_search(query_embeddings[0], top_n=top_n, table_name=table_name)]
+        return self.batch_embedding_search(query_embeddings, top_n=top_n, table_name=table_name)
+
+    def fused_rrf_search(self, query_strings: list, query_embeddings: list, top_n=5, k=60, table_names=["sparse", "dense"], depth=None):
+        """
+        Fuses sparse and dense results like rrf_search, but runs each leg on its own and fuses them here, by the method
+        set with set_fusion. This serves tables answered from an attached impact index or dense matrix, legs answered from
+        the result cache, fusion other than reciprocal rank fusion, and concurrent legs, in which case the dense leg runs
+        on the leg worker while the sparse leg runs on this searcher.
+
+        Args:
+            depth (int): Number of results of each leg to fuse. Default is top_n.
+        """
+        sparse_table, dense_table = self.split_hybrid_tables(table_names)
+        depth = depth or top_n
+        if self.concurrent_rrf:
+            if self.leg_worker is None:
+                self.leg_worker = self.worker()
+                self.leg_executor = ThreadPoolExecutor(max_workers=1)
+            dense_future = self.leg_executor.submit(self.leg_worker.dense_results, query_embeddings, depth, dense_table)
+            sparse_results = self.sparse_results(query_strings, top_n=depth, table_name=sparse_table)
+            dense_results = dense_future.result()
+        else:
+            sparse_results = self.sparse_results(query_strings, top_n=depth, table_name=sparse_table)
+            dense_results = self.dense_results(query_embeddings, top_n=depth, table_name=dense_table)
+        return [fuse([sparse, dense], top_n=top_n, k=k, **self.fusion_params) for sparse, dense in zip(sparse_results, dense_results)]
+
+    def batch_fts_search(self, query_strings: list, top_n=5, table_name="corpus"):
+        return [self.fts_search(query_string, top_n=top_n, table_name=table_name) for query_string in query_strings]
+
+    def batch_embedding_search(self, query_embeddings: list, top_n=5, table_name="corpus"):
+        return [self.embedding_search(query_embedding, top_n=top_n, table_name=table_name) for query_embedding in query_embeddings]
+
+    def batch_rrf_search(self, query_strings: list, query_embeddings: list, top_n=5, k=60, table_names=["sparse", "dense"], depth=None):
+        return [self.rrf_search(query_string, query_embedding, top_n=top_n, k=k, table_names=table_names, depth=depth)
+                for query_string, query_embedding in zip(query_strings, query_embeddings)]
     
-    @abstractmethod
     def get_search_type(self, table_name: str) -> SearchType:
-        pass
+        return SearchType(self.table_info(table_name).index_type.value)
     
     @abstractmethod
     def fts_search(self, query_string: str, top_n=5, table_name="corpus"):
@@ -51,8 +274,21 @@ class Searcher(ABC):
         pass
 
     @abstractmethod
-    def rrf_search(self, query_string: str, query_embedding: str, top_n=5, k=60, table_names=["sparse", "dense"]):
+    def rrf_search(self, query_string: str, query_embedding: str, top_n=5, k=60, table_names=["sparse", "dense"], depth=None):
+        """Fuses the top depth sparse and dense results by reciprocal rank fusion. depth defaults to top_n."""
         pass
 
+    @abstractmethod
+    def worker(self):
+        """Returns a searcher over the same database with its own connection, for use by one worker thread."""
+        pass
+
+    def close_leg_worker(self):
+        if self.leg_worker is not None:
+            self.leg_executor.shutdown()
+            self.leg_worker.close()
+            self.leg_worker = None
+
     def close(self):
+        self.close_leg_worker()
         self.conn.close()
\ No newline at end of file
@@ -0,0 +1,135 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from collections import OrderedDict
+import threading
+import hashlib
+import sqlite3
+import json
+
+# approximate CPython sizes of an entry, and of the tuple, float and str of every result in it
+ENTRY_OVERHEAD = 200
+RESULT_OVERHEAD = 130
+
+class ResultCache:
+    """
+    Caches the ranked lists of sparse and dense searches, keyed on the table, its version stamp, the search method,
+    the normalized query and the number of results. Entries are kept in memory up to a number of bytes, least recently
+    used first out, and optionally in an SQLite database on disk, which outlives the process and is shared between processes.
+    When an indexer changes a table, it writes a new version stamp, and the entries of the old version are dropped
+    the first time the new one is seen.
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024, path: str = None):
+        """
+        Args:
+            max_bytes (int): Bytes of results to keep in memory, approximately.
+            path (str): SQLite database to keep results in on disk as well. Default is memory only.
+        """
+        self.max_bytes = max_bytes
+        self.path = path
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        # the last version stamp seen of every table
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = None
+        if path is not None:
+            # several processes can share the database, so writers wait for each other rather than fail
+            self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            # results can always be searched again, so writes are not synced to disk
+            self.conn.execute("PRAGMA journal_mode = WAL")
+            self.conn.execute("PRAGMA synchronous = OFF")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, table_name TEXT, version TEXT, results TEXT)")
+            self.conn.commit()
+
+    @staticmethod
+    def normalize_query(query) -> str:
+        """Collapses the whitespace of a query string, and hashes a query embedding."""
+        if isinstance(query, str):
+            return " ".join(query.split())
+        return hashlib.sha1(json.dumps(query).encode()).hexdigest()
+
+    def key(self, table_name: str, version: str, method: str, query, top_n: int) -> str:
+        return json.dumps([table_name, version, method, self.normalize_query(query), top_n], ensure_ascii=False)
+
+    @staticmethod
+    def entry_bytes(key: str, results: list) -> int:
+        return ENTRY_OVERHEAD + len(key) + sum(RESULT_OVERHEAD + len(str(doc_id)) for doc_id, _ in results)
+
+    def check_version(self, table_name: str, version: str):
+        """Drops the entries of a table's older versions, once a new version stamp of it is seen."""
+        with self.lock:
+            if self.versions.get(table_name) == version:
+                return
+            previous = self.versions.get(table_name)
+            self.versions[table_name] = version
+            if previous is not None:
+                for key in [key for key in self.entries if json.loads(key)[0] == table_name]:
+                    self.num_bytes -= self.entry_bytes(key, self.entries.pop(key))
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM results WHERE table_name = ? AND version <> ?", (table_name, version))
+                self.conn.commit()
+
+    def get(self, key: str):
+        """Returns the cached results of a key, or None if they are not cached."""
+        with self.lock:
+            results = self.entries.get(key)
+            if results is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return results
+            if self.conn is not None:
+                row = self.conn.execute("SELECT results FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    results = [tuple(result) for result in json.loads(row[0])]
+                    self.add_entry(key, results)
+                    self.hits += 1
+                    return results
+            self.misses += 1
+            return None
+
+    def put(self, key: str, table_name: str, version: str, results: list):
+        with self.lock:
+            self.add_entry(key, results)
+            if self.conn is not None:
+                self.conn.execute("INSERT OR REPLACE INTO results (key, table_name, version, results) VALUES (?, ?, ?, ?)",
+                                  (key, table_name, version, json.dumps(results, ensure_ascii=False)))
+                self.conn.commit()
+
+    def add_entry(self, key: str, results: list):
+        if key in self.entries:
+            self.num_bytes -= self.entry_bytes(key, self.entries.pop(key))
+        self.entries[key] = results
+        self.num_bytes += self.entry_bytes(key, results)
+        while self.num_bytes > self.max_bytes and self.entries:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self.num_bytes -= self.entry_bytes(evicted_key, evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.num_bytes = 0
+            self.versions.clear()
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM results")
+                self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -15,85 +15,338 @@
 #
 
 import duckdb
+import threading
+from functools import lru_cache
 from ._base import Searcher
-from quackir._base import SearchType
+from ._matrix import RESCORE_FACTOR
+from quackir._base import IndexType, EmbeddingPrecision, TableInfo
+
+# the element type of the embedding arrays of every precision DuckDB stores, which has no half precision type
+DUCKDB_EMBEDDING_TYPES = {
+    EmbeddingPrecision.FLOAT64: "DOUBLE",
+    EmbeddingPrecision.FLOAT32: "FLOAT",
+    EmbeddingPrecision.INT8: "TINYINT",
+}
+
+# the float32 vectors int8 tables are quantized from, which the top candidates of a scan over the int8 ones are rescored with
+RESCORE_COLUMN = "rescore"
+
+def embedding_precision(column_type: str) -> EmbeddingPrecision:
+    element_type = column_type[:column_type.index("[")] if "[" in column_type else column_type
+    for precision, duckdb_type in DUCKDB_EMBEDDING_TYPES.items():
+        if element_type == duckdb_type:
+            return precision
+    raise ValueError(f"Unsupported embedding type: {column_type}.")
+
+def describe_duckdb_table(conn, table_name: str) -> TableInfo:
+    columns = dict((row[0], row[1]) for row in conn.execute(f"DESCRIBE {table_name}").fetchall())
+    num_rows = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+    if "contents" in columns:
+        has_fts_index = conn.execute("SELECT COUNT(*) FROM duckdb_schemas() WHERE schema_name = ?", [f"fts_main_{table_name}"]).fetchone()[0] > 0
+        return TableInfo(IndexType.SPARSE, num_rows=num_rows, has_fts_index=has_fts_index)
+    elif "embedding" in columns:
+        # embeddings are fixed size arrays, typed DOUBLE[dimension], FLOAT[dimension] or TINYINT[dimension]
+        column_type = columns["embedding"]
+        dimension = int(column_type[column_type.index("[") + 1:-1]) if column_type.endswith("]") and not column_type.endswith("[]") else None
+        has_ann_index = conn.execute(
+            "SELECT COUNT(*) FROM duckdb_indexes() WHERE table_name = ? AND sql ILIKE '%USING HNSW%'", [table_name]).fetchone()[0] > 0
+        return TableInfo(IndexType.DENSE, dimension=dimension, num_rows=num_rows, has_ann_index=has_ann_index, precision=embedding_precision(column_type))
+    else:
+        raise ValueError(f"Unknown type for table {table_name}. Ensure it has either an 'embedding' column or a 'contents' column.")
 
 class DuckDBSearcher(Searcher):
-    def __init__(self, db_path="duck.db"):
-        self.conn = duckdb.connect(db_path)
-
-    def get_search_type(self, table_name: str) -> SearchType:
-        table_description = self.conn.execute(f"DESCRIBE {table_name}").fetchall()
-        column_names = [row[0] for row in table_description]
-        if "contents" in column_names:
-            return SearchType.SPARSE
-        elif "embedding" in column_names:
-            return SearchType.DENSE
-        else:
-            raise ValueError(f"Unknown search type for table {table_name}. Ensure it has either an 'embedding' column or a 'contents' column.")
+    def __init__(self, db_path="duck.db", read_only=False, conn=None, ann_lock: threading.Lock = None):
+        super().__init__()
+        if conn is None:
+            conn = duckdb.connect(db_path, read_only=read_only)
+            # load extensions the database uses up front, since worker cursors autoloading them concurrently conflict with each other;
+            # the indexer installed them, so they are only loaded, which needs no network access
+            if conn.execute("SELECT COUNT(*) FROM duckdb_schemas() WHERE schema_name LIKE 'fts_main_%'").fetchone()[0] > 0:
+                conn.execute("LOAD fts")
+            if conn.execute("SELECT COUNT(*) FROM duckdb_indexes() WHERE sql ILIKE '%USING HNSW%'").fetchone()[0] > 0:
+                conn.execute("LOAD vss")
+        self.conn = conn
+        # vss crashes when cursors of one database search an hnsw index concurrently, so those searches take turns
+        self.ann_lock = ann_lock if ann_lock is not None else threading.Lock()
 
-    def fts_search(self, query_string, top_n=5, table_name="corpus"):
-        query = f"""
-        WITH fts AS (
-            SELECT *, COALESCE(fts_main_{table_name}.match_bm25(id, ?, k:=0.9, b:=0.4), 0) AS score
+    def worker(self):
+        # a cursor is a separate connection to the same database, which can be used from another thread
+        return self.share_settings(DuckDBSearcher(conn=self.conn.cursor(), ann_lock=self.ann_lock))
+
+    def apply_ann_params(self):
+        if "ef_search" in self.ann_params:
+            self.conn.execute(f"LOAD vss; SET hnsw_ef_search = {int(self.ann_params['ef_search'])}")
+
+    def is_missing_table(self, error: Exception) -> bool:
+        return isinstance(error, duckdb.CatalogException)
+
+    def describe_table(self, table_name: str) -> TableInfo:
+        return describe_duckdb_table(self.conn, table_name)
+
+    def has_ann_index(self, table_name: str) -> bool:
+        # an hnsw index only serves queries ordered by array_cosine_distance
+        return self.table_info(table_name).has_ann_index
+
+    def run_ann_query(self, query: str, params: list = None):
+        with self.ann_lock:
+            return self.conn.execute(query, params).fetchall()
+
+    @staticmethod
+    def ann_nearest_query(table_name: str, dimension: int, top_n: int) -> str:
+        """Builds a query for the top_n nearest rows by cosine distance, in the shape that the hnsw index serves."""
+        return f"""
+            SELECT id, array_cosine_distance(embedding, ?::FLOAT[{dimension}]) AS distance
             FROM {table_name}
+            ORDER BY distance
+            LIMIT {top_n}
+        """
+
+    @staticmethod
+    def cosine_similarity(embedding: str, query_embedding: str, dimension: int, precision: EmbeddingPrecision) -> str:
+        """
+        Builds the cosine similarity of a stored embedding and a query embedding, computed in double precision for
+        DOUBLE arrays and in single precision otherwise. Cosine similarity does not depend on the scale of int8 rows.
+        """
+        if precision == EmbeddingPrecision.FLOAT64:
+            return f"array_cosine_similarity({embedding}, {query_embedding}::DOUBLE[{dimension}])"
+        if precision == EmbeddingPrecision.INT8:
+            embedding = f"{embedding}::FLOAT[{dimension}]"
+        return f"array_cosine_similarity({embedding}, {query_embedding}::FLOAT[{dimension}])"
+
+    def table_precision(self, table_name: str) -> EmbeddingPrecision:
+        return self.table_info(table_name).precision
+
+    # The query vector is bound as a parameter rather than spliced into the SQL as a literal, which DuckDB would
+    # otherwise parse on every query. The SQL text is built once per table, result size, dimension and precision.
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def embedding_query(table_name: str, dimension: int, top_n: int, ann: bool, precision: EmbeddingPrecision = EmbeddingPrecision.FLOAT64) -> str:
+        if ann:
+            return f"SELECT id, 1 - distance AS score FROM ({DuckDBSearcher.ann_nearest_query(table_name, dimension, top_n)})"
+        if precision == EmbeddingPrecision.INT8:
+            # the int8 scan keeps RESCORE_FACTOR times as many candidates, which are ranked by their float32 vectors
+            return f"""
+            SELECT id, array_cosine_similarity({RESCORE_COLUMN}, query) AS score
+            FROM (
+                SELECT id, {RESCORE_COLUMN}, query
+                FROM {table_name}, (SELECT ?::FLOAT[{dimension}] AS query)
+                ORDER BY {DuckDBSearcher.cosine_similarity("embedding", "query", dimension, precision)} DESC, id
+                LIMIT {top_n * RESCORE_FACTOR}
+            )
+            ORDER BY score DESC, id
+            LIMIT {top_n}
+            """
+        return f"""
+        SELECT id, {DuckDBSearcher.cosine_similarity("embedding", "?", dimension, precision)} AS score
+        FROM {table_name}
+        ORDER BY score DESC, id
+        LIMIT {top_n}
+        """
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def rrf_query(sparse_table: str, dense_table: str, dimension: int, top_n: int, k: int, ann: bool, depth: int, precision: EmbeddingPrecision = EmbeddingPrecision.FLOAT64) -> str:
+        # each leg takes its top depth rows with a top-n operator before ranking them, rather than ranking whole tables
+        if ann:
+            embd = f"""
+            SELECT id, ROW_NUMBER() OVER (ORDER BY distance) AS sim_rank
+            FROM ({DuckDBSearcher.ann_nearest_query(dense_table, dimension, depth)})
+            """
+        else:
+            embd = f"""
+            SELECT id, ROW_NUMBER() OVER (ORDER BY score DESC, id) AS sim_rank
+            FROM ({DuckDBSearcher.embedding_query(dense_table, dimension, depth, False, precision)})
+            """
+        return f"""
+        WITH 
+        embd AS ({embd}),
+        fts AS (
+            SELECT id, ROW_NUMBER() OVER (ORDER BY score DESC, id) AS fts_rank
+            FROM ({DuckDBSearcher.fts_query(sparse_table, depth)})
+        ),
+        combined_results AS (
+            SELECT 
+                COALESCE(s.id, f.id) AS id,
+                COALESCE(1.0 / ({k} + s.sim_rank), 0) + COALESCE(1.0 / ({k} + f.fts_rank), 0) AS rrf_score
+            FROM embd s
+            FULL OUTER JOIN fts f ON s.id = f.id
         )
+        SELECT id, rrf_score
+        FROM combined_results
+        ORDER BY rrf_score DESC, id
+        LIMIT {top_n}
+        """
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def fts_query(table_name: str, top_n: int) -> str:
+        # one query scored by the same SQL as a block of them, so that both return the same scores and ties
+        return DuckDBSearcher.batch_bm25_query(table_name, top_n, single=True) + f"""
         SELECT id, score
         FROM fts
-        WHERE score IS NOT NULL
-        ORDER BY score DESC
-        LIMIT {top_n};
+        ORDER BY score DESC, id
+        LIMIT {top_n}
         """
-        return self.conn.execute(query, [query_string]).fetchall()
+
+    def fts_search(self, query_string, top_n=5, table_name="corpus"):
+        return self.conn.execute(self.fts_query(table_name, top_n), [query_string]).fetchall()
     
     def embedding_search(self, query_embedding: str, top_n=5, table_name="corpus"):
-        embd_size = len(query_embedding)
-        query_embedding = str(query_embedding)
-        query = f"""
-        WITH query_embedding AS (
-            SELECT array{query_embedding}::DOUBLE[{embd_size}] AS embedding
+        ann = self.has_ann_index(table_name)
+        query = self.embedding_query(table_name, len(query_embedding), top_n, ann, self.table_precision(table_name))
+        if ann:
+            return self.run_ann_query(query, [query_embedding])
+        return self.conn.execute(query, [query_embedding]).fetchall()
+
+    def rrf_search(self, query_string, query_embedding, top_n=5, k=60, table_names=["sparse", "dense"], depth=None):
+        sparse_table, dense_table = self.split_hybrid_tables(table_names)
+        ann = self.has_ann_index(dense_table)
+        query = self.rrf_query(sparse_table, dense_table, len(query_embedding), top_n, k, ann, depth or top_n, self.table_precision(dense_table))
+        if ann:
+            return self.run_ann_query(query, [query_embedding, query_string])
+        return self.conn.execute(query, [query_embedding, query_string]).fetchall()
+
+    def load_batch_queries(self, query_strings: list = None, query_embeddings: list = None):
+        """Loads a block of queries into the temp table batch_queries, keyed by their position in the block."""
+        num_queries = len(query_strings) if query_strings is not None else len(query_embeddings)
+        columns = ["qidx INTEGER"]
+        rows = [[i] for i in range(num_queries)]
+        if query_strings is not None:
+            columns.append("contents VARCHAR")
+            for row, query_string in zip(rows, query_strings):
+                row.append(query_string)
+        if query_embeddings is not None:
+            columns.append(f"embedding DOUBLE[{len(query_embeddings[0])}]")
+            for row, query_embedding in zip(rows, query_embeddings):
+                row.append(query_embedding)
+        self.conn.execute(f"CREATE OR REPLACE TEMP TABLE batch_queries ({', '.join(columns)})")
+        placeholders = ", ".join(["?"] * len(columns))
+        self.conn.executemany(f"INSERT INTO batch_queries VALUES ({placeholders})", rows)
+        return num_queries
+
+    @staticmethod
+    def batch_bm25_query(table_name: str, top_n: int, single=False) -> str:
+        """
+        Builds a query scoring every query in batch_queries against table_name in one pass over the FTS tables,
+        using the same BM25 formula as match_bm25. The score of a document sums the contributions of its terms in
+        the order of their termids, so that it does not depend on the other queries of the block. Queries with
+        fewer than top_n matches are padded with the zero-score documents of smallest id.
+
+        Args:
+            single (bool): Score the one query bound as a parameter instead, as fts_search does.
+        """
+        fts_schema = f"fts_main_{table_name}"
+        queries = "batch_queries AS (SELECT 0 AS qidx, ?::VARCHAR AS contents)," if single else ""
+        return f"""
+        WITH {queries}
+        query_terms AS (
+            SELECT DISTINCT qidx, stem(unnest({fts_schema}.tokenize(contents)), 'none') AS term
+            FROM batch_queries
+        ),
+        term_tf AS (
+            SELECT query_terms.qidx, terms.docid, dict.termid, dict.df, COUNT(*) AS tf
+            FROM query_terms
+            JOIN {fts_schema}.dict AS dict ON dict.term = query_terms.term
+            JOIN {fts_schema}.terms AS terms ON terms.termid = dict.termid
+            GROUP BY query_terms.qidx, terms.docid, dict.termid, dict.df
+        ),
+        scores AS (
+            SELECT term_tf.qidx, docs.name AS id,
+                SUM(log((((SELECT num_docs FROM {fts_schema}.stats) - df) + 0.5) / (df + 0.5) + 1) *
+                    ((tf * (0.9 + 1)) / (tf + (0.9 * ((1 - 0.4) + (0.4 * (len / (SELECT avgdl FROM {fts_schema}.stats))))))) ORDER BY term_tf.termid) AS score
+            FROM term_tf
+            JOIN {fts_schema}.docs AS docs ON docs.docid = term_tf.docid
+            GROUP BY term_tf.qidx, docs.name
+        ),
+        padding AS (
+            SELECT batch_queries.qidx, docs.name AS id, CAST(0 AS DOUBLE) AS score
+            FROM batch_queries, (SELECT name FROM {fts_schema}.docs ORDER BY name LIMIT {top_n}) AS docs
+            WHERE NOT EXISTS (SELECT 1 FROM scores WHERE scores.qidx = batch_queries.qidx AND scores.id = docs.name)
+        ),
+        fts AS (
+            SELECT * FROM scores
+            UNION ALL
+            SELECT * FROM padding
         )
-        SELECT {table_name}.id, 
-            array_cosine_similarity({table_name}.embedding, query_embedding.embedding) AS score
-        FROM {table_name}, query_embedding
-        ORDER BY score DESC
-        LIMIT {top_n}
         """
-        return self.conn.execute(query).fetchall()
 
-    def rrf_search(self, query_string, query_embedding, top_n=5, k=60, table_names=["sparse", "dense"]):
-        sparse_table = table_names[0] if self.get_search_type(table_names[0]) == SearchType.SPARSE else table_names[1]
-        dense_table = table_names[1] if self.get_search_type(table_names[1]) == SearchType.DENSE else table_names[0]
-        embd_size = len(query_embedding)
-        query_embedding = str(query_embedding)
+    def batch_fts_search(self, query_strings, top_n=5, table_name="corpus"):
+        num_queries = self.load_batch_queries(query_strings=query_strings)
+        query = self.batch_bm25_query(table_name, top_n) + f"""
+        SELECT qidx, id, score
+        FROM fts
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY qidx ORDER BY score DESC, id) <= {top_n}
+        ORDER BY qidx, score DESC, id
+        """
+        return self.group_batch_results(self.conn.execute(query).fetchall(), num_queries)
+
+    @staticmethod
+    def batch_similarity_query(table_name: str, dimension: int, depth: int, precision: EmbeddingPrecision) -> str:
+        """
+        Builds a query for the top depth rows of table_name by cosine similarity to every query in batch_queries,
+        as (qidx, id, score) rows, with int8 tables rescored from their float32 vectors as embedding_query does.
+        """
+        similarity = DuckDBSearcher.cosine_similarity(f"{table_name}.embedding", "batch_queries.embedding", dimension, precision)
+        if precision != EmbeddingPrecision.INT8:
+            return f"""
+            SELECT batch_queries.qidx, {table_name}.id, {similarity} AS score
+            FROM batch_queries, {table_name}
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY batch_queries.qidx ORDER BY score DESC, {table_name}.id) <= {depth}
+            """
+        # candidates are found without their float32 vectors, which are only read for the rows kept
+        return f"""
+            SELECT candidates.qidx, candidates.id,
+                array_cosine_similarity({table_name}.{RESCORE_COLUMN}, batch_queries.embedding::FLOAT[{dimension}]) AS score
+            FROM (
+                SELECT batch_queries.qidx, {table_name}.id, {similarity} AS approximate
+                FROM batch_queries, {table_name}
+                QUALIFY ROW_NUMBER() OVER (PARTITION BY batch_queries.qidx ORDER BY approximate DESC, {table_name}.id) <= {depth * RESCORE_FACTOR}
+            ) candidates
+            JOIN {table_name} ON {table_name}.id = candidates.id
+            JOIN batch_queries ON batch_queries.qidx = candidates.qidx
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY candidates.qidx ORDER BY score DESC, candidates.id) <= {depth}
+            """
+
+    def batch_embedding_search(self, query_embeddings, top_n=5, table_name="corpus"):
+        if self.has_ann_index(table_name):
+            # the hnsw index serves one query at a time
+            return super().batch_embedding_search(query_embeddings, top_n=top_n, table_name=table_name)
+        num_queries = self.load_batch_queries(query_embeddings=query_embeddings)
         query = f"""
-        WITH 
-        query_embedding AS (
-            SELECT array{query_embedding}::DOUBLE[{embd_size}] AS embedding
+        SELECT qidx, id, score
+        FROM ({self.batch_similarity_query(table_name, len(query_embeddings[0]), top_n, self.table_precision(table_name))})
+        ORDER BY qidx, score DESC, id
+        """
+        return self.group_batch_results(self.conn.execute(query).fetchall(), num_queries)
+
+    def batch_rrf_search(self, query_strings, query_embeddings, top_n=5, k=60, table_names=["sparse", "dense"], depth=None):
+        sparse_table, dense_table = self.split_hybrid_tables(table_names)
+        if self.has_ann_index(dense_table):
+            return super().batch_rrf_search(query_strings, query_embeddings, top_n=top_n, k=k, table_names=table_names, depth=depth)
+        depth = depth or top_n
+        num_queries = self.load_batch_queries(query_strings=query_strings, query_embeddings=query_embeddings)
+        query = self.batch_bm25_query(sparse_table, depth) + f""",
+        fts_ranks AS (
+            SELECT qidx, id, ROW_NUMBER() OVER (PARTITION BY qidx ORDER BY score DESC, id) AS fts_rank
+            FROM fts
+            QUALIFY fts_rank <= {depth}
         ),
         embd AS (
-            SELECT {dense_table}.id,
-                ROW_NUMBER() OVER (ORDER BY array_cosine_similarity({dense_table}.embedding, query_embedding.embedding) DESC) AS sim_rank
-            FROM {dense_table}, query_embedding
-            limit {top_n}
-        ),
-        fts AS (
-            SELECT id, 
-                ROW_NUMBER() OVER (ORDER BY COALESCE(fts_main_{sparse_table}.match_bm25(id, ?, k:=0.9, b:=0.4), 0) DESC) AS fts_rank
-            FROM {sparse_table}
-            limit {top_n}
+            SELECT qidx, id, ROW_NUMBER() OVER (PARTITION BY qidx ORDER BY score DESC, id) AS sim_rank
+            FROM ({self.batch_similarity_query(dense_table, len(query_embeddings[0]), depth, self.table_precision(dense_table))})
         ),
         combined_results AS (
             SELECT 
+                COALESCE(s.qidx, f.qidx) AS qidx,
                 COALESCE(s.id, f.id) AS id,
                 COALESCE(1.0 / ({k} + s.sim_rank), 0) + COALESCE(1.0 / ({k} + f.fts_rank), 0) AS rrf_score
             FROM embd s
-            FULL OUTER JOIN fts f ON s.id = f.id
+            FULL OUTER JOIN fts_ranks f ON s.qidx = f.qidx AND s.id = f.id
         )
-        SELECT id, rrf_score
+        SELECT qidx, id, rrf_score
         FROM combined_results
-        ORDER BY rrf_score DESC
-        LIMIT {top_n}
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY qidx ORDER BY rrf_score DESC, id) <= {top_n}
+        ORDER BY qidx, rrf_score DESC, id
         """
-        return self.conn.execute(query, [query_string]).fetchall()
-    
+        return self.group_batch_results(self.conn.execute(query).fetchall(), num_queries)
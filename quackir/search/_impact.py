@@ -0,0 +1,156 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import numpy as np
+import threading
+import json
+import os
+
+class ImpactIndex:
+    """
+    The BM25 index of a sparse table, exported to memory-mapped postings whose BM25 contribution, the impact,
+    is computed once at export time. An index is a directory holding rows.npy and impacts.npy with the postings
+    of every term ordered by row, terms.json mapping every term to its postings and its largest impact,
+    ids.json with the id of every row, and meta.json.
+    """
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), 'r') as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, "ids.json"), 'r') as f:
+            self.ids = json.load(f)
+        with open(os.path.join(path, "terms.json"), 'r') as f:
+            self.terms = json.load(f)
+        self.path = path
+        self.table_name = self.meta["table_name"]
+        self.rows = np.load(os.path.join(path, "rows.npy"), mmap_mode='r')
+        self.impacts = np.load(os.path.join(path, "impacts.npy"), mmap_mode='r')
+        # every thread searching the index accumulates scores in arrays of its own, allocated once and reset after every query
+        self.local = threading.local()
+
+    @staticmethod
+    def write(path: str, table_name: str, ids: list, term_counts: list, chunks, num_postings: int):
+        """
+        Writes an index from chunks of postings, ordered by term and then by row.
+
+        Args:
+            path (str): Directory to write the index to.
+            table_name (str): Name of the table the postings come from.
+            ids (list): Id of every row.
+            term_counts (list): (term, number of postings) tuples, in the order of the postings.
+            chunks (iterable): (rows, impacts) arrays, num_postings postings in total.
+        """
+        os.makedirs(path, exist_ok=True)
+        rows = np.lib.format.open_memmap(os.path.join(path, "rows.npy"), mode='w+', dtype=np.int32, shape=(num_postings,))
+        impacts = np.lib.format.open_memmap(os.path.join(path, "impacts.npy"), mode='w+', dtype=np.float64, shape=(num_postings,))
+        written = 0
+        for chunk_rows, chunk_impacts in chunks:
+            rows[written:written + len(chunk_rows)] = chunk_rows
+            impacts[written:written + len(chunk_impacts)] = chunk_impacts
+            written += len(chunk_rows)
+        if written != num_postings:
+            raise ValueError(f"Expected {num_postings} postings from {table_name}, got {written}.")
+        terms = {}
+        start = 0
+        for term, count in term_counts:
+            terms[term] = [start, start + count, float(impacts[start:start + count].max())]
+            start += count
+        rows.flush()
+        impacts.flush()
+        del rows, impacts
+        with open(os.path.join(path, "ids.json"), 'w') as f:
+            json.dump(ids, f)
+        with open(os.path.join(path, "terms.json"), 'w') as f:
+            json.dump(terms, f, ensure_ascii=False)
+        with open(os.path.join(path, "meta.json"), 'w') as f:
+            json.dump({"table_name": table_name, "num_rows": len(ids), "num_terms": len(terms), "num_postings": num_postings}, f)
+
+    def scratch(self) -> tuple:
+        """Returns the scores and seen arrays of the calling thread, all zero and False between queries."""
+        if not hasattr(self.local, "scores"):
+            self.local.scores = np.zeros(len(self.ids))
+            self.local.seen = np.zeros(len(self.ids), dtype=bool)
+        return self.local.scores, self.local.seen
+
+    def search(self, query_strings: list, top_n=5) -> list:
+        return [self.search_one(query_string, top_n) for query_string in query_strings]
+
+    def search_one(self, query_string: str, top_n=5) -> list:
+        """
+        Finds the top_n rows by BM25 with MaxScore: terms are visited from the largest impact down, and once the
+        impacts of the remaining terms add up to less than the score of the current top_n-th row, no row that has
+        not been seen can make it into the top_n. From then on, rows that cannot reach the top_n are dropped, and
+        the remaining terms only look up the rows still in the running by binary search over their postings.
+        Like DuckDB's search, repeated query terms count once, ties are broken by id, and fewer than top_n matches
+        are padded with the zero-score rows of smallest id.
+
+        Returns:
+            list: A list of (id, score) tuples, ordered by descending score.
+        """
+        num_rows = len(self.ids)
+        top_n = min(top_n, num_rows)
+        if top_n <= 0:
+            return []
+        terms = sorted((self.terms[term] for term in set(query_string.split()) if term in self.terms), key=lambda term: term[2], reverse=True)
+        # remaining[i] bounds the score that terms i and after can add to a row
+        remaining = np.cumsum([term[2] for term in reversed(terms)])[::-1].tolist() + [0.0]
+        scores, seen = self.scratch()
+        visited = []
+        try:
+            num_seen = 0
+            threshold = 0.0
+            i = 0
+            while i < len(terms) and (num_seen < top_n or remaining[i] >= threshold):
+                start, end, _ = terms[i]
+                rows = self.rows[start:end]
+                scores[rows] += self.impacts[start:end]
+                new_rows = rows[~seen[rows]]
+                seen[new_rows] = True
+                visited.append(new_rows)
+                num_seen += len(new_rows)
+                if num_seen >= top_n:
+                    seen_scores = scores[np.concatenate(visited)] if len(visited) > 1 else scores[visited[0]]
+                    threshold = np.partition(seen_scores, num_seen - top_n)[num_seen - top_n]
+                i += 1
+            seen_rows = np.sort(np.concatenate(visited)) if visited else np.zeros(0, dtype=np.int32)
+            candidates = seen_rows
+            while i < len(terms):
+                candidates = candidates[scores[candidates] + remaining[i] >= threshold]
+                start, end, _ = terms[i]
+                rows = self.rows[start:end]
+                positions = np.minimum(np.searchsorted(rows, candidates), len(rows) - 1)
+                found = rows[positions] == candidates
+                scores[candidates[found]] += self.impacts[start:end][positions[found]]
+                i += 1
+        finally:
+            # only the rows this query visited were written to, so only they are reset
+            for rows in visited:
+                scores[rows] = 0.0
+                seen[rows] = False
+        # the scores of the rows left are summed again in the order DuckDB sums them, that of the terms' postings,
+        # so that scores tied there are tied here too, and broken by row, which is id order, as DuckDB breaks them
+        candidate_scores = np.zeros(len(candidates))
+        for start, end, _ in sorted(terms):
+            rows = self.rows[start:end]
+            positions = np.minimum(np.searchsorted(rows, candidates), len(rows) - 1)
+            found = rows[positions] == candidates
+            candidate_scores[found] += self.impacts[start:end][positions[found]]
+        order = np.lexsort((candidates, -candidate_scores))[:top_n]
+        results = [(self.ids[row], float(score)) for row, score in zip(candidates[order].tolist(), candidate_scores[order].tolist())]
+        if len(results) < top_n:
+            # fewer than top_n rows were seen, so the first rows not among them are all below top_n + len(seen_rows)
+            padding = np.setdiff1d(np.arange(top_n + len(seen_rows)), seen_rows, assume_unique=True)[:top_n - len(results)]
+            results.extend((self.ids[row], 0.0) for row in padding.tolist())
+        return results
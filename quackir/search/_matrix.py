@@ -0,0 +1,155 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import numpy as np
+import json
+import os
+
+MATRIX_DTYPES = ["float32", "float16", "int8"]
+
+# rows scored per matrix multiply, which bounds the memory used by a batch of queries to batch size * block rows floats
+BLOCK_ROWS = 65536
+
+# candidates per result that int8 matrices rescore at full precision
+RESCORE_FACTOR = 4
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def quantize_rows(vectors: np.ndarray):
+    """
+    Scalar-quantizes every row to int8, scaling its largest absolute value to 127.
+
+    Returns:
+        tuple: The int8 rows, and the float32 scale of every row, which maps them back to the original values.
+    """
+    scales = np.abs(vectors).max(axis=1) / 127 if vectors.size else np.zeros(len(vectors))
+    scales[scales == 0] = 1
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+class DenseMatrix:
+    """
+    The embeddings of a dense table, exported to a memory-mapped matrix of L2-normalized rows so that
+    cosine similarity reduces to a matrix multiply. A matrix is a directory holding embeddings.npy,
+    ids.json with the id of every row, and meta.json. An int8 matrix also holds scales.npy with the scale
+    of every quantized row, and rescore.npy with the float32 rows its top candidates are rescored with.
+    """
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), 'r') as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, "ids.json"), 'r') as f:
+            self.ids = json.load(f)
+        self.path = path
+        self.table_name = self.meta["table_name"]
+        self.matrix = np.load(os.path.join(path, "embeddings.npy"), mmap_mode='r')
+        self.scales = None
+        self.rescore_matrix = None
+        if self.meta.get("dtype") == "int8":
+            self.scales = np.load(os.path.join(path, "scales.npy"))
+            self.rescore_matrix = np.load(os.path.join(path, "rescore.npy"), mmap_mode='r')
+
+    @staticmethod
+    def write(path: str, table_name: str, chunks, num_rows: int, dimension: int, dtype="float32"):
+        """
+        Writes a matrix from chunks of (id, embedding) rows, normalizing each chunk as it is written.
+
+        Args:
+            path (str): Directory to write the matrix to.
+            table_name (str): Name of the table the embeddings come from.
+            chunks (iterable): Lists of (id, embedding) rows, num_rows in total.
+            dtype (str): float32, float16 to halve the size of the matrix, or int8 to scan a quarter of it and rescore the top candidates.
+        """
+        if dtype not in MATRIX_DTYPES:
+            raise ValueError(f"Unsupported matrix dtype: {dtype}. Must be one of {MATRIX_DTYPES}.")
+        os.makedirs(path, exist_ok=True)
+        matrix = np.lib.format.open_memmap(os.path.join(path, "embeddings.npy"), mode='w+', dtype=dtype, shape=(num_rows, dimension))
+        if dtype == "int8":
+            scales = np.zeros(num_rows, dtype=np.float32)
+            rescore_matrix = np.lib.format.open_memmap(os.path.join(path, "rescore.npy"), mode='w+', dtype=np.float32, shape=(num_rows, dimension))
+        ids = []
+        for chunk in chunks:
+            start = len(ids)
+            ids.extend(str(id) for id, _ in chunk)
+            rows = normalize_rows(np.asarray([embedding for _, embedding in chunk], dtype=np.float32))
+            if dtype == "int8":
+                matrix[start:len(ids)], scales[start:len(ids)] = quantize_rows(rows)
+                rescore_matrix[start:len(ids)] = rows
+            else:
+                matrix[start:len(ids)] = rows
+        if len(ids) != num_rows:
+            raise ValueError(f"Expected {num_rows} rows from {table_name}, got {len(ids)}.")
+        matrix.flush()
+        del matrix
+        if dtype == "int8":
+            np.save(os.path.join(path, "scales.npy"), scales)
+            rescore_matrix.flush()
+            del rescore_matrix
+        with open(os.path.join(path, "ids.json"), 'w') as f:
+            json.dump(ids, f)
+        with open(os.path.join(path, "meta.json"), 'w') as f:
+            json.dump({"table_name": table_name, "num_rows": num_rows, "dimension": dimension, "dtype": dtype}, f)
+
+    def search(self, query_embeddings: list, top_n=5) -> list:
+        """
+        Scores every row against a batch of queries, one block of rows at a time, keeping the top_n of each block
+        with argpartition and merging them at the end. An int8 matrix keeps RESCORE_FACTOR times as many candidates
+        by their quantized scores, and ranks them by their exact scores from the float32 rows.
+
+        Returns:
+            list: A list of (id, cosine similarity) tuples per query, ordered by descending score.
+        """
+        queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+        num_rows = self.matrix.shape[0]
+        top_n = min(top_n, num_rows)
+        if top_n <= 0:
+            return [[] for _ in range(len(queries))]
+        depth = min(top_n * RESCORE_FACTOR, num_rows) if self.rescore_matrix is not None else top_n
+        candidate_rows = []
+        candidate_scores = []
+        for start in range(0, num_rows, BLOCK_ROWS):
+            block = np.asarray(self.matrix[start:start + BLOCK_ROWS], dtype=np.float32)
+            scores = queries @ block.T
+            if self.scales is not None:
+                scores *= self.scales[start:start + BLOCK_ROWS]
+            if scores.shape[1] > depth:
+                top = np.argpartition(-scores, depth - 1, axis=1)[:, :depth]
+                scores = np.take_along_axis(scores, top, axis=1)
+            else:
+                top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+            candidate_rows.append(top + start)
+            candidate_scores.append(scores)
+        rows = np.concatenate(candidate_rows, axis=1)
+        scores = np.concatenate(candidate_scores, axis=1)
+        if scores.shape[1] > depth:
+            top = np.argpartition(-scores, depth - 1, axis=1)[:, :depth]
+            rows = np.take_along_axis(rows, top, axis=1)
+            scores = np.take_along_axis(scores, top, axis=1)
+        if self.rescore_matrix is not None:
+            # candidates are read in row order, so that they come off the memory-mapped file sequentially
+            rows = np.sort(rows, axis=1)
+            scores = np.stack([np.asarray(self.rescore_matrix[query_rows]) @ query for query_rows, query in zip(rows, queries)])
+        if scores.shape[1] > top_n:
+            top = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+            rows = np.take_along_axis(rows, top, axis=1)
+            scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-scores, axis=1, kind='stable')
+        rows = np.take_along_axis(rows, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        return [[(self.ids[row], float(score)) for row, score in zip(query_rows, query_scores)]
+                for query_rows, query_scores in zip(rows.tolist(), scores.tolist())]
@@ -0,0 +1,127 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from ._util import get_searcher
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
+import threading
+
+def search_block(searcher, block: list, method, top_n=1000, tokenize_query=True, table_names=["corpus"], rrf_k=60, rrf_depth=None) -> list:
+    """
+    Searches for a block of queries, one at a time if the block holds a single query and as a batch otherwise.
+
+    Args:
+        searcher (Searcher): The searcher to use.
+        block (list): Tuples of (query_id, query_string, query_embedding).
+
+    Returns:
+        list: A (query_id, doc_id, score, rank) tuple for every result of every query in the block.
+    """
+    if len(block) == 1:
+        query_id, query_string, query_embedding = block[0]
+        block_results = [searcher.search(
+            method=method,
+            query_id=query_id,
+            query_string=query_string,
+            query_embedding=query_embedding,
+            top_n=top_n,
+            tokenize_query=tokenize_query,
+            table_names=table_names,
+            rrf_k=rrf_k,
+            rrf_depth=rrf_depth
+        )]
+    else:
+        block_results = searcher.batch_search(
+            method=method,
+            queries=block,
+            top_n=top_n,
+            tokenize_query=tokenize_query,
+            table_names=table_names,
+            rrf_k=rrf_k,
+            rrf_depth=rrf_depth
+        )
+    results = []
+    for (query_id, _, _), query_results in zip(block, block_results):
+        for rank, (doc_id, score) in enumerate(query_results, 1):
+            results.append((query_id, doc_id, score, rank))
+    return results
+
+_process_searcher = None
+
+def _init_process_worker(searcher_args: dict):
+    global _process_searcher
+    _process_searcher = get_searcher(**searcher_args, read_only=True)
+
+def _search_block_in_process(block: list, search_args: dict) -> list:
+    return search_block(_process_searcher, block, **search_args)
+
+def run_search(searcher, blocks: list, search_args: dict, threads=1, processes=1, searcher_args: dict = None, progress=None) -> list:
+    """
+    Searches for blocks of queries, sharded across worker threads or processes that each own a database connection.
+    Thread workers get their connection from searcher.worker(); process workers open their own read-only searcher.
+
+    Args:
+        searcher (Searcher): The searcher to use, or to derive thread workers from.
+        blocks (list): Blocks of (query_id, query_string, query_embedding) tuples.
+        search_args (dict): Keyword arguments passed on to search_block.
+        threads (int): Number of worker threads.
+        processes (int): Number of worker processes. Ignored if threads is more than 1.
+        searcher_args (dict): Keyword arguments for get_searcher, required for worker processes.
+        progress (tqdm): Progress bar to update with the number of queries searched.
+
+    Returns:
+        list: (query_id, doc_id, score, rank) tuples in no particular order.
+    """
+    all_results = []
+    if threads > 1:
+        local = threading.local()
+        workers = []
+        lock = threading.Lock()
+
+        def search_in_thread(block):
+            if not hasattr(local, "searcher"):
+                local.searcher = searcher.worker()
+                with lock:
+                    workers.append(local.searcher)
+            return search_block(local.searcher, block, **search_args)
+
+        try:
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                futures = {executor.submit(search_in_thread, block): len(block) for block in blocks}
+                for future in as_completed(futures):
+                    all_results.extend(future.result())
+                    if progress is not None:
+                        progress.update(futures[future])
+        finally:
+            for worker in workers:
+                worker.close()
+    elif processes > 1:
+        if searcher_args is None:
+            raise ValueError("Searching with worker processes requires the arguments to create their searchers.")
+        # spawn so that no worker inherits the parent's database connections or JVM
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_process_worker, initargs=(searcher_args,)) as executor:
+            futures = {executor.submit(_search_block_in_process, block, search_args): len(block) for block in blocks}
+            for future in as_completed(futures):
+                all_results.extend(future.result())
+                if progress is not None:
+                    progress.update(futures[future])
+    else:
+        for block in blocks:
+            all_results.extend(search_block(searcher, block, **search_args))
+            if progress is not None:
+                progress.update(len(block))
+    return all_results
@@ -15,13 +15,91 @@
 #
 
 import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.errors import UndefinedTable
 import re
 from ._base import Searcher
-from quackir._base import SearchType
+from quackir._base import IndexType, EmbeddingPrecision, TableInfo, VERSION_TABLE
+
+# the pgvector type of every precision it stores, single precision vector and half precision halfvec
+POSTGRES_EMBEDDING_TYPES = {
+    EmbeddingPrecision.FLOAT32: "vector",
+    EmbeddingPrecision.FLOAT16: "halfvec",
+}
+
+def embedding_precision(type_name: str) -> EmbeddingPrecision:
+    for precision, postgres_type in POSTGRES_EMBEDDING_TYPES.items():
+        if type_name == postgres_type:
+            return precision
+    raise ValueError(f"Unsupported embedding type: {type_name}.")
+
+def describe_postgres_table(conn, table_name: str) -> TableInfo:
+    cur = conn.cursor()
+    cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table_name,))
+    columns = [row[0] for row in cur.fetchall()]
+    cur.execute(f"SELECT COUNT(*) FROM {table_name}")
+    num_rows = cur.fetchone()[0]
+    cur.execute("SELECT indexdef FROM pg_indexes WHERE tablename = %s", (table_name,))
+    index_definitions = [row[0].lower() for row in cur.fetchall()]
+    if "contents" in columns:
+        # BM25 needs the stored tsvector and the statistics fts_index builds, which databases indexed before them lack
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (f"{table_name}_bm25_stats",))
+        has_bm25_stats = cur.fetchone()[0]
+        has_fts_index = "contents_tsv" in columns and has_bm25_stats and any("using gin" in definition for definition in index_definitions)
+        info = TableInfo(IndexType.SPARSE, num_rows=num_rows, has_fts_index=has_fts_index)
+    elif "embedding" in columns:
+        # the type modifier of a vector or halfvec column is its dimension
+        cur.execute("SELECT atttypmod, atttypid::regtype::text FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'embedding'", (table_name,))
+        dimension, type_name = cur.fetchone()
+        has_ann_index = any("using hnsw" in definition or "using ivfflat" in definition for definition in index_definitions)
+        info = TableInfo(IndexType.DENSE, dimension=dimension if dimension > 0 else None, num_rows=num_rows, has_ann_index=has_ann_index,
+                         precision=embedding_precision(type_name))
+    else:
+        raise ValueError(f"Unknown type for table {table_name}. Ensure it has either an 'embedding' column or a 'contents' column.")
+    return info
 
 class PostgresSearcher(Searcher):
-    def __init__(self, db_name="quackir", user="postgres"):
-        self.conn = psycopg2.connect(dbname=db_name, user=user)
+    def __init__(self, db_name="quackir", user="postgres", pool: ThreadedConnectionPool = None, max_connections=64):
+        super().__init__()
+        self.db_name = db_name
+        self.user = user
+        self.max_connections = max_connections
+        self.parent_pool = pool
+        self.pool = None
+        self.conn = pool.getconn() if pool is not None else psycopg2.connect(dbname=db_name, user=user)
+
+    def worker(self):
+        if self.pool is None:
+            self.pool = ThreadedConnectionPool(1, self.max_connections, dbname=self.db_name, user=self.user)
+        return self.share_settings(PostgresSearcher(self.db_name, self.user, pool=self.pool))
+
+    def apply_ann_params(self):
+        cur = self.conn.cursor()
+        if "ef_search" in self.ann_params:
+            cur.execute("SET hnsw.ef_search = %s", (int(self.ann_params["ef_search"]),))
+        if "probes" in self.ann_params:
+            cur.execute("SET ivfflat.probes = %s", (int(self.ann_params["probes"]),))
+        self.conn.commit()
+
+    def close(self):
+        self.close_leg_worker()
+        if self.parent_pool is not None:
+            self.parent_pool.putconn(self.conn)
+        else:
+            self.conn.close()
+        if self.pool is not None:
+            self.pool.closeall()
+
+    def table_version(self, table_name: str):
+        cur = self.conn.cursor()
+        try:
+            cur.execute(f"SELECT version FROM {VERSION_TABLE} WHERE table_name = %s", (table_name,))
+            row = cur.fetchone()
+        except UndefinedTable:
+            self.conn.rollback()
+            return None
+        return row[0] if row is not None else None
 
     @staticmethod
     def clean_tsquery(query_string):
@@ -30,57 +108,84 @@ class PostgresSearcher(Searcher):
         ts_query = " | ".join(cleaned_query.split())
         return ts_query
     
-    def get_search_type(self, table_name: str) -> SearchType:
-        cur = self.conn.cursor()
-        cur.execute(f"SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table_name,))
-        columns = [row[0] for row in cur.fetchall()]
-        if "contents" in columns:
-            return SearchType.SPARSE
-        elif "embedding" in columns:
-            return SearchType.DENSE
-        else:
-            raise ValueError(f"Unknown search type for table {table_name}. Ensure it has either an 'embedding' column or a 'contents' column.")
+    def describe_table(self, table_name: str) -> TableInfo:
+        return describe_postgres_table(self.conn, table_name)
     
+    def check_fts_index(self, table_name: str):
+        if not self.table_info(table_name).has_fts_index:
+            raise ValueError(f"Table {table_name} has no BM25 index, or was indexed before BM25 statistics were kept. Re-run fts_index on it.")
+
+    @staticmethod
+    def bm25_query(table_name: str, ts_query: str, limit: str) -> str:
+        """
+        Builds a query for the top documents of table_name by BM25, with the same k1 and b as DuckDB.
+        Documents are matched through the GIN index on contents_tsv and scored from the term frequencies stored in it,
+        along with the document lengths, document frequencies and collection statistics built by the indexer.
+        Term frequencies are the number of positions of a lexeme, and a tsvector keeps at most 256 positions per lexeme
+        and none past position 16383, so term frequencies and document lengths are undercounted for long documents,
+        and their scores only approximate BM25.
+
+        Args:
+            ts_query (str): SQL expression for the query, as text for to_tsquery with its terms joined by ' | '.
+            limit (str): SQL expression for the number of documents to return.
+        """
+        return f"""
+        SELECT docs.id, SUM(
+            log(((stats.num_docs - df.df) + 0.5) / (df.df + 0.5) + 1) *
+            ((doc_terms.tf * (0.9 + 1)) / (doc_terms.tf + (0.9 * ((1 - 0.4) + (0.4 * (doclen.len / stats.avgdl))))))) AS score
+        FROM {table_name} docs
+        CROSS JOIN LATERAL (
+            SELECT lexeme, array_length(positions, 1) AS tf FROM unnest(docs.contents_tsv)
+        ) doc_terms
+        JOIN {table_name}_bm25_df df ON df.term = doc_terms.lexeme
+        JOIN {table_name}_bm25_doclen doclen ON doclen.id = docs.id
+        CROSS JOIN {table_name}_bm25_stats stats
+        WHERE docs.contents_tsv @@ to_tsquery('simple', {ts_query})
+            AND doc_terms.lexeme = ANY(tsvector_to_array(to_tsvector('simple', replace({ts_query}, ' | ', ' '))))
+        GROUP BY docs.id
+        ORDER BY score DESC, docs.id
+        LIMIT {limit}
+        """
+
     def fts_search(self, query_string, top_n=5, table_name="corpus"):
+        self.check_fts_index(table_name)
         ts_query = self.clean_tsquery(query_string)
-        query = f"""
-        SELECT 
-            id, 
-            ts_rank(to_tsvector('simple', contents), to_tsquery('simple', %s)) AS score
-        FROM 
-            {table_name}
-        WHERE
-            to_tsvector('simple', contents) @@ to_tsquery('simple', %s)
-        ORDER BY 
-            score DESC
-        LIMIT %s
-        """
+        query = self.bm25_query(table_name, "%(query)s", "%(n)s")
         cur = self.conn.cursor()
-        cur.execute(query, (ts_query, ts_query, top_n))
+        cur.execute(query, {'query': ts_query, 'n': top_n})
         return cur.fetchall()
     
+    def vector_type(self, table_name: str) -> str:
+        # the distance operators take two vectors or two halfvecs, so query vectors are cast to the type of the table
+        return POSTGRES_EMBEDDING_TYPES[self.table_info(table_name).precision]
+
     def embedding_search(self, query_embedding, top_n=5, table_name="corpus"):
         cur = self.conn.cursor()
-        query = f"""select id, 1 - (embedding <=> %s::vector) as score from {table_name} order by score desc limit %s"""
-        cur.execute(query, (query_embedding, top_n))
+        vector_type = self.vector_type(table_name)
+        # ordering by the distance operator itself lets an hnsw or ivfflat index serve the query
+        query = f"""select id, 1 - (embedding <=> %(vector)s::{vector_type}) as score from {table_name} order by embedding <=> %(vector)s::{vector_type} limit %(n)s"""
+        cur.execute(query, {'vector': query_embedding, 'n': top_n})
         return cur.fetchall()
     
-    def rrf_search(self, query_string: str, query_embedding: str, top_n=5, k=60, table_names=["sparse", "dense"]):
-        sparse_table = table_names[0] if self.get_search_type(table_names[0]) == SearchType.SPARSE else table_names[1]
-        dense_table = table_names[1] if self.get_search_type(table_names[1]) == SearchType.DENSE else table_names[0]
+    def rrf_search(self, query_string: str, query_embedding: str, top_n=5, k=60, table_names=["sparse", "dense"], depth=None):
+        sparse_table, dense_table = self.split_hybrid_tables(table_names)
+        self.check_fts_index(sparse_table)
         ts_query = self.clean_tsquery(query_string)
+        vector_type = self.vector_type(dense_table)
         cur = self.conn.cursor()
         sql = f"""
         WITH semantic_search AS (
-            SELECT id, RANK () OVER (ORDER BY embedding <=> %(vector)s::vector) AS rank
-            FROM {dense_table}
-            LIMIT %(n)s
+            SELECT id, ROW_NUMBER() OVER (ORDER BY distance, id) AS rank
+            FROM (
+                SELECT id, embedding <=> %(vector)s::{vector_type} AS distance
+                FROM {dense_table}
+                ORDER BY embedding <=> %(vector)s::{vector_type}
+                LIMIT %(depth)s
+            ) nearest
         ),
         keyword_search AS (
-            SELECT id, RANK () OVER (ORDER BY ts_rank(to_tsvector('simple', contents), query) DESC) as rank
-            FROM {sparse_table}, to_tsquery('simple', %(query)s) query
-            WHERE to_tsvector('simple', contents) @@ query
-            LIMIT %(n)s
+            SELECT id, ROW_NUMBER() OVER (ORDER BY score DESC, id) as rank
+            FROM ({self.bm25_query(sparse_table, "%(query)s", "%(depth)s")}) bm25
         )
         SELECT
             COALESCE(semantic_search.id, keyword_search.id) AS id,
@@ -88,9 +193,87 @@ class PostgresSearcher(Searcher):
             COALESCE(1.0 / (%(k)s + keyword_search.rank), 0.0) AS score
         FROM semantic_search
         FULL OUTER JOIN keyword_search ON semantic_search.id = keyword_search.id
-        ORDER BY score DESC
+        ORDER BY score DESC, id
         LIMIT %(n)s
         """
-        cur.execute(sql, {'query': ts_query, 'vector': query_embedding, 'n': top_n, 'k': k})
+        cur.execute(sql, {'query': ts_query, 'vector': query_embedding, 'n': top_n, 'depth': depth or top_n, 'k': k})
         results = cur.fetchall()
-        return results
\ No newline at end of file
+        return results
+
+    def load_batch_queries(self, cur, query_strings: list = None, query_embeddings: list = None, vector_type="vector"):
+        """Loads a block of queries into the temp table batch_queries, which is dropped on the next commit."""
+        num_queries = len(query_strings) if query_strings is not None else len(query_embeddings)
+        if query_strings is None:
+            query_strings = [None] * num_queries
+        if query_embeddings is None:
+            query_embeddings = [None] * num_queries
+        cur.execute(f"CREATE TEMP TABLE batch_queries (qidx integer, query text, embedding {vector_type}) ON COMMIT DROP")
+        rows = [(i, self.clean_tsquery(query_string) if query_string is not None else None, query_embedding)
+                for i, (query_string, query_embedding) in enumerate(zip(query_strings, query_embeddings))]
+        execute_values(cur, "INSERT INTO batch_queries (qidx, query, embedding) VALUES %s", rows, template=f"(%s, %s, %s::{vector_type})")
+        return num_queries
+
+    def run_batch_query(self, cur, query, params, num_queries):
+        try:
+            cur.execute(query, params)
+            return self.group_batch_results(cur.fetchall(), num_queries)
+        finally:
+            self.conn.commit()
+
+    def batch_fts_search(self, query_strings, top_n=5, table_name="corpus"):
+        self.check_fts_index(table_name)
+        cur = self.conn.cursor()
+        num_queries = self.load_batch_queries(cur, query_strings=query_strings)
+        query = f"""
+        SELECT batch_queries.qidx, fts.id, fts.score
+        FROM batch_queries
+        CROSS JOIN LATERAL ({self.bm25_query(table_name, "batch_queries.query", "%(n)s")}) fts
+        ORDER BY batch_queries.qidx, fts.score DESC, fts.id
+        """
+        return self.run_batch_query(cur, query, {'n': top_n}, num_queries)
+
+    def batch_embedding_search(self, query_embeddings, top_n=5, table_name="corpus"):
+        cur = self.conn.cursor()
+        num_queries = self.load_batch_queries(cur, query_embeddings=query_embeddings, vector_type=self.vector_type(table_name))
+        query = f"""
+        SELECT batch_queries.qidx, embd.id, embd.score
+        FROM batch_queries
+        CROSS JOIN LATERAL (
+            select id, 1 - (embedding <=> batch_queries.embedding) as score from {table_name} order by embedding <=> batch_queries.embedding limit %s
+        ) embd
+        ORDER BY batch_queries.qidx, embd.score DESC, embd.id
+        """
+        return self.run_batch_query(cur, query, (top_n,), num_queries)
+
+    def batch_rrf_search(self, query_strings, query_embeddings, top_n=5, k=60, table_names=["sparse", "dense"], depth=None):
+        sparse_table, dense_table = self.split_hybrid_tables(table_names)
+        self.check_fts_index(sparse_table)
+        cur = self.conn.cursor()
+        num_queries = self.load_batch_queries(cur, query_strings=query_strings, query_embeddings=query_embeddings, vector_type=self.vector_type(dense_table))
+        sql = f"""
+        SELECT batch_queries.qidx, rrf.id, rrf.score
+        FROM batch_queries
+        CROSS JOIN LATERAL (
+            SELECT
+                COALESCE(semantic_search.id, keyword_search.id) AS id,
+                COALESCE(1.0 / (%(k)s + semantic_search.rank), 0.0) +
+                COALESCE(1.0 / (%(k)s + keyword_search.rank), 0.0) AS score
+            FROM (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY distance, id) AS rank
+                FROM (
+                    SELECT id, embedding <=> batch_queries.embedding AS distance
+                    FROM {dense_table}
+                    ORDER BY embedding <=> batch_queries.embedding
+                    LIMIT %(depth)s
+                ) nearest
+            ) semantic_search
+            FULL OUTER JOIN (
+                SELECT id, ROW_NUMBER() OVER (ORDER BY score DESC, id) as rank
+                FROM ({self.bm25_query(sparse_table, "batch_queries.query", "%(depth)s")}) bm25
+            ) keyword_search ON semantic_search.id = keyword_search.id
+            ORDER BY score DESC, id
+            LIMIT %(n)s
+        ) rrf
+        ORDER BY batch_queries.qidx, rrf.score DESC, rrf.id
+        """
+        return self.run_batch_query(cur, sql, {'n': top_n, 'depth': depth or top_n, 'k': k}, num_queries)
@@ -0,0 +1,101 @@
+#
+# QuackIR: Reproducible IR research in RDBMS
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+from ._base import Searcher
+from quackir._base import TableInfo, shard_table_name
+from concurrent.futures import ThreadPoolExecutor
+from heapq import merge
+from itertools import islice
+
+class ShardedSearcher(Searcher):
+    """
+    Searches an index built by a ShardedIndexer by scatter-gather: every search goes to all shards at once, each on
+    a searcher with a connection of its own, and the top_n results of every shard are merged into the overall top_n.
+    Tables are named as in an index that is not sharded, and shard_table maps them to the table of every shard.
+    Hybrid search always fuses its legs here, since reciprocal rank fusion needs the ranks across all shards.
+
+    Args:
+        searchers (list): The searcher of every shard, in order, each with a connection of its own.
+        separate_files (bool): Whether every shard is a database of its own, holding a table named as the index.
+    """
+    def __init__(self, searchers: list, separate_files=False):
+        super().__init__()
+        self.searchers = searchers
+        self.separate_files = separate_files
+        self.executor = ThreadPoolExecutor(max_workers=len(searchers))
+
+    def shard_table(self, table_name: str, shard: int) -> str:
+        return table_name if self.separate_files else shard_table_name(table_name, shard)
+
+    def worker(self):
+        return self.share_settings(ShardedSearcher([searcher.worker() for searcher in self.searchers], self.separate_files))
+
+    def apply_ann_params(self):
+        for searcher in self.searchers:
+            searcher.set_ann_params(**self.ann_params)
+
+    def describe_table(self, table_name: str) -> TableInfo:
+        infos = [searcher.table_info(self.shard_table(table_name, shard)) for shard, searcher in enumerate(self.searchers)]
+        return TableInfo(infos[0].index_type, dimension=infos[0].dimension, num_rows=sum(info.num_rows for info in infos),
+                         has_fts_index=all(info.has_fts_index for info in infos), has_ann_index=all(info.has_ann_index for info in infos),
+                         precision=infos[0].precision)
+
+    def table_version(self, table_name: str):
+        # a sharded table changes whenever any of its shards does
+        versions = [searcher.table_version(self.shard_table(table_name, shard)) for shard, searcher in enumerate(self.searchers)]
+        return None if None in versions else ".".join(versions)
+
+    def fuses_legs(self, table_names: list) -> bool:
+        return True
+
+    def scatter(self, search, queries: list, top_n: int, table_name: str) -> list:
+        """
+        Runs search(searcher, queries, top_n, shard_table) on every shard concurrently, and merges the results of every query
+        by descending score, ties broken by id as in an unsharded table, into its top_n.
+        """
+        futures = [self.executor.submit(search, searcher, queries, top_n, self.shard_table(table_name, shard)) for shard, searcher in enumerate(self.searchers)]
+        shard_results = [future.result() for future in futures]
+        return [list(islice(merge(*query_results, key=lambda result: (-result[1], result[0])), top_n)) for query_results in zip(*shard_results)]
+
+    def database_sparse_results(self, query_strings: list, top_n=5, table_name="corpus"):
+        return self.scatter(Searcher.sparse_results, query_strings, top_n, table_name)
+
+    def database_dense_results(self, query_embeddings: list, top_n=5, table_name="corpus"):
+        return self.scatter(Searcher.dense_results, query_embeddings, top_n, table_name)
+
+    def fts_search(self, query_string, top_n=5, table_name="corpus"):
+        return self.database_sparse_results([query_string], top_n, table_name)[0]
+
+    def embedding_search(self, query_embedding, top_n=5, table_name="corpus"):
+        return self.database_dense_results([query_embedding], top_n, table_name)[0]
+
+    def batch_fts_search(self, query_strings, top_n=5, table_name="corpus"):
+        return self.database_sparse_results(query_strings, top_n, table_name)
+
+    def batch_embedding_search(self, query_embeddings, top_n=5, table_name="corpus"):
+        return self.database_dense_results(query_embeddings, top_n, table_name)
+
+    def rrf_search(self, query_string, query_embedding, top_n=5, k=60, table_names=["sparse", "dense"], depth=None):
+        return self.fused_rrf_search([query_string], [query_embedding], top_n=top_n, k=k, table_names=table_names, depth=depth)[0]
+
+    def batch_rrf_search(self, query_strings, query_embeddings, top_n=5, k=60, table_names=["sparse", "dense"], depth=None):
+        return self.fused_rrf_search(query_strings, query_embeddings, top_n=top_n, k=k, table_names=table_names, depth=depth)
+
+    def close(self):
+        self.close_leg_worker()
+        self.executor.shutdown()
+        # workers of a shard's searcher go before the searcher whose connection they share
+        for searcher in reversed(self.searchers):
+            searcher.close()
@@ -15,41 +15,122 @@
 #
 
 import sqlite3
+from functools import lru_cache
 from ._base import Searcher
-from quackir._base import SearchType
+from quackir._base import IndexType, TableInfo
+
+def describe_sqlite_table(conn, table_name: str) -> TableInfo:
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})").fetchall()]
+    if "contents" not in columns:
+        raise ValueError(f"Unknown type for table {table_name}. Ensure it has a 'contents' column. SQLite only supports sparse tables currently.")
+    num_rows = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+    has_fts_index = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = ?", (f"fts_{table_name}",)).fetchone()[0] > 0
+    return TableInfo(IndexType.SPARSE, num_rows=num_rows, has_fts_index=has_fts_index)
 
 class SQLiteSearcher(Searcher):
-    def __init__(self, db_path="sqlite.db"):
-        self.conn = sqlite3.connect(db_path)
-
-    def get_search_type(self, table_name: str) -> SearchType:
-        cur = self.conn.execute(f'select * from {table_name}')
-        names = list(map(lambda x: x[0], cur.description))
-        if "contents" in names:
-            return SearchType.SPARSE
+    def __init__(self, db_path="sqlite.db", read_only=False, mmap_size: int = None, shared_cache=False):
+        """
+        Args:
+            db_path (str): Path to the database.
+            read_only (bool): Open the database in read-only mode.
+            mmap_size (int): Bytes of the database to read through memory mapping instead of the page cache.
+            shared_cache (bool): Share one page cache between the connections of this process to the database,
+                such as those of threaded workers. Only applies in read-only mode.
+        """
+        super().__init__()
+        self.db_path = db_path
+        self.mmap_size = mmap_size
+        self.shared_cache = shared_cache
+        if read_only:
+            cache = "&cache=shared" if shared_cache else ""
+            self.conn = sqlite3.connect(f"file:{db_path}?mode=ro{cache}", uri=True, check_same_thread=False)
         else:
-            raise ValueError(f"Unknown search type for table {table_name}. Ensure it has a 'contents' column. SQLite only supports sparse search currently.")
+            self.conn = sqlite3.connect(db_path)
+        if mmap_size is not None:
+            self.conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
 
-    def fts_search(self, query_string, top_n=5, table_name="corpus"):
-        query = f"""
-        SELECT id, bm25(fts_{table_name})*-1 AS score
-        FROM fts_{table_name}
-        WHERE fts_{table_name} MATCH '{{}}'
-        ORDER BY score DESC
-        LIMIT {{}}
-        """
-        query_string = query_string.replace("'", "''").replace('"', '""')
+    def worker(self):
+        return self.share_settings(SQLiteSearcher(self.db_path, read_only=True, mmap_size=self.mmap_size, shared_cache=self.shared_cache))
+
+    def is_missing_table(self, error: Exception) -> bool:
+        return isinstance(error, sqlite3.OperationalError) and str(error).startswith("no such table")
+
+    def describe_table(self, table_name: str) -> TableInfo:
+        return describe_sqlite_table(self.conn, table_name)
+
+    @staticmethod
+    def match_expression(query_string):
+        query_string = query_string.replace('"', '""')
         terms = query_string.split()
         escaped_terms = terms
         # make each term a string so that any special chars are escaped
         escaped_terms = [f'"{term}"' for term in escaped_terms]
         # allow matching of any of the terms, using + or AND will turn it into boolean AND retrieval
-        res = " OR ".join(escaped_terms)
-        query = query.format(res, top_n)
-        return self.conn.execute(query).fetchall()
+        return " OR ".join(escaped_terms)
+
+    # The match expression and the number of results are bound as parameters, so that the SQL text is the same
+    # for every query on a table, and sqlite3 reuses its prepared statement instead of compiling it again.
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def fts_query(table_name: str) -> str:
+        # ids are looked up in the table, which also covers contentless indexes that do not keep them, only for the
+        # top rows and those tied with the last of them, and then break the ties
+        return f"""
+        WITH matches AS MATERIALIZED (
+            SELECT rowid, bm25(fts_{table_name})*-1 AS score
+            FROM fts_{table_name}
+            WHERE fts_{table_name} MATCH ?1
+        )
+        SELECT {table_name}.id, matches.score
+        FROM matches
+        JOIN {table_name} ON {table_name}.rowid = matches.rowid
+        WHERE matches.score >= (SELECT MIN(score) FROM (SELECT score FROM matches ORDER BY score DESC LIMIT ?2))
+        ORDER BY matches.score DESC, {table_name}.id
+        LIMIT ?2
+        """
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def batch_fts_query(table_name: str) -> str:
+        return f"""
+        WITH fts AS (
+            SELECT batch_queries.qidx, fts_{table_name}.rowid, bm25(fts_{table_name})*-1 AS score
+            FROM batch_queries, fts_{table_name}
+            WHERE fts_{table_name} MATCH batch_queries.contents
+        ),
+        tied AS (
+            SELECT qidx, rowid, score, RANK() OVER (PARTITION BY qidx ORDER BY score DESC) AS rank
+            FROM fts
+        ),
+        ranked AS (
+            SELECT tied.qidx, {table_name}.id, tied.score, ROW_NUMBER() OVER (PARTITION BY tied.qidx ORDER BY tied.score DESC, {table_name}.id) AS rank
+            FROM tied
+            JOIN {table_name} ON {table_name}.rowid = tied.rowid
+            WHERE tied.rank <= ?1
+        )
+        SELECT qidx, id, score
+        FROM ranked
+        WHERE rank <= ?1
+        ORDER BY qidx, score DESC, id
+        """
+
+    def fts_search(self, query_string, top_n=5, table_name="corpus"):
+        return self.conn.execute(self.fts_query(table_name), (self.match_expression(query_string), top_n)).fetchall()
+
+    def batch_fts_search(self, query_strings, top_n=5, table_name="corpus"):
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS batch_queries (qidx INTEGER, contents TEXT)")
+        self.conn.execute("DELETE FROM batch_queries")
+        rows = [(i, self.match_expression(query_string)) for i, query_string in enumerate(query_strings)]
+        self.conn.executemany("INSERT INTO batch_queries VALUES (?, ?)", rows)
+        return self.group_batch_results(self.conn.execute(self.batch_fts_query(table_name), (top_n,)).fetchall(), len(query_strings))
     
+    def fuses_legs(self, table_names: list) -> bool:
+        # SQLite has no dense tables, so the dense leg of hybrid search always comes from an attached dense matrix
+        return True
+
     def embedding_search(self, query_embedding: str, top_n=5, table_name="corpus"):
-        pass
+        raise ValueError(f"SQLite does not support dense search on {table_name}. Attach a dense matrix of it to search it instead.")
 
-    def rrf_search(self, query_string: str, query_embedding: str, top_n=5, k=60, table_name="corpus"):
-        pass
\ No newline at end of file
+    def rrf_search(self, query_string: str, query_embedding: str, top_n=5, k=60, table_names=["sparse", "dense"], depth=None):
+        return self.fused_rrf_search([query_string], [query_embedding], top_n=top_n, k=k, table_names=table_names, depth=depth)[0]
\ No newline at end of file
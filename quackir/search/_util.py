@@ -17,10 +17,12 @@
 from ._duck import DuckDBSearcher
 from ._sqlite import SQLiteSearcher
 from ._postgres import PostgresSearcher
-from quackir._base import SearchDB
+from ._cache import ResultCache
+from ._shard import ShardedSearcher
+from quackir._base import SearchDB, shard_db_path
 import re
 
-def get_searcher(db_type: SearchDB, db_path: str = "database.db", db_name: str = "quackir", db_user: str = "postgres") -> object:
+def get_searcher(db_type: SearchDB, db_path: str = "database.db", db_name: str = "quackir", db_user: str = "postgres", read_only: bool = False, dense_matrices: list = None, impact_indexes: list = None, ann_params: dict = None, concurrent_rrf: bool = False, sqlite_mmap_size: int = None, sqlite_shared_cache: bool = False, result_cache_mb: int = None, result_cache_path: str = None, fusion_params: dict = None, shards: int = None, shard_files: bool = False) -> object:
     """
     Factory function to get the appropriate searcher based on the database type.
     
@@ -29,18 +31,56 @@ def get_searcher(db_type: SearchDB, db_path: str = "database.db", db_name: str =
         db_path (str): Path to the database file for DuckDB and SQLite. Ignored for Postgres.
         db_name (str): Name of the database for Postgres. Ignored for DuckDB and SQLite.
         user (str): Username for Postgres. Ignored for DuckDB and SQLite.
+        read_only (bool): Open DuckDB and SQLite databases in read-only mode. Ignored for Postgres.
+        dense_matrices (list): Paths of dense matrices exported by an indexer, to search their tables with instead of the database.
+        impact_indexes (list): Paths of impact indexes exported by a DuckDB indexer, to search their tables with instead of the database.
+        ann_params (dict): Search time parameters of approximate nearest neighbor indexes, ef_search and probes.
+        concurrent_rrf (bool): Run the sparse and dense legs of hybrid searches concurrently, on separate connections.
+        sqlite_mmap_size (int): Bytes of an SQLite database to memory map. Ignored for other databases.
+        sqlite_shared_cache (bool): Share one page cache between the read-only connections to an SQLite database. Ignored for other databases.
+        result_cache_mb (int): Megabytes of search results to cache in memory. Setting it or result_cache_path enables the result cache.
+        result_cache_path (str): SQLite database to cache search results in on disk as well, shared between processes and runs.
+        fusion_params (dict): How hybrid search fuses its legs, method, weights and normalization, as for Searcher.set_fusion.
+        shards (int): Number of shards of the indexes to search, built by a ShardedIndexer, searched with a ShardedSearcher.
+        shard_files (bool): Whether every shard is a DuckDB database file of its own, named after db_path, as for ShardedIndexer.
     
     Returns:
         object: An instance of a searcher class corresponding to the specified database type.
     """
-    if db_type == SearchDB.DUCKDB:
-        return DuckDBSearcher(db_path)
+    if shards is not None and shards > 1:
+        searcher = get_shard_searcher(db_type, db_path, db_name, db_user, read_only, shards, shard_files)
+    elif db_type == SearchDB.DUCKDB:
+        searcher = DuckDBSearcher(db_path, read_only=read_only)
     elif db_type == SearchDB.SQLITE:
-        return SQLiteSearcher(db_path)
+        searcher = SQLiteSearcher(db_path, read_only=read_only, mmap_size=sqlite_mmap_size, shared_cache=sqlite_shared_cache)
     elif db_type == SearchDB.POSTGRES:
-        return PostgresSearcher(db_name, db_user)
+        searcher = PostgresSearcher(db_name, db_user)
     else:
         raise ValueError(f"Unsupported database type: {db_type}")
+    for path in dense_matrices or []:
+        searcher.attach_dense_matrix(path)
+    for path in impact_indexes or []:
+        searcher.attach_impact_index(path)
+    if ann_params:
+        searcher.set_ann_params(**ann_params)
+    searcher.set_concurrent_rrf(concurrent_rrf)
+    if fusion_params:
+        searcher.set_fusion(**fusion_params)
+    if result_cache_mb is not None or result_cache_path is not None:
+        cache_args = {"max_bytes": result_cache_mb * 1024 * 1024} if result_cache_mb is not None else {}
+        searcher.set_result_cache(ResultCache(path=result_cache_path, **cache_args))
+    return searcher
+
+def get_shard_searcher(db_type: SearchDB, db_path: str, db_name: str, db_user: str, read_only: bool, shards: int, shard_files: bool) -> ShardedSearcher:
+    """Opens a searcher per shard, over a database file of its own with shard_files and as a worker of one searcher otherwise."""
+    if db_type == SearchDB.SQLITE:
+        raise ValueError("SQLite indexes cannot be sharded, since FTS5 cannot score BM25 with the statistics of the whole corpus.")
+    if shard_files:
+        if db_type != SearchDB.DUCKDB:
+            raise ValueError("Only DuckDB shards can be kept in database files of their own.")
+        return ShardedSearcher([DuckDBSearcher(shard_db_path(db_path, shard), read_only=read_only) for shard in range(shards)], separate_files=True)
+    first = get_searcher(db_type, db_path=db_path, db_name=db_name, db_user=db_user, read_only=read_only)
+    return ShardedSearcher([first] + [first.worker() for _ in range(1, shards)])
 
 def _custom_sort_key(item):
     # The default sorting in DuckDB is string comparison, which does not put the IDs in numerical strictly increasing order 
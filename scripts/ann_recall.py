@@ -0,0 +1,45 @@
+import argparse
+import json
+import tempfile
+import time
+from quackir._base import _add_db_parser_arguments, _load_env
+from quackir.index._util import get_indexer
+from quackir.search._util import get_searcher
+from quackir.search._matrix import DenseMatrix
+
+def exact_results(args, queries):
+    # the exported matrix gives exact cosine similarity, regardless of any index on the table
+    indexer = get_indexer(db_type=args.db_type, db_path=args.db_path, db_name=args.db_name, db_user=args.db_user)
+    with tempfile.TemporaryDirectory() as path:
+        indexer.export_dense_matrix(args.index, path)
+        indexer.close()
+        matrix = DenseMatrix(path)
+        results = matrix.search([vector for _, vector in queries], top_n=args.hits)
+        del matrix
+    return [[doc_id for doc_id, _ in query_results] for query_results in results]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the recall of approximate nearest neighbor search against exact search, for a range of search time parameters.")
+    _add_db_parser_arguments(parser)
+    parser.add_argument("--index", type=str, default="corpus", help="Dense table with an approximate nearest neighbor index.")
+    parser.add_argument("--topics", type=str, required=True, help="Queries in jsonl format with the fields id and vector.")
+    parser.add_argument("--hits", type=int, default=10, help="Number of results to compare per query.")
+    parser.add_argument("--param", type=str, choices=["ef_search", "probes"], default="ef_search", help="Search time parameter to vary.")
+    parser.add_argument("--values", type=int, nargs='+', default=[None], help="Values of the parameter to report. Default is the database's default.")
+
+    args = parser.parse_args()
+    _load_env(args)
+    with open(args.topics, 'r') as f:
+        queries = [(q.get("id", q.get("qid")), q["vector"]) for q in map(json.loads, f)]
+    exact = exact_results(args, queries)
+
+    searcher = get_searcher(args.db_type, db_path=args.db_path, db_name=args.db_name, db_user=args.db_user, read_only=True)
+    for value in args.values:
+        searcher.set_ann_params(**{args.param: value})
+        start = time.perf_counter()
+        approximate = [searcher.embedding_search(vector, top_n=args.hits, table_name=args.index) for _, vector in queries]
+        elapsed = time.perf_counter() - start
+        found = sum(len(set(expected) & set(doc_id for doc_id, _ in results)) for expected, results in zip(exact, approximate))
+        recall = found / max(sum(len(expected) for expected in exact), 1)
+        print(f"{args.param}={value if value is not None else 'default'}: recall@{args.hits} {recall:.4f}, {len(queries) / elapsed:.1f} queries per second")
+    searcher.close()
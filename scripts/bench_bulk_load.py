@@ -0,0 +1,32 @@
+import argparse
+import time
+from quackir import IndexType, SearchDB
+from quackir.index._util import get_indexer
+
+def time_load(db_type, db_path, input_file, index_type, dimension, bulk):
+    indexer = get_indexer(db_type, db_path=db_path)
+    indexer.init_table("bench_load", index_type, dimension)
+    start = time.perf_counter()
+    indexer.load_table("bench_load", input_file, index_type, pretokenized=True, bulk=bulk)
+    elapsed = time.perf_counter() - start
+    rows = indexer.get_num_rows("bench_load")
+    indexer.init_table("bench_load", index_type, dimension)
+    indexer.close()
+    return rows, elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the native bulk loading path against inserting rows from Python.")
+    parser.add_argument("--input", type=str, required=True, help="Pretokenized jsonl corpus for sparse tables, or jsonl embeddings for dense tables.")
+    parser.add_argument("--index-type", type=IndexType, choices=list(IndexType), default=IndexType.SPARSE)
+    parser.add_argument("--dimension", type=int, default=768)
+    parser.add_argument("--db-types", type=SearchDB, choices=list(SearchDB), nargs='+', default=[SearchDB.DUCKDB, SearchDB.SQLITE])
+    parser.add_argument("--db-path", type=str, default="bench_load.db")
+
+    args = parser.parse_args()
+    for db_type in args.db_types:
+        if db_type == SearchDB.SQLITE and args.index_type != IndexType.SPARSE:
+            continue
+        db_path = f"{args.db_path}.{db_type.value}"
+        rows, row_time = time_load(db_type, db_path, args.input, args.index_type, args.dimension, bulk=False)
+        _, bulk_time = time_load(db_type, db_path, args.input, args.index_type, args.dimension, bulk=True)
+        print(f"{db_type.value}: {rows} rows, {rows / row_time:.0f} rows/s from Python, {rows / bulk_time:.0f} rows/s bulk, {row_time / bulk_time:.2f}x speedup")
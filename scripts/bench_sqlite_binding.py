@@ -0,0 +1,60 @@
+import argparse
+import json
+import statistics
+import time
+from quackir.analysis import tokenize_batch
+from quackir.search._sqlite import SQLiteSearcher
+
+def literal_fts_search(searcher, query_string, top_n, table_name):
+    # the match expression and the number of results spliced into the SQL text, as the searcher used to do
+    match = searcher.match_expression(query_string).replace("'", "''")
+    query = f"""
+    SELECT {table_name}.id, matches.score
+    FROM (
+        SELECT rowid, bm25(fts_{table_name})*-1 AS score
+        FROM fts_{table_name}
+        WHERE fts_{table_name} MATCH '{match}'
+        ORDER BY score DESC
+        LIMIT {top_n}
+    ) AS matches
+    JOIN {table_name} ON {table_name}.rowid = matches.rowid
+    ORDER BY matches.score DESC
+    """
+    return searcher.conn.execute(query).fetchall()
+
+def bound_fts_search(searcher, query_string, top_n, table_name):
+    return searcher.fts_search(query_string, top_n=top_n, table_name=table_name)
+
+def time_queries(search, searcher, query_strings, top_n, table_name):
+    for query_string in query_strings[:10]:
+        search(searcher, query_string, top_n, table_name)
+    latencies = []
+    for query_string in query_strings:
+        start = time.perf_counter()
+        search(searcher, query_string, top_n, table_name)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-query latency of SQLite sparse search with the query spliced into the SQL text and bound as parameters, and with a memory-mapped, shared-cache connection.")
+    parser.add_argument("--db-path", type=str, required=True, help="SQLite database with a sparse table and its FTS5 index.")
+    parser.add_argument("--index", type=str, default="corpus", help="Sparse table to search.")
+    parser.add_argument("--topics", type=str, required=True, help="Queries in jsonl format with the field contents.")
+    parser.add_argument("--pretokenized", action='store_true', default=False, help="Indicate if the queries are pretokenized.")
+    parser.add_argument("--hits", type=int, default=1000)
+    parser.add_argument("--mmap-size", type=int, default=1 << 30, help="Bytes to memory map for the memory-mapped connection.")
+
+    args = parser.parse_args()
+    with open(args.topics, 'r') as f:
+        query_strings = [json.loads(line)["contents"] for line in f]
+    if not args.pretokenized:
+        query_strings = tokenize_batch(query_strings)
+    runs = [
+        ("literal", literal_fts_search, SQLiteSearcher(args.db_path, read_only=True)),
+        ("bound", bound_fts_search, SQLiteSearcher(args.db_path, read_only=True)),
+        ("bound, mmap and shared cache", bound_fts_search, SQLiteSearcher(args.db_path, read_only=True, mmap_size=args.mmap_size, shared_cache=True))
+    ]
+    for name, search, searcher in runs:
+        latencies = time_queries(search, searcher, query_strings, args.hits, args.index)
+        print(f"{name}: mean {statistics.mean(latencies):.3f} ms, p50 {statistics.median(latencies):.3f} ms per query")
+        searcher.close()
@@ -0,0 +1,49 @@
+import argparse
+import json
+import statistics
+import time
+from quackir import SearchDB
+from quackir.search._util import get_searcher
+
+def literal_embedding_search(searcher, query_embedding, top_n, table_name):
+    # the query vector spliced into the SQL text, as the searcher used to do
+    query = f"""
+    SELECT id, array_cosine_similarity(embedding, array{query_embedding}::DOUBLE[{len(query_embedding)}]) AS score
+    FROM {table_name}
+    ORDER BY score DESC
+    LIMIT {top_n}
+    """
+    return searcher.conn.execute(query).fetchall()
+
+def bound_embedding_search(searcher, query_embedding, top_n, table_name):
+    return searcher.embedding_search(query_embedding, top_n=top_n, table_name=table_name)
+
+def time_queries(search, searcher, vectors, top_n, table_name):
+    search(searcher, vectors[0], top_n, table_name)
+    latencies = []
+    for vector in vectors:
+        start = time.perf_counter()
+        search(searcher, vector, top_n, table_name)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-query latency of DuckDB dense search with the query vector as a SQL literal and as a bound parameter.")
+    parser.add_argument("--db-path", type=str, required=True, help="DuckDB database with a dense table.")
+    parser.add_argument("--index", type=str, default="corpus", help="Dense table to search.")
+    parser.add_argument("--topics", type=str, required=True, help="Queries in jsonl format with the field vector.")
+    parser.add_argument("--hits", type=int, default=1000)
+    parser.add_argument("--empty", action='store_true', default=False, help="Search an empty copy of the table, so that only parsing and planning are timed.")
+
+    args = parser.parse_args()
+    with open(args.topics, 'r') as f:
+        vectors = [json.loads(line)["vector"] for line in f]
+    searcher = get_searcher(SearchDB.DUCKDB, db_path=args.db_path, read_only=True)
+    table_name = args.index
+    if args.empty:
+        searcher.conn.execute(f"CREATE TEMP TABLE empty_{table_name} AS SELECT * FROM {table_name} LIMIT 0")
+        table_name = f"empty_{table_name}"
+    for name, search in (("literal", literal_embedding_search), ("bound", bound_embedding_search)):
+        latencies = time_queries(search, searcher, vectors, args.hits, table_name)
+        print(f"{name}: mean {statistics.mean(latencies):.2f} ms, p50 {statistics.median(latencies):.2f} ms per query")
+    searcher.close()
@@ -0,0 +1,41 @@
+import argparse
+import gzip
+import time
+from itertools import islice
+from quackir.analysis._porter import PorterAnalyzer
+from quackir.analysis._files import read_json_file, read_tsv_file
+
+def read_entries(input_file, limit):
+    open_cmd = gzip.open if input_file.endswith('.gz') else open
+    with open_cmd(input_file, 'rt') as f:
+        entries = read_json_file(f) if '.jsonl' in input_file else read_tsv_file(f)
+        return list(islice(entries, limit))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the pure Python analyzer against Pyserini's Lucene analyzer, token for token.")
+    parser.add_argument("--input", type=str, required=True, help="Corpus or queries in jsonl or tsv format, as accepted by quackir.analysis.")
+    parser.add_argument("--limit", type=int, default=None, help="Number of entries to compare. Default is all of them.")
+    parser.add_argument("--show", type=int, default=10, help="Number of mismatching entries to print.")
+
+    args = parser.parse_args()
+    from pyserini.analysis import Analyzer, get_lucene_analyzer
+    lucene = Analyzer(get_lucene_analyzer())
+    python = PorterAnalyzer()
+    entries = read_entries(args.input, args.limit)
+
+    start = time.perf_counter()
+    lucene_tokens = [lucene.analyze(content) for _, content in entries]
+    lucene_time = time.perf_counter() - start
+    start = time.perf_counter()
+    python_tokens = [python.analyze(content) for _, content in entries]
+    python_time = time.perf_counter() - start
+
+    mismatches = 0
+    for (id, _), expected, actual in zip(entries, lucene_tokens, python_tokens):
+        if list(expected) == actual:
+            continue
+        mismatches += 1
+        if mismatches <= args.show:
+            print(f"{id}: lucene only {sorted(set(expected) - set(actual))}, python only {sorted(set(actual) - set(expected))}")
+    print(f"{mismatches} of {len(entries)} entries differ ({mismatches / max(len(entries), 1):.4%})")
+    print(f"lucene: {lucene_time:.2f}s, python: {python_time:.2f}s")
@@ -0,0 +1,53 @@
+import argparse
+import json
+from quackir import SearchDB
+from quackir.analysis import tokenize_batch
+from quackir.search._util import get_searcher
+
+def compare(searcher, query_ids, query_strings, hits, table_name, show):
+    single = [searcher.fts_search(query_string, top_n=hits, table_name=table_name) for query_string in query_strings]
+    batch = searcher.batch_fts_search(query_strings, top_n=hits, table_name=table_name)
+    mismatches = 0
+    max_score_diff = 0.0
+    for query_id, single_results, batch_results in zip(query_ids, single, batch):
+        if len(single_results) == len(batch_results):
+            max_score_diff = max([max_score_diff] + [abs(s[1] - b[1]) for s, b in zip(single_results, batch_results)])
+        if [doc_id for doc_id, _ in single_results] == [doc_id for doc_id, _ in batch_results]:
+            continue
+        mismatches += 1
+        if mismatches <= show:
+            print(f"{query_id}: single {single_results[:3]}..., batch {batch_results[:3]}...")
+    return mismatches, max_score_diff
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that batched sparse search returns the same results, in the same order, as searching one query at a time, ties and zero-score padding included, in every database given.")
+    parser.add_argument("--duckdb-path", type=str, default=None, help="DuckDB database with a sparse table and its full text search index.")
+    parser.add_argument("--sqlite-path", type=str, default=None, help="SQLite database with a sparse table and its FTS5 index.")
+    parser.add_argument("--db-name", type=str, default=None, help="PostgreSQL database with a sparse table and its BM25 index.")
+    parser.add_argument("--db-user", type=str, default="postgres")
+    parser.add_argument("--index", type=str, default="corpus", help="Sparse table to search.")
+    parser.add_argument("--topics", type=str, required=True, help="Queries in jsonl format with the field contents.")
+    parser.add_argument("--pretokenized", action='store_true', default=False, help="Indicate if the queries are pretokenized.")
+    parser.add_argument("--hits", type=int, nargs='+', default=[10, 1000], help="Result sizes to compare, some larger than the number of matches to cover padding.")
+    parser.add_argument("--show", type=int, default=10, help="Number of mismatching queries to print.")
+
+    args = parser.parse_args()
+    databases = [(db_type, path) for db_type, path in [(SearchDB.DUCKDB, args.duckdb_path), (SearchDB.SQLITE, args.sqlite_path), (SearchDB.POSTGRES, args.db_name)] if path]
+    if not databases:
+        parser.error("Give at least one of --duckdb-path, --sqlite-path and --db-name.")
+    with open(args.topics, 'r') as f:
+        queries = [(q.get("id", q.get("qid")), q["contents"]) for q in map(json.loads, f)]
+    query_ids = [id for id, _ in queries]
+    query_strings = [contents for _, contents in queries]
+    if not args.pretokenized:
+        query_strings = tokenize_batch(query_strings)
+
+    for db_type, path in databases:
+        if db_type == SearchDB.POSTGRES:
+            searcher = get_searcher(db_type, db_name=path, db_user=args.db_user)
+        else:
+            searcher = get_searcher(db_type, db_path=path, read_only=True)
+        for hits in args.hits:
+            mismatches, max_score_diff = compare(searcher, query_ids, query_strings, hits, args.index, args.show)
+            print(f"{db_type.value}, hits {hits}: {mismatches} of {len(queries)} queries ranked differently, max score difference {max_score_diff:.2e}")
+        searcher.close()
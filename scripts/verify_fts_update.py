@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import tempfile
+from quackir import SearchDB, IndexType, UpdateMode
+from quackir.analysis import tokenize_batch
+from quackir.index._util import get_indexer
+from quackir.search._util import get_searcher
+
+def write_jsonl(path, docs):
+    with open(path, 'w') as f:
+        f.write(''.join(json.dumps(doc) + "\n" for doc in docs))
+
+def same_top_k(expected, actual, tolerance=1e-9):
+    # scores are summed over terms in no particular order, and documents tied with the last score can be cut off either way
+    if len(expected) != len(actual):
+        return False
+    if any(abs(e[1] - a[1]) > tolerance for e, a in zip(expected, actual)):
+        return False
+    cutoff = expected[-1][1] + tolerance if expected else 0
+    return {id for id, score in expected if score > cutoff} == {id for id, score in actual if score > cutoff}
+
+def fts_state(indexer, table_name):
+    # docids and termids depend on the order documents were indexed in, so the tables are compared by name and term
+    fts_schema = f"fts_main_{table_name}"
+    return {
+        "stats": indexer.conn.execute(f"SELECT num_docs, avgdl FROM {fts_schema}.stats").fetchall(),
+        "dict": dict(indexer.conn.execute(f"SELECT term, df FROM {fts_schema}.dict").fetchall()),
+        "docs": dict(indexer.conn.execute(f"SELECT name, len FROM {fts_schema}.docs").fetchall()),
+        "terms": sorted(indexer.conn.execute(f"""
+            SELECT docs.name, dict.term, COUNT(*)
+            FROM {fts_schema}.terms AS terms
+            JOIN {fts_schema}.docs AS docs ON docs.docid = terms.docid
+            JOIN {fts_schema}.dict AS dict ON dict.termid = terms.termid
+            GROUP BY docs.name, dict.term
+        """).fetchall()),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare a DuckDB full text search index updated in place by appends, upserts and deletes against one rebuilt by fts_index over the same rows.")
+    parser.add_argument("--corpus", type=str, required=True, help="Corpus in jsonl format with the fields id and contents.")
+    parser.add_argument("--topics", type=str, required=True, help="Queries in jsonl format with the field contents.")
+    parser.add_argument("--pretokenized", action='store_true', default=False, help="Indicate if the corpus and queries are pretokenized.")
+    parser.add_argument("--hits", type=int, default=100)
+
+    args = parser.parse_args()
+    with open(args.corpus, 'r') as f:
+        docs = [json.loads(line) for line in f if line.strip()]
+    with open(args.topics, 'r') as f:
+        query_strings = [json.loads(line)["contents"] for line in f]
+    if not args.pretokenized:
+        query_strings = tokenize_batch(query_strings)
+
+    # the first half is indexed at once, the second half appended, a tenth of the rows replaced by the contents of others, and a tenth deleted
+    half = len(docs) // 2
+    upserted = [{"id": doc["id"], "contents": docs[-1 - i]["contents"]} for i, doc in enumerate(docs[:len(docs) // 10])]
+    deleted = [doc["id"] for doc in docs[half:half + len(docs) // 10]]
+
+    with tempfile.TemporaryDirectory() as path:
+        db_path = os.path.join(path, "duck.db")
+        write_jsonl(os.path.join(path, "base.jsonl"), docs[:half])
+        write_jsonl(os.path.join(path, "appended.jsonl"), docs[half:])
+        write_jsonl(os.path.join(path, "upserted.jsonl"), upserted)
+        indexer = get_indexer(SearchDB.DUCKDB, db_path=db_path)
+        indexer.init_table("updated", IndexType.SPARSE)
+        indexer.load_table("updated", os.path.join(path, "base.jsonl"), IndexType.SPARSE, args.pretokenized)
+        indexer.fts_index("updated")
+        indexer.load_table("updated", os.path.join(path, "appended.jsonl"), IndexType.SPARSE, args.pretokenized, update=UpdateMode.APPEND)
+        indexer.load_table("updated", os.path.join(path, "upserted.jsonl"), IndexType.SPARSE, args.pretokenized, update=UpdateMode.UPSERT)
+        indexer.delete_rows("updated", deleted)
+        try:
+            indexer.load_table("updated", os.path.join(path, "upserted.jsonl"), IndexType.SPARSE, args.pretokenized, update=UpdateMode.APPEND)
+            print("appending existing ids was not refused")
+        except ValueError as e:
+            print(f"appending existing ids refused: {e}")
+
+        # the same rows, indexed from scratch
+        indexer.conn.execute("CREATE TABLE rebuilt AS SELECT id, contents FROM updated")
+        indexer.fts_index("rebuilt")
+        updated_state = fts_state(indexer, "updated")
+        rebuilt_state = fts_state(indexer, "rebuilt")
+        indexer.close()
+        for name in rebuilt_state:
+            print(f"{name}: {'same' if updated_state[name] == rebuilt_state[name] else 'DIFFERENT'}")
+
+        searcher = get_searcher(SearchDB.DUCKDB, db_path=db_path, read_only=True)
+        mismatches = 0
+        for query_string in query_strings:
+            updated = searcher.fts_search(query_string, top_n=args.hits, table_name="updated")
+            rebuilt = searcher.fts_search(query_string, top_n=args.hits, table_name="rebuilt")
+            if not same_top_k(rebuilt, updated):
+                mismatches += 1
+        searcher.close()
+    print(f"{mismatches} of {len(query_strings)} queries differ")
@@ -0,0 +1,56 @@
+import argparse
+import json
+import tempfile
+import time
+from quackir import SearchDB
+from quackir.analysis import tokenize_batch
+from quackir.index._util import get_indexer
+from quackir.search._util import get_searcher
+from quackir.search._impact import ImpactIndex
+
+def same_ranking(expected, actual, tolerance=1e-9):
+    # ties are broken by id on both sides, so the ranked ids must agree exactly, and the scores up to rounding
+    if [id for id, _ in expected] != [id for id, _ in actual]:
+        return False
+    return all(abs(e[1] - a[1]) <= tolerance for e, a in zip(expected, actual))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare sparse search answered from an impact index against DuckDB's match_bm25, query for query.")
+    parser.add_argument("--db-path", type=str, required=True, help="DuckDB database with a sparse table and its full text search index.")
+    parser.add_argument("--index", type=str, default="corpus", help="Sparse table to search.")
+    parser.add_argument("--topics", type=str, required=True, help="Queries in jsonl format with the field contents.")
+    parser.add_argument("--pretokenized", action='store_true', default=False, help="Indicate if the queries are pretokenized.")
+    parser.add_argument("--hits", type=int, default=1000)
+    parser.add_argument("--show", type=int, default=10, help="Number of mismatching queries to print.")
+
+    args = parser.parse_args()
+    with open(args.topics, 'r') as f:
+        queries = [(q.get("id", q.get("qid")), q["contents"]) for q in map(json.loads, f)]
+    query_strings = [contents for _, contents in queries]
+    if not args.pretokenized:
+        query_strings = tokenize_batch(query_strings)
+
+    with tempfile.TemporaryDirectory() as path:
+        indexer = get_indexer(SearchDB.DUCKDB, db_path=args.db_path)
+        indexer.export_impact_index(args.index, path)
+        indexer.close()
+        searcher = get_searcher(SearchDB.DUCKDB, db_path=args.db_path, read_only=True)
+        start = time.perf_counter()
+        expected = [searcher.fts_search(query_string, top_n=args.hits, table_name=args.index) for query_string in query_strings]
+        duckdb_time = time.perf_counter() - start
+        searcher.close()
+        index = ImpactIndex(path)
+        start = time.perf_counter()
+        actual = [index.search_one(query_string, top_n=args.hits) for query_string in query_strings]
+        impact_time = time.perf_counter() - start
+        del index
+
+    mismatches = 0
+    for (id, _), expected_results, actual_results in zip(queries, expected, actual):
+        if same_ranking(expected_results, actual_results):
+            continue
+        mismatches += 1
+        if mismatches <= args.show:
+            print(f"{id}: duckdb {expected_results[:3]}..., impact index {actual_results[:3]}...")
+    print(f"{mismatches} of {len(queries)} queries differ")
+    print(f"duckdb: {len(queries) / duckdb_time:.1f} queries per second, impact index: {len(queries) / impact_time:.1f} queries per second")